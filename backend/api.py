@@ -1,15 +1,27 @@
 import os
+import time
 import uuid
+import hashlib
 import asyncio
+import zipfile
 from pathlib import Path
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from sse_starlette.sse import EventSourceResponse
-import json
-from typing import Dict
-from workflow import stream_pdf_summaries
-from encryption import encrypt_file, is_encrypted_file
+from typing import AsyncIterator, BinaryIO, List, Optional
+from workflow import is_known_document, forget_checkpoints, close_checkpoints, cpu_pool
+from encryption import StreamEncryptor, is_encrypted_file
+from scheduler import parse_priority
+from jobs import job_store, STATUS_UPLOADED
+from batches import (
+    BATCH_MAX_DOCUMENTS, new_batch_id, resolve_directory, iter_documents, create_batch, get_batch, batch_progress
+)
+from bus import event_bus
+from worker import JOB_WORKERS, start_workers, stop_workers
+from transport import encode_event, coalesce, SSE_PING_SECONDS
+from metrics import metrics
+import pagestore
 
 
 app = FastAPI(title="DocVeil API", version="1.0.0")
@@ -24,8 +36,38 @@ app.add_middleware(
 
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+workers = []
+
+
+def _purge_expired_uploads() -> None:
+    # Expired jobs disappear from the store on their own; their encrypted
+    # uploads are removed here once nothing refers to them any more.
+    job_store.purge_expired()
+    event_bus.purge_expired()
+    metrics.purge_expired(job_store.ttl)
+    pagestore.purge_expired(job_store.ttl, keep=lambda job_id: job_store.get(job_id) is not None)
+    cutoff = time.time() - job_store.ttl
+    for path in UPLOAD_DIR.glob("*.enc"):
+        if path.stat().st_mtime < cutoff and job_store.get(path.stem) is None:
+            path.unlink(missing_ok=True)
+            print(f"Removed expired upload {path.name}")
+
+
+@app.on_event("startup")
+async def purge_on_startup():
+    _purge_expired_uploads()
+    # Summaries are produced by background worker processes, not by the SSE
+    # request. Set JOB_WORKERS=0 when they run separately (python worker.py).
+    workers.extend(start_workers(JOB_WORKERS))
+
 
-active_jobs: Dict[str, dict] = {}
+@app.on_event("shutdown")
+async def close_on_shutdown():
+    stop_workers(workers)
+    workers.clear()
+    await close_checkpoints()
 
 
 @app.get("/")
@@ -37,123 +79,273 @@ async def root():
     }
 
 
-@app.post("/upload")
-async def upload_pdf(file: UploadFile = File(...)):
-    if not file.filename.endswith('.pdf'):
+async def _iter_upload_file(file: UploadFile) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def _iter_binary_file(f: BinaryIO) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    while True:
+        chunk = await loop.run_in_executor(cpu_pool, f.read, UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def _store_upload(
+    chunks: AsyncIterator[bytes], filename: str, priority: str, pipelined: Optional[bool],
+    stream_tokens: Optional[bool],
+) -> dict:
+    if not filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
     
+    try:
+        job_priority = parse_priority(priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    _purge_expired_uploads()
+    return await _store_document(chunks, filename, job_priority, pipelined, stream_tokens)
+
+
+async def _store_document(
+    chunks: AsyncIterator[bytes], filename: str, job_priority: int, pipelined: Optional[bool],
+    stream_tokens: Optional[bool], batch_id: Optional[str] = None,
+) -> dict:
     job_id = str(uuid.uuid4())
     
-    temp_path = UPLOAD_DIR / f"{job_id}_temp.pdf"
     encrypted_path = UPLOAD_DIR / f"{job_id}.enc"
     
+    loop = asyncio.get_running_loop()
+    encryptor = None
     try:
-        content = await file.read()
-        with open(temp_path, "wb") as f:
-            f.write(content)
+        # Encrypt chunk by chunk so neither the plaintext nor a full copy of
+        # the document is ever held in memory or written to disk.
+        encryptor = await loop.run_in_executor(cpu_pool, StreamEncryptor, str(encrypted_path))
+        digest = hashlib.sha256()
+        async for chunk in chunks:
+            digest.update(chunk)
+            await loop.run_in_executor(cpu_pool, encryptor.write, chunk)
+        await loop.run_in_executor(cpu_pool, encryptor.close)
         
-        encrypt_file(str(temp_path), str(encrypted_path))
+        fingerprint = digest.hexdigest()
+        duplicate = is_known_document(fingerprint)
         
-        temp_path.unlink()
-        
-        active_jobs[job_id] = {
-            'filename': file.filename,
+        job_store.create(job_id, {
+            'filename': filename,
             'path': str(encrypted_path),
-            'status': 'uploaded'
-        }
+            'priority': job_priority,
+            'fingerprint': fingerprint,
+            'pipelined': pipelined,
+            'stream_tokens': stream_tokens,
+            'batch_id': batch_id,
+            'status': STATUS_UPLOADED
+        })
         
-        print(f"Uploaded and encrypted PDF: {file.filename} (Job ID: {job_id})")
+        print(f"Uploaded and encrypted PDF: {filename} (Job ID: {job_id})")
         
         return {
             'job_id': job_id,
-            'filename': file.filename,
+            'filename': filename,
+            'duplicate': duplicate,
             'message': 'PDF uploaded and encrypted successfully'
         }
     
     except Exception as e:
-        if temp_path.exists():
-            temp_path.unlink()
+        if encryptor is not None:
+            encryptor.abort()
         if encrypted_path.exists():
             encrypted_path.unlink()
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 
+@app.post("/upload")
+async def upload_pdf(
+    file: UploadFile = File(...), priority: str = 'interactive', pipelined: Optional[bool] = None,
+    stream_tokens: Optional[bool] = None,
+):
+    return await _store_upload(_iter_upload_file(file), file.filename, priority, pipelined, stream_tokens)
+
+
+@app.post("/upload-stream")
+async def upload_pdf_stream(
+    request: Request, filename: str, priority: str = 'interactive', pipelined: Optional[bool] = None,
+    stream_tokens: Optional[bool] = None,
+):
+    # Raw request body instead of multipart: the multipart parser spools large
+    # files to a plaintext temp file, this path encrypts straight off the socket.
+    return await _store_upload(request.stream(), filename, priority, pipelined, stream_tokens)
+
+
+
+@app.post("/batch")
+async def upload_batch(
+    files: List[UploadFile] = File(None), directory: Optional[str] = None, priority: str = 'bulk',
+    pipelined: Optional[bool] = None,
+):
+    # Many documents in one request: PDFs, zip archives of PDFs, and/or a
+    # directory on the server. Each document becomes an ordinary job; workers
+    # share the LLM queue between all of them (see WORKER_MAX_JOBS).
+    if not files and directory is None:
+        raise HTTPException(status_code=400, detail="Send files or a directory")
+    try:
+        job_priority = parse_priority(priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        root = resolve_directory(directory) if directory is not None else None
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    _purge_expired_uploads()
+    batch_id = new_batch_id()
+    job_ids, skipped = [], []
+    uploads = [(file.filename, file.file) for file in files or []]
+    documents = iter_documents(uploads, root, skipped)
+    loop = asyncio.get_running_loop()
+    try:
+        # Walking a directory tree or a zip index blocks, so each step runs
+        # in the pool; the loop keeps serving other requests meanwhile.
+        while True:
+            document = await loop.run_in_executor(cpu_pool, next, documents, None)
+            if document is None:
+                break
+            filename, f = document
+            if len(job_ids) >= BATCH_MAX_DOCUMENTS:
+                raise HTTPException(status_code=413, detail=f"More than {BATCH_MAX_DOCUMENTS} documents in one batch")
+            stored = await _store_document(_iter_binary_file(f), filename, job_priority, pipelined, False, batch_id)
+            job_ids.append(stored['job_id'])
+    except (HTTPException, zipfile.BadZipFile) as e:
+        # Nothing half-submitted is left running.
+        for job_id in job_ids:
+            await _cleanup(job_id)
+        if isinstance(e, zipfile.BadZipFile):
+            raise HTTPException(status_code=400, detail=f"Invalid zip archive: {e}")
+        raise
+    finally:
+        documents.close()
+
+    create_batch(batch_id, job_ids, skipped, job_priority)
+    print(f"Queued batch {batch_id}: {len(job_ids)} documents, {len(skipped)} skipped")
+
+    return {
+        'batch_id': batch_id,
+        'documents': len(job_ids),
+        'job_ids': job_ids,
+        'skipped': skipped,
+        'message': 'Batch uploaded and encrypted successfully'
+    }
+
+
+@app.get("/batch/{batch_id}")
+async def get_batch_status(batch_id: str):
+    progress = batch_progress(batch_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return progress
+
+
+@app.delete("/batch/{batch_id}")
+async def cleanup_batch(batch_id: str):
+    batch = get_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    for job_id in batch['jobs']:
+        await _cleanup(job_id)
+    job_store.delete(batch_id)
+
+    print(f"Cleaned up batch {batch_id}")
+
+    return {'message': 'Batch cleaned up successfully'}
+
 
 @app.get("/stream-summary/{job_id}")
-async def stream_summary(job_id: str):
-    if job_id not in active_jobs:
+async def stream_summary(job_id: str, last_event_id: Optional[str] = Header(None)):
+    if job_store.get(job_id) is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    job = active_jobs[job_id]
-    pdf_path = job['path']
-    
-    if not Path(pdf_path).exists():
-        raise HTTPException(status_code=404, detail="PDF file not found")
+    # Page events carry their page number as the SSE id, so a reconnecting
+    # EventSource tells us how far it got.
+    try:
+        after_page = int(last_event_id) if last_event_id else 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
     
     async def event_generator():
-        try:
-            job['status'] = 'processing'
-            
-            async for summary_data in stream_pdf_summaries(pdf_path):
-
-                event_data = json.dumps(summary_data)
-                yield {
-                    "event": "summary",
-                    "data": event_data
-                }
-                
-                await asyncio.sleep(0.1)
-                
-                if summary_data['status'] == 'complete':
-                    job['status'] = 'complete'
-                    break
-            
-            print(f"Completed streaming job {job_id}")
-            
-        except Exception as e:
-            print(f"Error in job {job_id}: {str(e)}")
-            error_data = json.dumps({
-                'error': str(e),
-                'status': 'error'
-            })
-            yield {
-                "event": "error",
-                "data": error_data
-            }
-            job['status'] = 'error'
+        # Any number of clients can attach; each one replays the job's events
+        # from the bus and then follows new ones until the job finishes.
+        async for event in event_bus.subscribe(job_id, is_alive=lambda: job_store.get(job_id) is not None):
+            summary_data = event['data']
+            if summary_data.get('status') in ('processing', 'delta') and summary_data['page'] <= after_page:
+                continue
+
+            event_id = str(summary_data['page']) if summary_data.get('status') == 'processing' else None
+            yield encode_event(event['event'], summary_data, event_id)
+        
+        print(f"Completed streaming job {job_id}")
     
-    return EventSourceResponse(event_generator())
+    # Events that arrive close together are written in one chunk, and idle
+    # connections are kept open by the transport's ping comments.
+    return EventSourceResponse(coalesce(event_generator()), ping=SSE_PING_SECONDS)
 
 
 @app.get("/status/{job_id}")
 async def get_job_status(job_id: str):
 
-    if job_id not in active_jobs:
+    job = job_store.get(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    job = active_jobs[job_id]
     return {
         'job_id': job_id,
         'status': job['status'],
-        'filename': job['filename']
+        'filename': job['filename'],
+        'pages_done': job.get('pages_done', 0),
+        # Reported by the worker running the job (see worker._heartbeat).
+        'queue_position': job.get('queue_position'),
+        'queued_requests': job.get('queued_requests', 0),
+        'running_requests': job.get('running_requests', 0),
+        'cache': job.get('cache', {'hits': 0, 'misses': 0}),
+        # Seconds and call counts per stage, plus LLM token counts.
+        'timings': job.get('timings', {'stages': {}, 'tokens': {}})
     }
 
 
-@app.delete("/cleanup/{job_id}")
-async def cleanup_job(job_id: str):
- 
-    if job_id not in active_jobs:
-        raise HTTPException(status_code=404, detail="Job not found")
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Prometheus scrape target covering the API and all worker processes.
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+async def _cleanup(job_id: str) -> bool:
+    job = job_store.delete(job_id)
+    if job is None:
+        return False
     
-    job = active_jobs[job_id]
     pdf_path = Path(job['path'])
     
     if pdf_path.exists():
         pdf_path.unlink()
     
-    del active_jobs[job_id]
+    event_bus.forget(job_id)
+    await forget_checkpoints(job_id)
     
     print(f"Cleaned up job {job_id}")
+    return True
+
+
+@app.delete("/cleanup/{job_id}")
+async def cleanup_job(job_id: str):
+ 
+    if not await _cleanup(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
     
     return {'message': 'Job cleaned up successfully'}
 
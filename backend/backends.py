@@ -0,0 +1,329 @@
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_MODEL = os.getenv("LLM_MODEL", "llama3.1:8b")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.3"))
+# Comma-separated base URLs. Plain URLs are Ollama servers; prefix a URL with
+# "openai+" for an OpenAI-compatible server (vLLM, llama.cpp, LM Studio...).
+# LLM_ENDPOINTS_FILE (JSON list of endpoint objects) takes precedence.
+LLM_ENDPOINTS = os.getenv("LLM_ENDPOINTS", os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434"))
+LLM_ENDPOINTS_FILE = os.getenv("LLM_ENDPOINTS_FILE")
+# Model tiering: page drafts can run on a smaller, faster model than the
+# refine stage, and on other servers. The fallback model is tried when every
+# endpoint of a stage has failed a call.
+LLM_DRAFT_MODEL = os.getenv("LLM_DRAFT_MODEL", LLM_MODEL)
+LLM_REFINE_MODEL = os.getenv("LLM_REFINE_MODEL", LLM_MODEL)
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "")
+LLM_DRAFT_ENDPOINTS = os.getenv("LLM_DRAFT_ENDPOINTS", LLM_ENDPOINTS)
+LLM_REFINE_ENDPOINTS = os.getenv("LLM_REFINE_ENDPOINTS", LLM_ENDPOINTS)
+LLM_ENDPOINT_CONCURRENCY = int(os.getenv("LLM_ENDPOINT_CONCURRENCY", "2"))
+# A failed endpoint is skipped for this long, doubling per consecutive
+# failure up to LLM_RETRY_MAX_SECONDS, then health-checked before reuse.
+LLM_RETRY_SECONDS = float(os.getenv("LLM_RETRY_SECONDS", "5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "120"))
+LLM_HEALTH_TIMEOUT = float(os.getenv("LLM_HEALTH_TIMEOUT", "2"))
+
+KIND_OLLAMA = 'ollama'
+KIND_OPENAI = 'openai'
+
+STAGE_DRAFT = 'draft'
+STAGE_REFINE = 'refine'
+
+
+class NoBackendAvailable(RuntimeError):
+    pass
+
+
+def _chat_model(kind: str, url: str, model: str, temperature: float, api_key: Optional[str]) -> BaseChatModel:
+    if kind == KIND_OLLAMA:
+        from langchain_ollama import ChatOllama
+        return ChatOllama(base_url=url, model=model, temperature=temperature)
+    if kind == KIND_OPENAI:
+        try:
+            from langchain_openai import ChatOpenAI
+        except ImportError as e:
+            raise ImportError("OpenAI-compatible endpoints require 'langchain-openai': pip install langchain-openai") from e
+        return ChatOpenAI(base_url=url, model=model, temperature=temperature, api_key=api_key or "unused")
+    raise ValueError(f"Unknown endpoint kind '{kind}', expected '{KIND_OLLAMA}' or '{KIND_OPENAI}'")
+
+
+class Endpoint:
+    def __init__(self, url: str, kind: str = KIND_OLLAMA, model: str = LLM_MODEL,
+                 temperature: float = LLM_TEMPERATURE, max_concurrency: int = LLM_ENDPOINT_CONCURRENCY,
+                 api_key: Optional[str] = None, client: Optional[BaseChatModel] = None):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.url = url.rstrip('/')
+        self.kind = kind
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.api_key = api_key
+        self.client = client or _chat_model(kind, self.url, model, temperature, api_key)
+        self.outstanding = 0
+        self.served = 0
+        self.failures = 0
+        self.down_until = 0.0
+
+    def available(self, now: float) -> bool:
+        return self.failures == 0 or now >= self.down_until
+
+    def mark_failed(self, error: BaseException) -> None:
+        self.failures += 1
+        backoff = min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_SECONDS * 2 ** (self.failures - 1))
+        self.down_until = time.monotonic() + backoff
+        print(f"LLM endpoint {self.url} failed ({error!r}), retrying it in {backoff:.0f}s")
+
+    def mark_ok(self) -> None:
+        if self.failures:
+            print(f"LLM endpoint {self.url} is back")
+        self.failures = 0
+        self.served += 1
+
+    async def check(self) -> bool:
+        path = '/api/tags' if self.kind == KIND_OLLAMA else '/models'
+        headers = {'Authorization': f"Bearer {self.api_key}"} if self.api_key else {}
+        try:
+            async with httpx.AsyncClient(timeout=LLM_HEALTH_TIMEOUT) as client:
+                response = await client.get(self.url + path, headers=headers)
+            return response.status_code < 500
+        except httpx.HTTPError:
+            return False
+
+    def status(self) -> Dict:
+        return {
+            'url': self.url,
+            'kind': self.kind,
+            'model': self.model,
+            'outstanding': self.outstanding,
+            'max_concurrency': self.max_concurrency,
+            'served': self.served,
+            'healthy': self.failures == 0,
+        }
+
+
+class BackendPool(BaseChatModel):
+    # Chat model that spreads calls over several servers running the same
+    # model: each call goes to the healthy endpoint with the fewest calls in
+    # flight, below that endpoint's own concurrency cap. A call that fails
+    # before producing output is retried on another endpoint, and then on
+    # the fallback model if there is one.
+
+    model: str = LLM_MODEL
+    temperature: float = LLM_TEMPERATURE
+    fallback: Optional[BaseChatModel] = None
+    _endpoints: List[Endpoint] = PrivateAttr(default_factory=list)
+    _waiters: Deque[asyncio.Future] = PrivateAttr(default_factory=deque)
+
+    def __init__(self, endpoints: List[Endpoint], **kwargs):
+        if not endpoints:
+            raise ValueError("BackendPool needs at least one endpoint")
+        super().__init__(**kwargs)
+        self._endpoints = list(endpoints)
+
+    @property
+    def _llm_type(self) -> str:
+        return "docveil-pool"
+
+    @property
+    def endpoints(self) -> List[Endpoint]:
+        return self._endpoints
+
+    @property
+    def primary(self) -> BaseChatModel:
+        return self._endpoints[0].client
+
+    @property
+    def capacity(self) -> int:
+        return sum(endpoint.max_concurrency for endpoint in self._endpoints)
+
+    def status(self) -> List[Dict]:
+        return [endpoint.status() for endpoint in self._endpoints]
+
+    def _pick(self, exclude) -> Optional[Endpoint]:
+        now = time.monotonic()
+        candidates = [
+            endpoint for endpoint in self._endpoints
+            if endpoint not in exclude and endpoint.available(now) and endpoint.outstanding < endpoint.max_concurrency
+        ]
+        return min(candidates, key=lambda endpoint: endpoint.outstanding, default=None)
+
+    async def _acquire(self, exclude) -> Endpoint:
+        loop = asyncio.get_running_loop()
+        while True:
+            now = time.monotonic()
+            remaining = [endpoint for endpoint in self._endpoints if endpoint not in exclude]
+            if not remaining or (self.fallback is not None and not any(endpoint.available(now) for endpoint in remaining)):
+                # With a fallback model, use it rather than queue behind
+                # servers that are down. Without one, wait out the back-off
+                # below: one transient error must not fail every queued call.
+                # A wakeup this call may have been given goes to the next.
+                self._wake()
+                raise NoBackendAvailable(f"No healthy LLM endpoint for {self.model}")
+            endpoint = self._pick(exclude)
+            if endpoint is not None:
+                endpoint.outstanding += 1
+                try:
+                    healthy = not endpoint.failures or await endpoint.check()
+                except BaseException:
+                    # Cancelled mid-check: the slot is still ours to give back.
+                    self._release(endpoint)
+                    raise
+                if not healthy:
+                    self._release(endpoint)
+                    endpoint.mark_failed(ConnectionError("health check failed"))
+                    continue
+                return endpoint
+
+            # Every usable endpoint is at its cap: wait for a release, or until
+            # a down endpoint may be tried again.
+            retry_at = [endpoint.down_until for endpoint in remaining if not endpoint.available(now)]
+            future = loop.create_future()
+            self._waiters.append(future)
+            try:
+                await asyncio.wait([future], timeout=max(0.0, min(retry_at) - now) if retry_at else None)
+            except BaseException:
+                # Woken by a release and cancelled before using it: pass the
+                # wakeup on, or the next waiter sleeps through a free slot.
+                if future.done() and not future.cancelled():
+                    self._wake()
+                raise
+            finally:
+                if not future.done():
+                    future.cancel()
+
+    def _release(self, endpoint: Endpoint) -> None:
+        endpoint.outstanding -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+
+    async def _agenerate_balanced(self, messages, stop=None, **kwargs) -> ChatResult:
+        tried = set()
+        while True:
+            endpoint = await self._acquire(tried)
+            try:
+                result = await endpoint.client._agenerate(messages, stop=stop, **kwargs)
+            except Exception as e:
+                endpoint.mark_failed(e)
+                tried.add(endpoint)
+                if len(tried) == len(self._endpoints):
+                    raise
+                continue
+            finally:
+                self._release(endpoint)
+            endpoint.mark_ok()
+            return result
+
+    async def _astream_balanced(self, messages, stop=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        tried = set()
+        while True:
+            endpoint = await self._acquire(tried)
+            started = False
+            try:
+                async for chunk in endpoint.client._astream(messages, stop=stop, **kwargs):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                endpoint.mark_failed(e)
+                tried.add(endpoint)
+                # Output already handed to the caller cannot be taken back.
+                if started or len(tried) == len(self._endpoints):
+                    raise
+                continue
+            finally:
+                self._release(endpoint)
+            endpoint.mark_ok()
+            return
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        try:
+            return await self._agenerate_balanced(messages, stop, **kwargs)
+        except Exception:
+            if self.fallback is None:
+                raise
+        print(f"All {self.model} endpoints failed, using fallback model {self.fallback.model}")
+        return await self.fallback._agenerate(messages, stop=stop, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        started = False
+        try:
+            async for chunk in self._astream_balanced(messages, stop, **kwargs):
+                started = True
+                yield chunk
+            return
+        except Exception:
+            if started or self.fallback is None:
+                raise
+        print(f"All {self.model} endpoints failed, using fallback model {self.fallback.model}")
+        async for chunk in self.fallback._astream(messages, stop=stop, **kwargs):
+            yield chunk
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        # The pipeline is async; sync calls are not balanced.
+        return self.primary._generate(messages, stop=stop, **kwargs)
+
+
+def load_endpoints(
+    spec: str = LLM_ENDPOINTS, path: Optional[str] = LLM_ENDPOINTS_FILE,
+    model: str = LLM_MODEL, temperature: float = LLM_TEMPERATURE, stage: Optional[str] = None,
+) -> List[Endpoint]:
+    if path:
+        # An entry with "stages": ["refine"] only serves those stages.
+        with open(path) as f:
+            entries = json.load(f)
+        return [
+            Endpoint(
+                entry['url'],
+                kind=entry.get('kind', KIND_OLLAMA),
+                model=entry.get('model', model),
+                temperature=entry.get('temperature', temperature),
+                max_concurrency=entry.get('max_concurrency', LLM_ENDPOINT_CONCURRENCY),
+                api_key=os.getenv(entry['api_key_env']) if entry.get('api_key_env') else None,
+            )
+            for entry in entries
+            if stage is None or stage in entry.get('stages', (stage,))
+        ]
+
+    endpoints = []
+    for url in filter(None, (part.strip() for part in spec.split(','))):
+        kind = KIND_OLLAMA
+        if url.startswith(f"{KIND_OPENAI}+"):
+            kind, url = KIND_OPENAI, url[len(KIND_OPENAI) + 1:]
+        endpoints.append(Endpoint(url, kind=kind, model=model, temperature=temperature))
+    return endpoints
+
+
+def create_backend_pool(
+    model: str = LLM_MODEL, temperature: float = LLM_TEMPERATURE, spec: str = LLM_ENDPOINTS,
+    stage: Optional[str] = None, fallback: Optional[BaseChatModel] = None,
+) -> BackendPool:
+    endpoints = load_endpoints(spec, model=model, temperature=temperature, stage=stage)
+    return BackendPool(endpoints, model=model, temperature=temperature, fallback=fallback)
+
+
+fallback_llm = create_backend_pool(LLM_FALLBACK_MODEL) if LLM_FALLBACK_MODEL else None
+draft_llm = create_backend_pool(LLM_DRAFT_MODEL, spec=LLM_DRAFT_ENDPOINTS, stage=STAGE_DRAFT, fallback=fallback_llm)
+if (LLM_REFINE_MODEL, LLM_REFINE_ENDPOINTS) == (LLM_DRAFT_MODEL, LLM_DRAFT_ENDPOINTS) and not LLM_ENDPOINTS_FILE:
+    # One model for both stages: one pool, so endpoint caps cover both.
+    refine_llm = draft_llm
+else:
+    refine_llm = create_backend_pool(
+        LLM_REFINE_MODEL, spec=LLM_REFINE_ENDPOINTS, stage=STAGE_REFINE, fallback=fallback_llm
+    )
+llm = draft_llm
@@ -0,0 +1,133 @@
+import os
+import uuid
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+from jobs import job_store, STATUS_BATCH, STATUS_UPLOADED, STATUS_PROCESSING, STATUS_COMPLETE, STATUS_ERROR
+
+load_dotenv()
+
+# POST /batch?directory=... reads PDFs from a directory on the server, which
+# must lie under this root. Empty (the default) turns directory batches off.
+BATCH_DIRECTORY_ROOT = os.getenv("BATCH_DIRECTORY_ROOT", "")
+# Most documents one batch may hold, zip members included.
+BATCH_MAX_DOCUMENTS = int(os.getenv("BATCH_MAX_DOCUMENTS", "10000"))
+
+# Jobs whose record expired are reported with this status.
+STATUS_EXPIRED = 'expired'
+
+
+def is_pdf(name: str) -> bool:
+    return name.lower().endswith('.pdf')
+
+
+def new_batch_id() -> str:
+    return f"batch-{uuid.uuid4()}"
+
+
+def resolve_directory(directory: str, root: Optional[str] = None) -> Path:
+    root = BATCH_DIRECTORY_ROOT if root is None else root
+    if not root:
+        raise PermissionError("Directory batches are disabled (set BATCH_DIRECTORY_ROOT)")
+    root_path = Path(root).resolve()
+    path = (root_path / directory).resolve()
+    if path != root_path and root_path not in path.parents:
+        raise PermissionError(f"'{directory}' is outside BATCH_DIRECTORY_ROOT")
+    if not path.is_dir():
+        raise FileNotFoundError(f"Directory '{directory}' not found")
+    return path
+
+
+def iter_documents(
+    uploads: Iterable[Tuple[str, BinaryIO]], directory: Optional[Path] = None, skipped: Optional[List[str]] = None
+) -> Iterator[Tuple[str, BinaryIO]]:
+    # Yields (filename, binary file) for every PDF among the uploads, inside
+    # uploaded zip archives and under directory (already resolved, see
+    # resolve_directory). A file is only open until the next one is
+    # requested. Anything else, including links that lead out of directory,
+    # is added to skipped.
+    skipped = [] if skipped is None else skipped
+    for name, upload in uploads:
+        if is_pdf(name):
+            yield name, upload
+        elif name.lower().endswith('.zip'):
+            with zipfile.ZipFile(upload) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or info.filename.startswith('__MACOSX/'):
+                        continue
+                    if not is_pdf(info.filename):
+                        skipped.append(f"{name}/{info.filename}")
+                        continue
+                    with archive.open(info) as member:
+                        yield info.filename, member
+        else:
+            skipped.append(name)
+
+    if directory is not None:
+        for path in sorted(directory.rglob('*')):
+            if not path.is_file():
+                continue
+            name = str(path.relative_to(directory))
+            target = path.resolve()
+            if not is_pdf(name) or directory not in target.parents:
+                skipped.append(name)
+                continue
+            with open(target, 'rb') as f:
+                yield name, f
+
+
+def create_batch(batch_id: str, job_ids: List[str], skipped: List[str], priority: int) -> None:
+    job_store.create(batch_id, {
+        'filename': batch_id,
+        'jobs': job_ids,
+        'skipped': skipped,
+        'priority': priority,
+        'status': STATUS_BATCH
+    })
+
+
+def get_batch(batch_id: str) -> Optional[Dict]:
+    batch = job_store.get(batch_id)
+    if batch is None or batch['status'] != STATUS_BATCH:
+        return None
+    return batch
+
+
+def batch_progress(batch_id: str) -> Optional[Dict]:
+    batch = get_batch(batch_id)
+    if batch is None:
+        return None
+
+    counts = {status: 0 for status in (STATUS_UPLOADED, STATUS_PROCESSING, STATUS_COMPLETE, STATUS_ERROR, STATUS_EXPIRED)}
+    documents = []
+    pages_done = pages_total = 0
+    for job_id in batch['jobs']:
+        job = job_store.get(job_id)
+        status = job['status'] if job is not None else STATUS_EXPIRED
+        # Written by the worker with each page (see worker.run_job).
+        done = job.get('pages_done', 0) if job is not None else 0
+        total = job.get('total_pages') if job is not None else None
+        counts[status] += 1
+        pages_done += done
+        pages_total += total or 0
+        documents.append({
+            'job_id': job_id,
+            'filename': job['filename'] if job is not None else None,
+            'status': status,
+            'pages_done': done,
+            'total_pages': total,
+        })
+
+    finished = counts[STATUS_COMPLETE] + counts[STATUS_ERROR] + counts[STATUS_EXPIRED]
+    return {
+        'batch_id': batch_id,
+        'status': STATUS_COMPLETE if finished == len(documents) else STATUS_PROCESSING,
+        'documents': len(documents),
+        'counts': counts,
+        'pages_done': pages_done,
+        # Pages of documents not yet opened by a worker are not counted.
+        'pages_total': pages_total,
+        'skipped': batch.get('skipped', []),
+        'jobs': documents,
+    }
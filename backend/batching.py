@@ -0,0 +1,251 @@
+import os
+import re
+import json
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional
+from langchain_core.prompts import PromptTemplate
+from dotenv import load_dotenv
+import helper_function
+from helper_function import run_chain, summery_asycn, SUMMARY_PROMPT
+from scheduler import scheduler, PRIORITY_INTERACTIVE
+from cache import summary_cache, make_key
+from metrics import metrics
+
+load_dotenv()
+
+# Token counts are estimated from characters; ~4 per token holds well enough
+# for English text with the llama tokenizers.
+CHARS_PER_TOKEN = 4
+# Consecutive pages below PAGE_BATCH_SMALL_TOKENS (covers, separators,
+# signature pages) share one LLM call, up to PAGE_BATCH_TOKENS of page text
+# and PAGE_BATCH_MAX_PAGES pages. PAGE_BATCH_MAX_PAGES=1 turns packing off.
+PAGE_BATCH_MAX_PAGES = int(os.getenv("PAGE_BATCH_MAX_PAGES", "6"))
+PAGE_BATCH_SMALL_TOKENS = int(os.getenv("PAGE_BATCH_SMALL_TOKENS", "120"))
+PAGE_BATCH_TOKENS = int(os.getenv("PAGE_BATCH_TOKENS", "1200"))
+# Pages above this are summarized in chunks and the chunk summaries merged,
+# so prompt plus answer stay inside the model's context (8k for llama3.1:8b
+# as Ollama runs it).
+PAGE_SPLIT_TOKENS = int(os.getenv("PAGE_SPLIT_TOKENS", "5000"))
+
+BATCH_SUMMARY_PROMPT = PromptTemplate(
+    input_variables=["pages"],
+    template="""
+You are a summarizer. Below are several consecutive short pages of one document, each starting with a line like "=== Page N ===".
+
+{pages}
+
+Write a separate summary for EACH page. Format every summary like this:
+**Brief Topic/Heading** (describing what this page is about)
+
+(1) First key point
+(2) Second key point
+... (as many points as the page needs; a near-empty page may need only one)
+
+Return ONLY a JSON object of this shape, with exactly one entry per page, in page order:
+{{"pages": [{{"page": <page number>, "summary": "<summary>"}}]}}
+"""
+)
+
+MERGE_PROMPT = PromptTemplate(
+    input_variables=["parts"],
+    template="""
+The summaries below each cover one consecutive part of the same, very long page.
+
+{parts}
+
+Combine them into ONE detailed summary of the whole page. Format it like this:
+**Brief Topic/Heading** (describing what this page is about)
+
+(1) First key point
+(2) Second key point
+... (continue with as many points as needed for a comprehensive summary)
+
+IMPORTANT:
+- Keep every distinct point; drop only repetitions
+- Do not use additional asterisks in the points themselves
+- Output ONLY the heading and summary points
+"""
+)
+
+_JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+
+Summarize = Callable[..., Awaitable[str]]
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text or '') // CHARS_PER_TOKEN + 1
+
+
+def split_text(text: str, max_tokens: int) -> List[str]:
+    # Split on line boundaries where possible; a single over-long line is cut.
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks, current = [], ''
+    for line in text.splitlines(keepends=True):
+        while len(line) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(line[:max_chars])
+            line = line[max_chars:]
+        if len(current) + len(line) > max_chars:
+            chunks.append(current)
+            current = ''
+        current += line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def parse_batch_summaries(content: str, page_numbers: List[int]) -> Optional[List[str]]:
+    match = _JSON_OBJECT.search(content or '')
+    if match is None:
+        return None
+    try:
+        entries = json.loads(match.group(0)).get('pages')
+        summaries = {int(entry['page']): str(entry['summary']).strip() for entry in entries}
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+    if any(not summaries.get(number) for number in page_numbers):
+        return None
+    return [summaries[number] for number in page_numbers]
+
+
+async def _invoke(prompt: PromptTemplate, inputs: Dict, stage: str, job_id: str, priority: int) -> str:
+    chain = prompt | helper_function.draft_llm
+    queued = time.perf_counter()
+    async with scheduler.slot(job_id, priority):
+        metrics.observe('llm.wait', time.perf_counter() - queued, job_id)
+        return await run_chain(chain, inputs, None, stage, job_id)
+
+
+def _summary_key(page_text: str, kind: str = 'summary', template: str = SUMMARY_PROMPT.template) -> str:
+    llm = helper_function.draft_llm
+    return make_key(kind, [page_text], template, llm.model, llm.temperature)
+
+
+def _batch_key(page_text: str) -> str:
+    # A page summarized inside a packed call is kept apart from one
+    # summarized alone: the prompts differ, and so may the answers.
+    return _summary_key(page_text, 'summary.batch', BATCH_SUMMARY_PROMPT.template)
+
+
+def _merge_key(page_text: str) -> str:
+    return _summary_key(page_text, 'summary.merge', SUMMARY_PROMPT.template + MERGE_PROMPT.template)
+
+
+async def summarize_batch(
+    page_texts: List[str], first_page: int, job_id: str = 'default', priority: int = PRIORITY_INTERACTIVE,
+    summarize: Summarize = summery_asycn,
+) -> List[str]:
+    # One call for several short pages. Results are cached per page, so a
+    # page packed again with different neighbours is not asked for twice. If
+    # the answer cannot be split back into pages, each page is summarized on
+    # its own.
+    keys = [_batch_key(text) for text in page_texts]
+    cached = [summary_cache.get(key, job_id) for key in keys]
+    missing = [index for index, summary in enumerate(cached) if summary is None]
+    if len(missing) == 1:
+        index = missing[0]
+        cached[index] = await summarize(page_contnet=page_texts[index], job_id=job_id, priority=priority)
+    elif missing:
+        numbers = [first_page + index for index in missing]
+        pages = "\n\n".join(f"=== Page {number} ===\n{page_texts[index]}" for number, index in zip(numbers, missing))
+        content = await _invoke(BATCH_SUMMARY_PROMPT, {'pages': pages}, 'llm.batch', job_id, priority)
+        summaries = parse_batch_summaries(content, numbers)
+        if summaries is None:
+            print(f"Batch answer for pages {numbers[0]}-{numbers[-1]} did not parse, summarizing them one by one")
+            summaries = await asyncio.gather(*(
+                summarize(page_contnet=page_texts[index], job_id=job_id, priority=priority) for index in missing
+            ))
+        else:
+            for index, summary in zip(missing, summaries):
+                summary_cache.put(keys[index], summary)
+        for index, summary in zip(missing, summaries):
+            cached[index] = summary
+    return cached
+
+
+async def summarize_long_page(
+    page_text: str, job_id: str = 'default', priority: int = PRIORITY_INTERACTIVE,
+    summarize: Summarize = summery_asycn,
+) -> str:
+    # Map-reduce: summarize each chunk, then merge the chunk summaries.
+    key = _merge_key(page_text)
+    cached = summary_cache.get(key, job_id)
+    if cached is not None:
+        return cached
+
+    chunks = split_text(page_text, PAGE_SPLIT_TOKENS)
+    parts = await asyncio.gather(*(
+        summarize(page_contnet=chunk, job_id=job_id, priority=priority) for chunk in chunks
+    ))
+    numbered = "\n\n".join(f"--- Part {index} ---\n{part}" for index, part in enumerate(parts, 1))
+    content = await _invoke(MERGE_PROMPT, {'parts': numbered}, 'llm.merge', job_id, priority)
+    summary_cache.put(key, content)
+    return content
+
+
+class PageBatcher:
+    # Turns pages, fed in document order, into LLM work: small pages are
+    # packed into shared calls, oversize pages are split, the rest get one
+    # call each. add() and flush() return one future per page, in page order,
+    # each resolving to that page's summary.
+
+    def __init__(self, job_id: str = 'default', priority: int = PRIORITY_INTERACTIVE,
+                 summarize: Summarize = summery_asycn, on_token: Optional[Callable[[str], None]] = None):
+        self.job_id = job_id
+        self.priority = priority
+        self.summarize = summarize
+        # Token stream for page 1; only used if page 1 gets a call of its own.
+        self.on_token = on_token
+        self._page = 0
+        self._pending: List[str] = []
+        self._pending_first = 0
+        self._pending_tokens = 0
+
+    def add(self, page_text: str) -> List[asyncio.Future]:
+        self._page += 1
+        tokens = estimate_tokens(page_text)
+        if PAGE_BATCH_MAX_PAGES > 1 and tokens <= PAGE_BATCH_SMALL_TOKENS:
+            futures = []
+            if self._pending and self._pending_tokens + tokens > PAGE_BATCH_TOKENS:
+                futures = self.flush()
+            if not self._pending:
+                self._pending_first = self._page
+            self._pending.append(page_text)
+            self._pending_tokens += tokens
+            if len(self._pending) >= PAGE_BATCH_MAX_PAGES:
+                futures += self.flush()
+            return futures
+
+        futures = self.flush()
+        if tokens > PAGE_SPLIT_TOKENS:
+            futures.append(asyncio.ensure_future(
+                summarize_long_page(page_text, self.job_id, self.priority, self.summarize)
+            ))
+        else:
+            futures.append(self._single(page_text, self._page))
+        return futures
+
+    def flush(self) -> List[asyncio.Future]:
+        pending, first_page = self._pending, self._pending_first
+        self._pending, self._pending_tokens = [], 0
+        if not pending:
+            return []
+        if len(pending) == 1:
+            return [self._single(pending[0], first_page)]
+        batch = asyncio.ensure_future(
+            summarize_batch(pending, first_page, self.job_id, self.priority, self.summarize)
+        )
+        return [asyncio.ensure_future(_nth(batch, index)) for index in range(len(pending))]
+
+    def _single(self, page_text: str, page: int) -> asyncio.Future:
+        return asyncio.ensure_future(self.summarize(
+            page_contnet=page_text, job_id=self.job_id, priority=self.priority,
+            on_token=self.on_token if page == 1 else None,
+        ))
+
+
+async def _nth(batch: asyncio.Future, index: int) -> str:
+    return (await batch)[index]
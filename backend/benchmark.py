@@ -0,0 +1,487 @@
+import os
+import io
+import sys
+import json
+import math
+import time
+import re
+import random
+import asyncio
+import hashlib
+import argparse
+import resource
+import tempfile
+import statistics
+from contextlib import contextmanager, redirect_stdout
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Benchmarks never touch real user files; any passphrase will do.
+os.environ.setdefault("ENCRYPTION_PASSPHRASE", "docveil-benchmark")
+
+import helper_function
+import workflow
+from cache import summary_cache
+from encryption import encrypt_file, open_decrypted
+from extraction import PageStream
+from pagestore import page_store, discard_pages, KIND_TEXT
+from transport import encode_event
+
+# Stand-in model defaults: fast enough that a 100-page run takes seconds.
+# Pass --latency 0.5 --token-rate 40 to approximate llama3.1:8b on a laptop.
+FAKE_LATENCY = 0.02
+FAKE_TOKEN_RATE = 2000.0
+FAKE_OUTPUT_TOKENS = 40
+
+WORDS = (
+    "revenue margin quarter growth customer product market risk strategy cost "
+    "forecast supply demand region segment report policy audit contract asset "
+    "liability equity cash flow capital board review target result analysis plan"
+).split()
+
+_BATCH_PAGE = re.compile(r"^=== Page (\d+) ===$", re.MULTILINE)
+
+
+class FakeChatModel(BaseChatModel):
+    # Deterministic replacement for ChatOllama: the reply is derived from the
+    # prompt, arrives after `latency` seconds and then at `token_rate` tokens
+    # per second, so runs are repeatable and need no Ollama server.
+    model: str = "fake"
+    temperature: float = 0.0
+    latency: float = FAKE_LATENCY
+    token_rate: float = FAKE_TOKEN_RATE
+    output_tokens: int = FAKE_OUTPUT_TOKENS
+
+    @property
+    def _llm_type(self) -> str:
+        return "docveil-fake"
+
+    def _reply(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = "".join(str(message.content) for message in messages)
+        rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).digest())
+        words = [rng.choice(WORDS) for _ in range(self.output_tokens)]
+        pages = _BATCH_PAGE.findall(prompt)
+        if pages:
+            # Packed short pages: answer in the JSON shape the batch prompt asks for.
+            share = max(1, len(words) // len(pages))
+            entries = [{'page': int(page), 'summary': " ".join(words[i * share:(i + 1) * share]) or "empty"}
+                       for i, page in enumerate(pages)]
+            return [json.dumps({'pages': entries})]
+        return [word + " " for word in words]
+
+    def _usage(self, messages: List[BaseMessage]) -> Dict[str, int]:
+        # Whitespace words stand in for tokens, like Ollama's prompt_eval_count.
+        prompt_tokens = sum(len(str(message.content).split()) for message in messages)
+        return {
+            'input_tokens': prompt_tokens,
+            'output_tokens': self.output_tokens,
+            'total_tokens': prompt_tokens + self.output_tokens,
+        }
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        message = AIMessage(content="".join(self._reply(messages)), usage_metadata=self._usage(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency + self.output_tokens / self.token_rate)
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency + self.output_tokens / self.token_rate)
+        return self._result(messages)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for token in self._reply(messages):
+            await asyncio.sleep(1 / self.token_rate)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages)))
+
+
+@contextmanager
+def fake_llm(model: FakeChatModel, refine_model: Optional[FakeChatModel] = None) -> Iterator[FakeChatModel]:
+    # Drafts are built from helper_function.draft_llm, refinement from
+    # workflow.refine_llm; refine_model stands in for a separate refine tier.
+    refine_model = refine_model or model
+    originals = (helper_function.draft_llm, workflow.draft_llm, workflow.refine_llm, summary_cache.enabled)
+    helper_function.draft_llm = workflow.draft_llm = model
+    workflow.refine_llm = refine_model
+    # Every run must do the full work, not replay earlier results.
+    summary_cache.enabled = False
+    try:
+        yield model
+    finally:
+        helper_function.draft_llm, workflow.draft_llm, workflow.refine_llm, summary_cache.enabled = originals
+
+
+def _pdf_text(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def make_pdf(path: str, pages: int, lines_per_page: int = 40, seed: int = 0) -> str:
+    # Plain single-font text pages, written by hand so no PDF library beyond
+    # pypdf is needed. Same arguments, same bytes.
+    rng = random.Random(seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for page in range(pages):
+        lines = [f"Page {page + 1}"] + [
+            " ".join(rng.choice(WORDS) for _ in range(12)) for _ in range(lines_per_page)
+        ]
+        text = " T* ".join(f"({_pdf_text(line)}) Tj" for line in lines)
+        content = f"BT /F1 10 Tf 12 TL 50 760 Td {text} ET".encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), pages
+    )
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+    with open(path, 'wb') as f:
+        f.write(out.getvalue())
+    return path
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    # Nearest-rank: the smallest sample with at least pct% of samples at or below it.
+    rank = math.ceil(pct / 100 * len(ordered))
+    return ordered[min(len(ordered), max(1, rank)) - 1]
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    # ru_maxrss is KiB on Linux and bytes on macOS. Children covers the PDF
+    # extraction worker processes.
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def _load(path: str) -> int:
+    with open(path, 'rb') as f:
+        return len(f.read())
+
+
+def _decrypt(path: str) -> int:
+    with open_decrypted(path) as stream:
+        return len(stream.read())
+
+
+def _extract(path: str) -> List[str]:
+    with PageStream(path) as pages:
+        return list(pages)
+
+
+async def _summarize(page_texts: List[str], job_id: str) -> List[str]:
+    return list(await asyncio.gather(*(
+        helper_function.summery_asycn(page_contnet=text, job_id=job_id) for text in page_texts
+    )))
+
+
+async def _refine(summaries: List[str], job_id: str) -> None:
+    await workflow.refine_document(summaries, job_id, 0)
+
+
+async def _stream(path: str, job_id: str, pipelined: Optional[bool]) -> Dict[str, float]:
+    # Wall time to the first page event and to the end of the stream, with
+    # each event encoded as it would be for the SSE client.
+    start = time.perf_counter()
+    first = None
+    events = 0
+    async for summary_data in workflow.stream_pdf_summaries(path, job_id, pipelined=pipelined):
+        encode_event('summary', summary_data, str(summary_data['page']))
+        events += 1
+        if first is None:
+            first = time.perf_counter() - start
+    return {'ttfe': first or 0.0, 'total': time.perf_counter() - start, 'events': events}
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    return {
+        'p50': percentile(samples, 50),
+        'p95': percentile(samples, 95),
+        'mean': statistics.fmean(samples) if samples else 0.0,
+    }
+
+
+async def benchmark_document(path: str, encrypted_path: str, pages: int, runs: int) -> Dict[str, Any]:
+    stages = {}
+    stages['load'], _ = _timed(_load, path)
+    stages['encrypt'], _ = _timed(encrypt_file, path, encrypted_path)
+    stages['decrypt'], _ = _timed(_decrypt, encrypted_path)
+    stages['extract'], page_texts = _timed(_extract, encrypted_path)
+
+    start = time.perf_counter()
+    summaries = await _summarize(page_texts, f"bench-{pages}-summarize")
+    stages['summarize'] = time.perf_counter() - start
+    start = time.perf_counter()
+    await _refine(summaries, f"bench-{pages}-refine")
+    stages['refine'] = time.perf_counter() - start
+
+    stream = {}
+    for mode, pipelined in (('graph', False), ('pipelined', True)):
+        samples = [await _stream(encrypted_path, f"bench-{pages}-{mode}-{run}", pipelined) for run in range(runs)]
+        stream[mode] = {
+            'ttfe': _summary([sample['ttfe'] for sample in samples]),
+            'total': _summary([sample['total'] for sample in samples]),
+        }
+    return {'pages': pages, 'stages': stages, 'stream': stream, 'peak_rss_mb': peak_rss_mb()}
+
+
+async def benchmark_scaling(encrypted_path: str, pages: int, jobs: int) -> Dict[str, Any]:
+    # jobs identical documents streamed at once through the shared LLM
+    # scheduler, as concurrent uploads would be.
+    start = time.perf_counter()
+    samples = await asyncio.gather(*(
+        _stream(encrypted_path, f"bench-scale-{jobs}-{job}", None) for job in range(jobs)
+    ))
+    total = time.perf_counter() - start
+    return {
+        'jobs': jobs,
+        'pages': pages,
+        'total': total,
+        'pages_per_second': jobs * pages / total if total else 0.0,
+        'ttfe': _summary([sample['ttfe'] for sample in samples]),
+    }
+
+
+@contextmanager
+def instant_stages(page_texts: List[str]) -> Iterator[None]:
+    # Extraction and every LLM stage return at once, so what is left to time
+    # is the graph's own per-step bookkeeping. One page per refine step.
+    originals = (workflow._extract_pages, workflow.summery_asycn, workflow.refine_page,
+                 workflow.update_memory, workflow.REFINE_WINDOW)
+
+    async def summarize(page_contnet, job_id='default', priority=0, on_token=None):
+        return page_contnet
+
+    async def refine(memory, previous, current, job_id, priority, on_token=None):
+        return current
+
+    async def update_memory(memory, summaries, job_id, priority):
+        return memory
+
+    def extract(pdf_path, job_id='default'):
+        page_store(job_id).put_many(KIND_TEXT, 0, page_texts)
+        return {'total_page': len(page_texts)}
+
+    workflow._extract_pages = extract
+    workflow.summery_asycn, workflow.refine_page, workflow.update_memory = summarize, refine, update_memory
+    workflow.REFINE_WINDOW = 1
+    try:
+        yield
+    finally:
+        (workflow._extract_pages, workflow.summery_asycn, workflow.refine_page,
+         workflow.update_memory, workflow.REFINE_WINDOW) = originals
+
+
+async def benchmark_graph_steps(pages: int, lines_per_page: int = 40) -> Dict[str, Any]:
+    # Time per refine step with the LLM taken out, for the bare graph and for
+    # the checkpointed stream the workers run. Neither should grow with the
+    # number of pages already refined.
+    rng = random.Random(pages)
+    page_texts = [
+        "\n".join(" ".join(rng.choice(WORDS) for _ in range(12)) for _ in range(lines_per_page))
+        for _ in range(pages)
+    ]
+    steps, checkpointed = [], []
+    with instant_stages(page_texts):
+        last = time.perf_counter()
+        async for event in workflow.workflow.astream(workflow.State(pdf_path="unused.pdf", job_id="bench-steps")):
+            now = time.perf_counter()
+            if 'refined_summaries' in event:
+                steps.append(now - last)
+            last = now
+        discard_pages("bench-steps")
+
+        last = time.perf_counter()
+        async for summary_data in workflow.stream_pdf_summaries("unused.pdf", "bench-steps", pipelined=False):
+            now = time.perf_counter()
+            if summary_data['status'] == 'processing':
+                checkpointed.append(now - last)
+            last = now
+    # The second half of each run, where the document so far is largest.
+    return {
+        'pages': pages,
+        'step': _summary(steps),
+        'late_step': _summary(steps[len(steps) // 2:]),
+        'checkpointed_step': _summary(checkpointed),
+        'late_checkpointed_step': _summary(checkpointed[len(checkpointed) // 2:]),
+    }
+
+
+async def run_benchmark(
+    page_counts: List[int],
+    job_counts: List[int],
+    runs: int = 3,
+    model: Optional[FakeChatModel] = None,
+    scale_pages: int = 10,
+    workdir: Optional[str] = None,
+    verbose: bool = False,
+    refine_model: Optional[FakeChatModel] = None,
+    step_pages: Optional[List[int]] = None,
+) -> Dict[str, Any]:
+    # model writes the page drafts; refine_model (default: the same model)
+    # refines them, as with LLM_DRAFT_MODEL / LLM_REFINE_MODEL. step_pages:
+    # document sizes for the per-step graph overhead runs.
+    model = model or FakeChatModel()
+    refine_model = refine_model or model
+    with tempfile.TemporaryDirectory(prefix="docveil-bench-") as tmp:
+        workdir = os.path.abspath(workdir or tmp)
+        os.makedirs(workdir, exist_ok=True)
+        previous_cwd = os.getcwd()
+        # Checkpoints and saved summaries are written relative to the cwd.
+        os.chdir(workdir)
+        log = sys.stdout if verbose else io.StringIO()
+        try:
+            with fake_llm(model, refine_model), redirect_stdout(log):
+                documents = []
+                for pages in page_counts:
+                    path = make_pdf(os.path.join(workdir, f"bench_{pages}.pdf"), pages)
+                    documents.append(await benchmark_document(path, f"{path}.enc", pages, runs))
+
+                scaling = []
+                scale_path = make_pdf(os.path.join(workdir, f"bench_scale_{scale_pages}.pdf"), scale_pages)
+                encrypt_file(scale_path, f"{scale_path}.enc")
+                scale_path = f"{scale_path}.enc"
+                for jobs in job_counts:
+                    scaling.append(await benchmark_scaling(scale_path, scale_pages, jobs))
+
+                graph_steps = [await benchmark_graph_steps(pages) for pages in step_pages or ()]
+        finally:
+            # The checkpoint connection runs a non-daemon thread; left open,
+            # the interpreter never exits.
+            await workflow.close_checkpoints()
+            os.chdir(previous_cwd)
+
+    return {
+        'model': _describe(model),
+        'refine_model': _describe(refine_model),
+        'runs': runs,
+        'documents': documents,
+        'scaling': scaling,
+        'graph_steps': graph_steps,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _describe(model: FakeChatModel) -> Dict[str, Any]:
+    return {'latency': model.latency, 'token_rate': model.token_rate, 'output_tokens': model.output_tokens}
+
+
+def _model_line(label: str, model: Dict[str, Any]) -> str:
+    return (
+        f"{label}: {model['latency'] * 1000:.0f}ms latency, {model['token_rate']:.0f} tok/s, "
+        f"{model['output_tokens']} tokens per reply"
+    )
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    if report['model'] == report['refine_model']:
+        lines = [_model_line("Fake LLM", report['model'])]
+    else:
+        lines = [_model_line("Fake draft LLM", report['model']), _model_line("Fake refine LLM", report['refine_model'])]
+    lines += [
+        f"{report['runs']} runs per mode",
+        "",
+        f"{'pages':>6} {'load':>8} {'encrypt':>8} {'decrypt':>8} {'extract':>8} {'summar.':>8} {'refine':>8}"
+        f"   {'mode':<9} {'ttfe p50':>9} {'ttfe p95':>9} {'total p50':>10} {'total p95':>10}",
+    ]
+    for document in report['documents']:
+        stages = document['stages']
+        prefix = f"{document['pages']:>6} " + " ".join(
+            f"{stages[name]:>8.3f}" for name in ('load', 'encrypt', 'decrypt', 'extract', 'summarize', 'refine')
+        )
+        for mode, stream in document['stream'].items():
+            lines.append(
+                f"{prefix}   {mode:<9} {stream['ttfe']['p50']:>9.3f} {stream['ttfe']['p95']:>9.3f} "
+                f"{stream['total']['p50']:>10.3f} {stream['total']['p95']:>10.3f}"
+            )
+            prefix = " " * len(prefix)
+    lines += ["", f"{'jobs':>6} {'pages':>6} {'total':>8} {'pages/s':>8} {'ttfe p50':>9} {'ttfe p95':>9}"]
+    for row in report['scaling']:
+        lines.append(
+            f"{row['jobs']:>6} {row['pages']:>6} {row['total']:>8.3f} {row['pages_per_second']:>8.1f} "
+            f"{row['ttfe']['p50']:>9.3f} {row['ttfe']['p95']:>9.3f}"
+        )
+    if report.get('graph_steps'):
+        lines += ["", f"{'pages':>6} {'step p50 ms':>12} {'step p95 ms':>12} {'late p50 ms':>12}"
+                      f" {'ckpt p50 ms':>12} {'ckpt p95 ms':>12} {'late p50 ms':>12}"]
+        for row in report['graph_steps']:
+            lines.append(
+                f"{row['pages']:>6} {row['step']['p50'] * 1000:>12.3f} {row['step']['p95'] * 1000:>12.3f} "
+                f"{row['late_step']['p50'] * 1000:>12.3f} {row['checkpointed_step']['p50'] * 1000:>12.3f} "
+                f"{row['checkpointed_step']['p95'] * 1000:>12.3f} {row['late_checkpointed_step']['p50'] * 1000:>12.3f}"
+            )
+    rss = report['peak_rss_mb']
+    lines += ["", f"Peak RSS: {rss['self']:.1f} MB (extraction workers: {rss['children']:.1f} MB)"]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the DocVeil pipeline against a fake LLM")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4, 8], help="concurrent job counts")
+    parser.add_argument("--scale-pages", type=int, default=10, help="pages per document in the scaling runs")
+    parser.add_argument("--step-pages", type=int, nargs="*", default=[100, 1000, 5000],
+                        help="document sizes for the per-step graph overhead runs")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=FAKE_LATENCY, help="seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=FAKE_TOKEN_RATE, help="tokens per second")
+    parser.add_argument("--tokens", type=int, default=FAKE_OUTPUT_TOKENS, help="tokens per reply")
+    parser.add_argument("--draft-latency", type=float, help="separate draft model: seconds before the first token")
+    parser.add_argument("--draft-token-rate", type=float, help="separate draft model: tokens per second")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="show pipeline logs")
+    args = parser.parse_args()
+
+    refine_model = FakeChatModel(latency=args.latency, token_rate=args.token_rate, output_tokens=args.tokens)
+    draft_model = refine_model
+    if args.draft_latency is not None or args.draft_token_rate is not None:
+        draft_model = FakeChatModel(
+            model="fake-draft",
+            latency=args.latency if args.draft_latency is None else args.draft_latency,
+            token_rate=args.token_rate if args.draft_token_rate is None else args.draft_token_rate,
+            output_tokens=args.tokens,
+        )
+
+    report = asyncio.run(run_benchmark(
+        args.pages, args.jobs, args.runs, draft_model, args.scale_pages,
+        verbose=args.verbose, refine_model=refine_model, step_pages=args.step_pages,
+    ))
+    print(format_report(report))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
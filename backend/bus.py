@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from encryption import ValueCipher, EVENT_KEY_INFO
+from jobs import JOB_STORE, JOB_STORE_PATH, JOB_STORE_URL, JOB_TTL_SECONDS
+
+load_dotenv()
+
+BUS_POLL_INTERVAL = float(os.getenv("BUS_POLL_INTERVAL", "0.25"))
+# While idle, a subscriber checks this often whether its job still exists.
+BUS_ALIVE_CHECK_SECONDS = 5.0
+
+TERMINAL_STATUSES = ('complete', 'error')
+
+
+class EventBus(ABC):
+    # Per-job append-only event log shared by worker and API processes.
+    # Events are kept until the job is forgotten (or expires), so a
+    # subscriber that attaches late still sees every page. They carry page
+    # summaries, so they are stored encrypted and bound to their job.
+
+    def __init__(self, ttl: int = JOB_TTL_SECONDS):
+        self.ttl = ttl
+        self._cipher: Optional[ValueCipher] = None
+
+    def _seal(self, job_id: str, event: Dict) -> bytes:
+        if self._cipher is None:
+            self._cipher = ValueCipher(EVENT_KEY_INFO)
+        return self._cipher.encrypt(json.dumps(event).encode('utf-8'), job_id.encode('utf-8'))
+
+    def _open(self, job_id: str, sealed: bytes) -> Dict:
+        if self._cipher is None:
+            self._cipher = ValueCipher(EVENT_KEY_INFO)
+        return json.loads(self._cipher.decrypt(sealed, job_id.encode('utf-8')))
+
+    @abstractmethod
+    def publish(self, job_id: str, event: Dict) -> None:
+        ...
+
+    @abstractmethod
+    def read(self, job_id: str, cursor=None) -> Tuple[List[Dict], object]:
+        # Events published after cursor, and the cursor to pass next time.
+        ...
+
+    @abstractmethod
+    def forget(self, job_id: str) -> None:
+        ...
+
+    def purge_expired(self) -> int:
+        return 0
+
+    async def subscribe(
+        self,
+        job_id: str,
+        is_alive: Optional[Callable[[], bool]] = None,
+        poll_interval: float = BUS_POLL_INTERVAL,
+    ) -> AsyncIterator[Dict]:
+        cursor = None
+        idle_since = time.monotonic()
+        while True:
+            events, cursor = self.read(job_id, cursor)
+            for event in events:
+                yield event
+                if event['data'].get('status') in TERMINAL_STATUSES:
+                    return
+            if events:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since > BUS_ALIVE_CHECK_SECONDS:
+                if is_alive is not None and not is_alive():
+                    return
+                idle_since = time.monotonic()
+            await asyncio.sleep(poll_interval)
+
+
+class SQLiteEventBus(EventBus):
+    def __init__(self, path: str = JOB_STORE_PATH, ttl: int = JOB_TTL_SECONDS):
+        super().__init__(ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ':memory:':
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_events ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, "
+                "event BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS job_events_job ON job_events(job_id, id)")
+            self._conn = conn
+        return self._conn
+
+    def publish(self, job_id: str, event: Dict) -> None:
+        with self._lock:
+            self._connection().execute(
+                "INSERT INTO job_events (job_id, event, created_at) VALUES (?, ?, ?)",
+                (job_id, self._seal(job_id, event), time.time())
+            )
+
+    def read(self, job_id: str, cursor=None) -> Tuple[List[Dict], object]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT id, event FROM job_events WHERE job_id = ? AND id > ? ORDER BY id",
+                (job_id, cursor or 0)
+            ).fetchall()
+        if not rows:
+            return [], cursor
+        return [self._open(job_id, event) for _, event in rows], rows[-1][0]
+
+    def forget(self, job_id: str) -> None:
+        with self._lock:
+            self._connection().execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._connection().execute(
+                "DELETE FROM job_events WHERE created_at <= ?", (time.time() - self.ttl,)
+            )
+        return cursor.rowcount
+
+
+class RedisEventBus(EventBus):
+    # One Redis stream per job; the stream id is the cursor.
+
+    def __init__(self, url: str = JOB_STORE_URL, ttl: int = JOB_TTL_SECONDS, client=None,
+                 prefix: str = 'docveil:events:'):
+        super().__init__(ttl)
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise ImportError("JOB_STORE=redis requires the 'redis' package: pip install redis") from e
+            client = redis.Redis.from_url(url)
+        self._client = client
+        self.prefix = prefix
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.prefix}{job_id}"
+
+    def publish(self, job_id: str, event: Dict) -> None:
+        key = self._key(job_id)
+        self._client.xadd(key, {'event': self._seal(job_id, event)})
+        self._client.expire(key, self.ttl)
+
+    def read(self, job_id: str, cursor=None) -> Tuple[List[Dict], object]:
+        entries = self._client.xrange(self._key(job_id), min=f"({cursor}" if cursor else '-')
+        if not entries:
+            return [], cursor
+        events = [self._open(job_id, fields.get(b'event', fields.get('event'))) for _, fields in entries]
+        last_id = entries[-1][0]
+        return events, last_id.decode() if isinstance(last_id, bytes) else last_id
+
+    def forget(self, job_id: str) -> None:
+        self._client.delete(self._key(job_id))
+
+
+def create_event_bus(backend: str = JOB_STORE) -> EventBus:
+    if backend == 'sqlite':
+        return SQLiteEventBus()
+    if backend == 'redis':
+        return RedisEventBus()
+    raise ValueError(f"Unknown JOB_STORE '{backend}', expected 'sqlite' or 'redis'")
+
+
+event_bus = create_event_bus()
@@ -0,0 +1,141 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+from cryptography.exceptions import InvalidTag
+from dotenv import load_dotenv
+from encryption import ValueCipher, CACHE_KEY_INFO
+
+load_dotenv()
+
+CACHE_ENABLED = os.getenv("SUMMARY_CACHE_ENABLED", "true").lower() == "true"
+CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", "cache/summaries.db")
+CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "50000"))
+CACHE_MAX_BYTES = int(os.getenv("SUMMARY_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Evict a little below the limit so a full cache does not evict on every put.
+EVICTION_TARGET = 0.9
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text or "").strip()
+
+
+def make_key(kind: str, texts: List[str], template: str, model: str, temperature: float) -> str:
+    digest = hashlib.sha256()
+    for part in [kind, template, model, repr(temperature), *map(normalize_text, texts)]:
+        encoded = part.encode('utf-8')
+        digest.update(len(encoded).to_bytes(8, 'big'))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class SummaryCache:
+    # Summaries are as confidential as the documents: values are encrypted
+    # under their own subkey and bound to their key. Keys are hashes.
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = CACHE_MAX_ENTRIES,
+                 max_bytes: int = CACHE_MAX_BYTES, enabled: bool = CACHE_ENABLED):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._cipher: Optional[ValueCipher] = None
+        self._job_stats: Dict[str, Dict[str, int]] = {}
+        self._refreshing: Set[str] = set()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ':memory:':
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS summaries_last_access ON summaries(last_access)")
+            self._cipher = ValueCipher(CACHE_KEY_INFO)
+            self._conn = conn
+        return self._conn
+
+    def _totals(self) -> Tuple[int, int]:
+        # Read from the database each time: the API and every worker process
+        # write to the same file, so no process can count on its own.
+        return self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM summaries").fetchone()
+
+    def get(self, key: str, job_id: Optional[str] = None) -> Optional[str]:
+        value = None
+        if self.enabled and not self.is_refreshing(job_id):
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute("SELECT value FROM summaries WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    try:
+                        value = self._cipher.decrypt(row[0], key.encode('utf-8')).decode('utf-8')
+                    except (InvalidTag, TypeError, ValueError):
+                        # Written in the clear or under another passphrase.
+                        conn.execute("DELETE FROM summaries WHERE key = ?", (key,))
+                    else:
+                        conn.execute("UPDATE summaries SET last_access = ? WHERE key = ?", (time.time(), key))
+        self._record(job_id, 'hits' if value is not None else 'misses')
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            conn = self._connection()
+            sealed = self._cipher.encrypt(value.encode('utf-8'), key.encode('utf-8'))
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, sealed, len(sealed), time.time())
+            )
+            entries, total = self._totals()
+            if entries > self.max_entries or total > self.max_bytes:
+                self._evict(entries, total)
+
+    def _evict(self, entries: int, total: int) -> None:
+        target_entries = int(self.max_entries * EVICTION_TARGET)
+        target_bytes = int(self.max_bytes * EVICTION_TARGET)
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM summaries ORDER BY last_access"):
+            if entries <= target_entries and total <= target_bytes:
+                break
+            stale.append((key,))
+            entries -= 1
+            total -= size
+        self._conn.executemany("DELETE FROM summaries WHERE key = ?", stale)
+        print(f"Summary cache evicted {len(stale)} entries")
+
+    def _record(self, job_id: Optional[str], outcome: str) -> None:
+        if job_id is None:
+            return
+        stats = self._job_stats.setdefault(job_id, {'hits': 0, 'misses': 0})
+        stats[outcome] += 1
+
+    def job_stats(self, job_id: str) -> Dict[str, int]:
+        return dict(self._job_stats.get(job_id, {'hits': 0, 'misses': 0}))
+
+    def refresh_job(self, job_id: str) -> None:
+        # Until forget_job, lookups for job_id miss, so everything is asked
+        # of the model again; the new answers replace the stored ones.
+        self._refreshing.add(job_id)
+
+    def is_refreshing(self, job_id: Optional[str]) -> bool:
+        return job_id is not None and job_id in self._refreshing
+
+    def forget_job(self, job_id: str) -> None:
+        self._job_stats.pop(job_id, None)
+        self._refreshing.discard(job_id)
+
+
+summary_cache = SummaryCache()
@@ -0,0 +1,187 @@
+import os
+import sys
+import glob
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+import workflow
+from workflow import stream_pdf_summaries, close_checkpoints, forget_checkpoints, cpu_pool
+from scheduler import parse_priority
+from cache import summary_cache
+from metrics import metrics
+from pagestore import release_pages
+
+load_dotenv()
+
+# Documents summarized at once. Their LLM calls share one queue (see
+# LLM_MAX_CONCURRENCY), so this keeps the model busy without adding load.
+CLI_JOBS = int(os.getenv("CLI_JOBS", "4"))
+# Record of summarized files, kept in the output directory.
+MANIFEST_NAME = ".docveil-manifest.json"
+
+
+def find_pdfs(patterns: List[str]) -> List[Path]:
+    # Directories are searched recursively; anything else is a file or a
+    # glob pattern (** included).
+    found = set()
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            matches = path.rglob('*')
+        elif path.is_file():
+            matches = [path]
+        else:
+            matches = (Path(match) for match in glob.glob(pattern, recursive=True))
+        for match in matches:
+            if match.is_file() and match.name.lower().endswith('.pdf'):
+                found.add(match.resolve())
+    return sorted(found)
+
+
+def file_fingerprint(path: Path) -> str:
+    # Same digest the API takes of an upload, so both share stored summaries
+    # of a document (see workflow.document_cache_key).
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    # Maps each summarized PDF (absolute path) to its size, mtime, content
+    # fingerprint and summary file. A PDF is skipped while its entry still
+    # matches and the summary file exists; size and mtime are checked first
+    # so an unchanged tree is not read again.
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: Dict[str, Dict] = json.loads(path.read_text()) if path.exists() else {}
+
+    def is_done(self, pdf: Path) -> bool:
+        entry = self.entries.get(str(pdf))
+        if entry is None or not Path(entry['saved_file']).exists():
+            return False
+        stat = pdf.stat()
+        if (entry['size'], entry['mtime']) == (stat.st_size, stat.st_mtime):
+            return True
+        if entry['fingerprint'] != file_fingerprint(pdf):
+            return False
+        # Touched (copied, synced) but unchanged.
+        self.record(pdf, entry['fingerprint'], entry['saved_file'])
+        return True
+
+    def record(self, pdf: Path, fingerprint: str, saved_file: str) -> None:
+        stat = pdf.stat()
+        self.entries[str(pdf)] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'fingerprint': fingerprint,
+            'saved_file': saved_file,
+        }
+        # Written after every document, so an interrupted run loses nothing.
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_suffix('.tmp')
+        temporary.write_text(json.dumps(self.entries, indent=1))
+        os.replace(temporary, self.path)
+
+
+def job_id_for(pdf: Path, fingerprint: str) -> str:
+    # Stable across runs: a document interrupted mid-way resumes from its
+    # checkpoint the next time.
+    return "cli-" + hashlib.sha256(f"{pdf}\0{fingerprint}".encode('utf-8')).hexdigest()[:32]
+
+
+async def summarize_file(
+    pdf: Path, fingerprint: str, priority: int, pipelined: Optional[bool] = None, force: bool = False,
+) -> str:
+    job_id = job_id_for(pdf, fingerprint)
+    saved_file = None
+    try:
+        if force:
+            # Recomputed from scratch: no stored summaries, no checkpoint.
+            summary_cache.refresh_job(job_id)
+            await forget_checkpoints(job_id)
+        async for summary_data in stream_pdf_summaries(str(pdf), job_id, priority, pipelined, fingerprint):
+            if summary_data['status'] == 'complete':
+                saved_file = summary_data['saved_file']
+        if saved_file is None:
+            raise RuntimeError("Summary stream ended before the document was complete")
+    finally:
+        summary_cache.forget_job(job_id)
+        metrics.forget_job(job_id)
+        # Kept on disk: the next run resumes an unfinished document.
+        release_pages(job_id)
+    return saved_file
+
+
+async def summarize_files(
+    pdfs: List[Path], manifest: Manifest, jobs: int = CLI_JOBS, priority: int = 0,
+    pipelined: Optional[bool] = None, force: bool = False,
+) -> int:
+    # Returns the number of documents that failed.
+    semaphore = asyncio.Semaphore(jobs)
+    loop = asyncio.get_running_loop()
+    finished, failed = 0, 0
+
+    async def process(pdf: Path) -> None:
+        nonlocal finished, failed
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                fingerprint = await loop.run_in_executor(cpu_pool, file_fingerprint, pdf)
+                saved_file = await summarize_file(pdf, fingerprint, priority, pipelined, force)
+                manifest.record(pdf, fingerprint, saved_file)
+            except Exception as e:
+                failed += 1
+                print(f"Failed to summarize {pdf}: {str(e)}")
+                return
+            finished += 1
+            print(f"[{finished}/{len(pdfs)}] {pdf} -> {saved_file} ({time.perf_counter() - started:.1f}s)")
+
+    try:
+        await asyncio.gather(*(process(pdf) for pdf in pdfs))
+    finally:
+        await close_checkpoints()
+    return failed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Summarize PDFs in bulk, without the API")
+    parser.add_argument("paths", nargs="+", help="PDF files, directories (searched recursively) or glob patterns")
+    parser.add_argument("--jobs", type=int, default=CLI_JOBS, help="documents summarized at once")
+    parser.add_argument("--output", default=workflow.SUMMARY_OUTPUT_DIR, help="directory for the summary files")
+    parser.add_argument("--priority", default='bulk', help="LLM queue priority (interactive or bulk)")
+    parser.add_argument("--pipelined", action=argparse.BooleanOptionalAction, default=None,
+                        help="stream pages through both stages (default: PIPELINE_MODE)")
+    parser.add_argument("--force", action="store_true",
+                        help="summarize files again, without stored summaries, even if already done")
+    args = parser.parse_args(argv)
+
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    try:
+        priority = parse_priority(args.priority)
+    except ValueError as e:
+        parser.error(str(e))
+
+    workflow.SUMMARY_OUTPUT_DIR = args.output
+    manifest = Manifest(Path(args.output) / MANIFEST_NAME)
+    pdfs = find_pdfs(args.paths)
+    pending = pdfs if args.force else [pdf for pdf in pdfs if not manifest.is_done(pdf)]
+    print(f"Found {len(pdfs)} PDFs, {len(pdfs) - len(pending)} already summarized, {len(pending)} to do")
+    if not pending:
+        return 0
+
+    failed = asyncio.run(summarize_files(pending, manifest, args.jobs, priority, args.pipelined, args.force))
+    print(f"Summarized {len(pending) - failed} PDFs into {args.output}, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,19 @@
+import io
 import os
+import time
+import struct
+from collections import OrderedDict
+from functools import lru_cache
 from io import BytesIO
 from pathlib import Path
+from typing import Iterator, List, Optional
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 from dotenv import load_dotenv
+from metrics import metrics
 
 load_dotenv()
 
@@ -13,6 +21,38 @@ SALT_SIZE = 16
 NONCE_SIZE = 12
 KEY_SIZE = 32
 PBKDF2_ITERATIONS = 100000
+# Streamed files use per-file HKDF subkeys of a master key that is stretched
+# with PBKDF2 once per process, over a random salt of this deployment: hex in
+# MASTER_KEY_SALT, or else the file at MASTER_KEY_SALT_PATH, created on first
+# start next to the uploads (not in cache/, which is safe to delete). The API
+# and every worker must see the same salt. Legacy single-blob files keep
+# their per-file PBKDF2 key, memoised by salt so repeated reads of the same
+# file do not re-run it.
+MASTER_KEY_SALT = os.getenv("MASTER_KEY_SALT", "")
+MASTER_KEY_SALT_PATH = os.getenv("MASTER_KEY_SALT_PATH", "uploads/.master_key.salt")
+# Reads of a salt file another process is still writing are retried.
+SALT_READ_RETRIES = 100
+FILE_KEY_INFO = b"docveil-file-key"
+CHECKPOINT_KEY_INFO = b"docveil-checkpoint-key"
+PAGE_KEY_INFO = b"docveil-page-key"
+CACHE_KEY_INFO = b"docveil-cache-key"
+EVENT_KEY_INFO = b"docveil-event-key"
+KEY_CACHE_SIZE = int(os.getenv("KEY_CACHE_SIZE", "256"))
+
+# Streamed container: [MAGIC(4)][VERSION(1)][SALT(16)][NONCE_PREFIX(7)][SEGMENT_SIZE(4)]
+# followed by AES-GCM segments of SEGMENT_SIZE plaintext bytes (the last one
+# may be shorter). Each segment nonce is NONCE_PREFIX + counter(4) + last(1),
+# and the header is authenticated as associated data, so reordered, dropped
+# or truncated segments fail to decrypt.
+STREAM_MAGIC = b"DVEL"
+STREAM_VERSION = 1
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+SEGMENT_SIZE = int(os.getenv("ENCRYPTION_SEGMENT_SIZE", str(64 * 1024)))
+STREAM_HEADER = struct.Struct(f">4sB{SALT_SIZE}s{NONCE_PREFIX_SIZE}sI")
+# Decrypted segments kept per reader; pypdf jumps between the trailer, the
+# xref table and the page objects, so a few recent segments cover most reads.
+DECRYPT_CACHE_SEGMENTS = int(os.getenv("DECRYPT_CACHE_SEGMENTS", "16"))
 
 
 def _get_passphrase() -> bytes:
@@ -33,47 +73,374 @@ def _derive_key(passphrase: bytes, salt: bytes) -> bytes:
         iterations=PBKDF2_ITERATIONS,
         backend=default_backend()
     )
-    return kdf.derive(passphrase)
+    with metrics.span('key_derivation'):
+        return kdf.derive(passphrase)
 
 
-def encrypt_file(input_path: str, output_path: str) -> None:
-    passphrase = _get_passphrase()
+def _salted_uploads(directory: Path) -> List[Path]:
+    # Uploads whose key depends on the deployment salt.
+    return [path for path in directory.glob("*.enc") if _is_stream_container(str(path))]
+
+
+def _create_salt(path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    salted = _salted_uploads(path.parent)
+    if salted:
+        # A new salt would not open them: the old one was lost or moved.
+        raise RuntimeError(
+            f"Master key salt {path} is missing but {len(salted)} upload(s) in {path.parent} were "
+            f"encrypted with it; restore the file or set MASTER_KEY_SALT"
+        )
     salt = os.urandom(SALT_SIZE)
-    key = _derive_key(passphrase, salt)
-    
-    aesgcm = AESGCM(key)
-    nonce = os.urandom(NONCE_SIZE)
-    
-    with open(input_path, 'rb') as f:
-        plaintext = f.read()
-    
-    ciphertext = aesgcm.encrypt(nonce, plaintext, None)
-    
-    with open(output_path, 'wb') as f:
-        f.write(salt)
-        f.write(nonce)
-        f.write(ciphertext)
+    # Written aside and linked into place: processes starting together all
+    # end up with the one salt that got there first, never a partial file.
+    temp_path = Path(f"{path}.{os.getpid()}.tmp")
+    temp_path.write_bytes(salt)
+    try:
+        os.link(temp_path, path)
+        return
+    except FileExistsError:
+        return
+    except OSError:
+        # No hard links here (some bind mounts, SMB shares): create it in
+        # place, exclusively. A process reading it meanwhile sees it short
+        # and waits (see deployment_salt).
+        pass
+    finally:
+        temp_path.unlink()
+    try:
+        with open(path, 'xb') as f:
+            f.write(salt)
+    except FileExistsError:
+        pass
+
+
+def deployment_salt() -> bytes:
+    if MASTER_KEY_SALT:
+        salt = bytes.fromhex(MASTER_KEY_SALT)
+    else:
+        path = Path(MASTER_KEY_SALT_PATH)
+        if not path.exists():
+            _create_salt(path)
+        salt = path.read_bytes()
+        for _ in range(SALT_READ_RETRIES):
+            if len(salt) == SALT_SIZE:
+                break
+            time.sleep(0.01)
+            salt = path.read_bytes()
+    if len(salt) != SALT_SIZE:
+        raise ValueError(f"Master key salt must be {SALT_SIZE} bytes, got {len(salt)}")
+    return salt
+
+
+@lru_cache(maxsize=2)
+def _master_key(passphrase: bytes, salt: bytes) -> bytes:
+    return _derive_key(passphrase, salt)
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def _legacy_key(passphrase: bytes, salt: bytes) -> bytes:
+    return _derive_key(passphrase, salt)
+
+
+def _file_key(salt: bytes) -> bytes:
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=KEY_SIZE, salt=salt, info=FILE_KEY_INFO)
+    return hkdf.derive(_master_key(_get_passphrase(), deployment_salt()))
+
+
+class CheckpointCipher:
+    # Cipher for LangGraph's EncryptedSerializer. Checkpoints hold the job's
+    # progress and rolling digest (pages live in the page store), which must
+    # not end up on disk in the clear. One HKDF subkey of the master key
+    # (info CHECKPOINT_KEY_INFO, no salt) covers every checkpoint, with a
+    # random nonce per write.
+    name = 'aesgcm'
+
+    def __init__(self):
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=KEY_SIZE, salt=None, info=CHECKPOINT_KEY_INFO)
+        self._aesgcm = AESGCM(hkdf.derive(_master_key(_get_passphrase(), deployment_salt())))
+
+    def encrypt(self, plaintext: bytes):
+        nonce = os.urandom(NONCE_SIZE)
+        return self.name, nonce + self._aesgcm.encrypt(nonce, plaintext, None)
+
+    def decrypt(self, ciphername: str, ciphertext: bytes) -> bytes:
+        if ciphername != self.name:
+            raise ValueError(f"Unsupported checkpoint cipher: {ciphername}")
+        return self._aesgcm.decrypt(ciphertext[:NONCE_SIZE], ciphertext[NONCE_SIZE:], None)
+
+
+class ValueCipher:
+    # Cipher for values kept in a database: one HKDF subkey per use (info),
+    # and each value authenticated together with the slot it is stored
+    # under, so it cannot be moved to another row.
+
+    def __init__(self, info: bytes, salt: Optional[bytes] = None):
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=KEY_SIZE, salt=salt, info=info)
+        self._aesgcm = AESGCM(hkdf.derive(_master_key(_get_passphrase(), deployment_salt())))
+
+    def encrypt(self, plaintext: bytes, slot: bytes) -> bytes:
+        nonce = os.urandom(NONCE_SIZE)
+        return nonce + self._aesgcm.encrypt(nonce, plaintext, slot)
+
+    def decrypt(self, ciphertext: bytes, slot: bytes) -> bytes:
+        return self._aesgcm.decrypt(ciphertext[:NONCE_SIZE], ciphertext[NONCE_SIZE:], slot)
+
+
+class PageCipher(ValueCipher):
+    # Cipher for a job's page store: a subkey per store, salted like the
+    # stream container; the slot is the page's kind and index.
+
+    def __init__(self, salt: bytes):
+        super().__init__(PAGE_KEY_INFO, salt)
+
+
+def _segment_nonce(prefix: bytes, counter: int, last: bool) -> bytes:
+    return prefix + struct.pack(">IB", counter, 1 if last else 0)
+
+
+class StreamEncryptor:
+    def __init__(self, output_path: str, segment_size: int = SEGMENT_SIZE):
+        salt = os.urandom(SALT_SIZE)
+        self._aesgcm = AESGCM(_file_key(salt))
+        self._prefix = os.urandom(NONCE_PREFIX_SIZE)
+        self._header = STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, salt, self._prefix, segment_size)
+        self.segment_size = segment_size
+        self._buffer = bytearray()
+        self._counter = 0
+        self._file = open(output_path, 'wb')
+        self._file.write(self._header)
+
+    def write(self, data: bytes) -> None:
+        self._buffer += data
+        # Keep at least one byte back: the final segment has to be flagged as
+        # last, and we only know which one that is when close() is called.
+        while len(self._buffer) > self.segment_size:
+            self._write_segment(bytes(self._buffer[:self.segment_size]), last=False)
+            del self._buffer[:self.segment_size]
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self._write_segment(bytes(self._buffer), last=True)
+        self._buffer.clear()
+        self._file.close()
+
+    def abort(self) -> None:
+        self._buffer.clear()
+        self._file.close()
+
+    def _write_segment(self, plaintext: bytes, last: bool) -> None:
+        nonce = _segment_nonce(self._prefix, self._counter, last)
+        with metrics.span('encrypt'):
+            ciphertext = self._aesgcm.encrypt(nonce, plaintext, self._header)
+        self._file.write(ciphertext)
+        self._counter += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def encrypt_file(input_path: str, output_path: str) -> None:
+    with open(input_path, 'rb') as src, StreamEncryptor(output_path) as encryptor:
+        while True:
+            chunk = src.read(encryptor.segment_size)
+            if not chunk:
+                break
+            encryptor.write(chunk)
     
     print(f"Encrypted: {input_path} -> {output_path}")
 
 
-def decrypt_file_to_memory(encrypted_path: str) -> BytesIO:
-    passphrase = _get_passphrase()
-    
+def _is_stream_container(encrypted_path: str) -> bool:
+    with open(encrypted_path, 'rb') as f:
+        head = f.read(len(STREAM_MAGIC) + 1)
+    return head == STREAM_MAGIC + bytes([STREAM_VERSION])
+
+
+def iter_decrypted_chunks(encrypted_path: str) -> Iterator[bytes]:
+    with open(encrypted_path, 'rb') as f:
+        header = f.read(STREAM_HEADER.size)
+        _, _, salt, prefix, segment_size = STREAM_HEADER.unpack(header)
+        aesgcm = AESGCM(_file_key(salt))
+
+        ciphertext_size = segment_size + TAG_SIZE
+        counter = 0
+        segment = f.read(ciphertext_size)
+        while True:
+            next_segment = f.read(ciphertext_size)
+            last = not next_segment
+            with metrics.span('decrypt'):
+                plaintext = aesgcm.decrypt(_segment_nonce(prefix, counter, last), segment, header)
+            yield plaintext
+            if last:
+                break
+            segment = next_segment
+            counter += 1
+
+
+class EncryptedFileReader(io.RawIOBase):
+    # Seekable read-only view of a streamed container. Segments have a fixed
+    # size, so the ciphertext offset of any plaintext position is computed
+    # directly and only the segments a reader touches are decrypted.
+
+    def __init__(self, encrypted_path: str, cache_segments: int = DECRYPT_CACHE_SEGMENTS):
+        super().__init__()
+        self._file = open(encrypted_path, 'rb')
+        try:
+            self._header = self._file.read(STREAM_HEADER.size)
+            _, _, salt, self._prefix, self.segment_size = STREAM_HEADER.unpack(self._header)
+            self._aesgcm = AESGCM(_file_key(salt))
+
+            body_size = os.fstat(self._file.fileno()).st_size - STREAM_HEADER.size
+            ciphertext_size = self.segment_size + TAG_SIZE
+            self._segments = max(1, -(-body_size // ciphertext_size))
+            last_size = body_size - (self._segments - 1) * ciphertext_size - TAG_SIZE
+            if last_size < 0:
+                raise ValueError(f"Truncated encrypted file: {encrypted_path}")
+            self.size = (self._segments - 1) * self.segment_size + last_size
+            self._cache: "OrderedDict[int, bytes]" = OrderedDict()
+            self._cache_segments = max(1, cache_segments)
+            self._position = 0
+            # Authenticate the final segment up front: it carries the "last"
+            # flag, so a truncated file is rejected before any page is parsed.
+            self._segment(self._segments - 1)
+        except Exception:
+            self._file.close()
+            raise
+
+    def _segment(self, index: int) -> bytes:
+        plaintext = self._cache.get(index)
+        if plaintext is not None:
+            self._cache.move_to_end(index)
+            return plaintext
+
+        self._file.seek(STREAM_HEADER.size + index * (self.segment_size + TAG_SIZE))
+        ciphertext = self._file.read(self.segment_size + TAG_SIZE)
+        last = index == self._segments - 1
+        with metrics.span('decrypt'):
+            plaintext = self._aesgcm.decrypt(_segment_nonce(self._prefix, index, last), ciphertext, self._header)
+
+        self._cache[index] = plaintext
+        if len(self._cache) > self._cache_segments:
+            self._cache.popitem(last=False)
+        return plaintext
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError("Negative seek position")
+        self._position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        written = 0
+        while written < len(view) and self._position < self.size:
+            index, offset = divmod(self._position, self.segment_size)
+            chunk = self._segment(index)[offset:offset + len(view) - written]
+            view[written:written + len(chunk)] = chunk
+            written += len(chunk)
+            self._position += len(chunk)
+        return written
+
+    def close(self) -> None:
+        if not self.closed:
+            self._file.close()
+            self._cache.clear()
+        super().close()
+
+
+def open_decrypted(encrypted_path: str):
+    # pypdf only needs a seekable binary stream: streamed containers are
+    # decrypted lazily, legacy single-blob files still have to be loaded whole.
+    if _is_stream_container(encrypted_path):
+        return EncryptedFileReader(encrypted_path)
+    return decrypt_file_to_memory(encrypted_path)
+
+
+def _decrypt_legacy(encrypted_path: str) -> bytes:
     with open(encrypted_path, 'rb') as f:
         salt = f.read(SALT_SIZE)
         nonce = f.read(NONCE_SIZE)
         ciphertext = f.read()
     
-    key = _derive_key(passphrase, salt)
-    aesgcm = AESGCM(key)
+    aesgcm = AESGCM(_legacy_key(_get_passphrase(), salt))
     
-    plaintext = aesgcm.decrypt(nonce, ciphertext, None)
+    with metrics.span('decrypt'):
+        return aesgcm.decrypt(nonce, ciphertext, None)
+
+
+def decrypt_file_to_memory(encrypted_path: str) -> BytesIO:
+    if _is_stream_container(encrypted_path):
+        plaintext = BytesIO()
+        for chunk in iter_decrypted_chunks(encrypted_path):
+            plaintext.write(chunk)
+        plaintext.seek(0)
+    else:
+        # Files written before the streamed container: [SALT][NONCE][CIPHERTEXT]
+        plaintext = BytesIO(_decrypt_legacy(encrypted_path))
     
     print(f"Decrypted to memory: {encrypted_path}")
     
-    return BytesIO(plaintext)
+    return plaintext
+
+
+def needs_migration(encrypted_path: str) -> bool:
+    return not _is_stream_container(encrypted_path)
+
+
+def migrate_file(encrypted_path: str) -> bool:
+    # Re-encrypt a legacy single-blob file into the streamed container in place.
+    if not needs_migration(encrypted_path):
+        return False
+
+    temp_path = f"{encrypted_path}.migrating"
+    try:
+        with open_decrypted(encrypted_path) as src, StreamEncryptor(temp_path) as encryptor:
+            while True:
+                chunk = src.read(encryptor.segment_size)
+                if not chunk:
+                    break
+                encryptor.write(chunk)
+        os.replace(temp_path, encrypted_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+    print(f"Migrated: {encrypted_path}")
+    return True
 
 
 def is_encrypted_file(file_path: str) -> bool:
     return file_path.endswith('.enc')
+
+
+if __name__ == "__main__":
+    import sys
+
+    upload_dir = Path(sys.argv[1] if len(sys.argv) > 1 else "uploads")
+    migrated = sum(migrate_file(str(path)) for path in sorted(upload_dir.glob("*.enc")))
+    print(f"Migrated {migrated} file(s) in {upload_dir}")
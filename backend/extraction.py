@@ -0,0 +1,115 @@
+import os
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Iterator, List, Optional, Tuple
+from pypdf import PdfReader
+from dotenv import load_dotenv
+from encryption import open_decrypted, is_encrypted_file, _is_stream_container
+from metrics import metrics
+
+load_dotenv()
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Below this many pages the worker start-up and per-worker xref parsing cost
+# more than extracting the pages in the calling thread.
+PARALLEL_MIN_PAGES = int(os.getenv("PARALLEL_MIN_PAGES", "32"))
+# Each worker gets a few ranges rather than one, so a run of heavy
+# (scanned) pages does not leave the other workers idle.
+RANGES_PER_WORKER = 2
+# Upper bound on a single range, so the first pages of a long document come
+# back quickly and only a few ranges of text are held at once.
+STREAM_RANGE_PAGES = int(os.getenv("STREAM_RANGE_PAGES", "16"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the parent runs an event loop and thread pools.
+        _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _open_pdf(pdf_path: str):
+    if is_encrypted_file(pdf_path):
+        return open_decrypted(pdf_path)
+    return open(pdf_path, 'rb')
+
+
+def _extract_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    # Runs in a worker process. Workers get the path, not the bytes: each one
+    # reads the file itself and, for encrypted files, only decrypts the
+    # segments its own pages live in.
+    with _open_pdf(pdf_path) as stream:
+        reader = PdfReader(stream)
+        return [reader.pages[index].extract_text() for index in range(start, stop)]
+
+
+def page_ranges(total: int, parts: int, max_size: Optional[int] = None) -> List[Tuple[int, int]]:
+    size = max(1, -(-total // max(1, parts)))
+    if max_size:
+        size = min(size, max_size)
+    return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+
+def _can_parallelize(pdf_path: str) -> bool:
+    if PDF_WORKERS < 2:
+        return False
+    # Legacy single-blob files can only be decrypted whole; doing that once
+    # per worker would cost more than it saves.
+    return not is_encrypted_file(pdf_path) or _is_stream_container(pdf_path)
+
+
+class PageStream:
+    # Yields page texts in order as they are extracted. Only a bounded number
+    # of page ranges is in flight at a time, so memory follows the window,
+    # not the document size.
+
+    def __init__(self, pdf_path: str, job_id: Optional[str] = None):
+        self.pdf_path = pdf_path
+        self.job_id = job_id
+        self._stream = _open_pdf(pdf_path)
+        try:
+            self._reader = PdfReader(self._stream)
+            self.total = len(self._reader.pages)
+        except Exception:
+            self._stream.close()
+            raise
+        self._futures: Deque[Future] = deque()
+
+    def __iter__(self) -> Iterator[str]:
+        if self.total < PARALLEL_MIN_PAGES or not _can_parallelize(self.pdf_path):
+            for page in self._reader.pages:
+                with metrics.span('extract', self.job_id):
+                    page_text = page.extract_text()
+                yield page_text
+            return
+
+        pool = _get_pool()
+        in_flight = PDF_WORKERS * RANGES_PER_WORKER
+        ranges = iter(page_ranges(self.total, in_flight, STREAM_RANGE_PAGES))
+        for start, stop in itertools.islice(ranges, in_flight):
+            self._futures.append(pool.submit(_extract_range, self.pdf_path, start, stop))
+        while self._futures:
+            # In parallel mode 'extract' is the time spent waiting for a
+            # range, i.e. how long extraction held up the caller.
+            with metrics.span('extract', self.job_id):
+                page_texts = self._futures.popleft().result()
+            for start, stop in itertools.islice(ranges, 1):
+                self._futures.append(pool.submit(_extract_range, self.pdf_path, start, stop))
+            yield from page_texts
+
+    def close(self) -> None:
+        for future in self._futures:
+            future.cancel()
+        self._futures.clear()
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,20 +1,18 @@
 from langchain_community.document_loaders import PyPDFLoader
-from langchain_ollama import ChatOllama
 from langchain_core.prompts import PromptTemplate
 import asyncio
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
+from scheduler import scheduler, PRIORITY_INTERACTIVE
+from cache import summary_cache, make_key
+from metrics import metrics
+from backends import llm, draft_llm
+import time
 # import torch
 # import os
 # from diffusers import AutoPipelineForText2Image
 # from PIL import Image as PILImage
 
-
-llm = ChatOllama(
-    model="llama3.1:8b",
-    temperature=0.3
-)
-
 # device = "mps" if torch.backends.mps.is_available() else "cpu"
 # pipe = AutoPipelineForText2Image.from_pretrained(
 #     "stabilityai/sdxl-turbo",
@@ -35,12 +33,12 @@ No text, no watermark, no logo.
 class Image(BaseModel):
     image_name : List[str] = []
 
-llm_stuc = llm.with_structured_output(Image)
+# Structured output goes to the first endpoint only.
+llm_stuc = llm.primary.with_structured_output(Image)
 
-async def summery_asycn(page_contnet:str):
-    prompt = PromptTemplate(
-        input_types={'page_contnet':str},
-        template= """
+SUMMARY_PROMPT = PromptTemplate(
+    input_types={'page_contnet':str},
+    template= """
 You are a summarizer who can generate a detailed summary of {page_contnet}
 
 Format your summary like this:
@@ -59,10 +57,49 @@ IMPORTANT:
 - Do not limit yourself to just 3 points - the examples above are not a maximum
 - Do not use additional asterisks in the points themselves
 """
-    )
-    chain = prompt | llm
-    result = await chain.ainvoke({'page_contnet' : page_contnet})
-    return result.content
+)
+
+
+def _count_usage(stage: str, usage: Optional[Dict], job_id: Optional[str]) -> None:
+    # Ollama reports token counts on the response (the last chunk when
+    # streaming); models that do not are simply not counted.
+    if usage:
+        metrics.count_tokens(stage, usage.get('input_tokens', 0), usage.get('output_tokens', 0), job_id)
+
+
+async def run_chain(chain, inputs: Dict, on_token: Optional[Callable[[str], None]] = None,
+                    stage: str = 'llm', job_id: Optional[str] = None) -> str:
+    # With on_token the model output is streamed and every chunk is handed
+    # over as it arrives; the full text is returned either way.
+    with metrics.span(stage, job_id):
+        if on_token is None:
+            result = await chain.ainvoke(inputs)
+            _count_usage(stage, result.usage_metadata, job_id)
+            return result.content
+
+        parts = []
+        async for chunk in chain.astream(inputs):
+            if chunk.content:
+                parts.append(chunk.content)
+                on_token(chunk.content)
+            _count_usage(stage, chunk.usage_metadata, job_id)
+        return ''.join(parts)
+
+
+async def summery_asycn(page_contnet:str, job_id:str = 'default', priority:int = PRIORITY_INTERACTIVE,
+                        on_token:Optional[Callable[[str], None]] = None):
+    key = make_key('summary', [page_contnet], SUMMARY_PROMPT.template, draft_llm.model, draft_llm.temperature)
+    cached = summary_cache.get(key, job_id)
+    if cached is not None:
+        return cached
+
+    chain = SUMMARY_PROMPT | draft_llm
+    queued = time.perf_counter()
+    async with scheduler.slot(job_id, priority):
+        metrics.observe('llm.wait', time.perf_counter() - queued, job_id)
+        content = await run_chain(chain, {'page_contnet' : page_contnet}, on_token, 'llm.summary', job_id)
+    summary_cache.put(key, content)
+    return content
 
 
 # async def get_image_metadata(summary_text:str) -> Image:
@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+JOB_STORE = os.getenv("JOB_STORE", "sqlite").lower()
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "cache/jobs.db")
+JOB_STORE_URL = os.getenv("JOB_STORE_URL", "redis://localhost:6379/0")
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", str(24 * 60 * 60)))
+
+STATUS_UPLOADED = 'uploaded'
+STATUS_PROCESSING = 'processing'
+STATUS_COMPLETE = 'complete'
+STATUS_ERROR = 'error'
+# Batch records share the store with jobs but are never claimed by workers.
+STATUS_BATCH = 'batch'
+
+
+class JobStore(ABC):
+    # Jobs are plain dicts with at least 'status'. Every write refreshes the
+    # job's TTL; a job that has not been touched for ttl seconds is gone.
+
+    def __init__(self, ttl: int = JOB_TTL_SECONDS):
+        self.ttl = ttl
+
+    @abstractmethod
+    def create(self, job_id: str, job: Dict) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def update(self, job_id: str, **fields) -> bool:
+        ...
+
+    @abstractmethod
+    def transition(self, job_id: str, status: str, from_statuses: Iterable[str], **fields) -> bool:
+        # Atomically move the job to status if it is currently in one of
+        # from_statuses; returns False (and changes nothing) otherwise.
+        ...
+
+    @abstractmethod
+    def delete(self, job_id: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def claim_next(self, worker_id: str, stale_after: float) -> Optional[Tuple[str, Dict]]:
+        # Hand the next queued job (lowest priority value, then oldest) to a
+        # worker by moving it to processing. Jobs whose worker stopped sending
+        # heartbeats for stale_after seconds are handed out again.
+        ...
+
+    def purge_expired(self) -> int:
+        return 0
+
+
+class SQLiteJobStore(JobStore):
+    def __init__(self, path: str = JOB_STORE_PATH, ttl: int = JOB_TTL_SECONDS):
+        super().__init__(ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ':memory:':
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, status TEXT NOT NULL, "
+                "data TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs(expires_at)")
+            self._conn = conn
+        return self._conn
+
+    def create(self, job_id: str, job: Dict) -> None:
+        job = dict(job)
+        status = job.pop('status', STATUS_UPLOADED)
+        with self._lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO jobs (job_id, status, data, expires_at) VALUES (?, ?, ?, ?)",
+                (job_id, status, json.dumps(job), time.time() + self.ttl)
+            )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT status, data FROM jobs WHERE job_id = ? AND expires_at > ?", (job_id, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return {**json.loads(row[1]), 'status': row[0]}
+
+    def _write(self, job_id: str, fields: Dict, status: Optional[str], from_statuses: Optional[Iterable[str]]) -> bool:
+        with self._lock:
+            conn = self._connection()
+            # BEGIN IMMEDIATE takes the write lock up front, so the
+            # read-check-write below is atomic across processes too.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT status, data FROM jobs WHERE job_id = ? AND expires_at > ?", (job_id, time.time())
+                ).fetchone()
+                if row is None or (from_statuses is not None and row[0] not in from_statuses):
+                    conn.execute("ROLLBACK")
+                    return False
+                data = {**json.loads(row[1]), **fields}
+                conn.execute(
+                    "UPDATE jobs SET status = ?, data = ?, expires_at = ? WHERE job_id = ?",
+                    (status or row[0], json.dumps(data), time.time() + self.ttl, job_id)
+                )
+                conn.execute("COMMIT")
+                return True
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def update(self, job_id: str, **fields) -> bool:
+        status = fields.pop('status', None)
+        return self._write(job_id, fields, status, None)
+
+    def transition(self, job_id: str, status: str, from_statuses: Iterable[str], **fields) -> bool:
+        return self._write(job_id, fields, status, tuple(from_statuses))
+
+    def delete(self, job_id: str) -> Optional[Dict]:
+        job = self.get(job_id)
+        with self._lock:
+            self._connection().execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        return job
+
+    def claim_next(self, worker_id: str, stale_after: float) -> Optional[Tuple[str, Dict]]:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT job_id, data FROM jobs WHERE expires_at > ? AND (status = ? OR "
+                    "(status = ? AND COALESCE(json_extract(data, '$.heartbeat'), 0) < ?)) "
+                    "ORDER BY json_extract(data, '$.priority'), rowid LIMIT 1",
+                    (now, STATUS_UPLOADED, STATUS_PROCESSING, now - stale_after)
+                ).fetchone()
+                if row is None:
+                    conn.execute("ROLLBACK")
+                    return None
+                job_id = row[0]
+                data = {**json.loads(row[1]), 'worker': worker_id, 'heartbeat': now}
+                conn.execute(
+                    "UPDATE jobs SET status = ?, data = ?, expires_at = ? WHERE job_id = ?",
+                    (STATUS_PROCESSING, json.dumps(data), now + self.ttl, job_id)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return job_id, {**data, 'status': STATUS_PROCESSING}
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._connection().execute("DELETE FROM jobs WHERE expires_at <= ?", (time.time(),))
+        return cursor.rowcount
+
+
+class RedisJobStore(JobStore):
+    # Works with anything that speaks the redis-py client API, so a local
+    # stand-in (fakeredis, Valkey, KeyDB) can be passed in as client.
+
+    # Queued jobs also sit in a sorted set scored by (priority, upload time),
+    # processing jobs in one scored by their last heartbeat, so jobs of a
+    # worker that died are found and handed out again.
+
+    def __init__(self, url: str = JOB_STORE_URL, ttl: int = JOB_TTL_SECONDS, client=None,
+                 prefix: str = 'docveil:job:'):
+        super().__init__(ttl)
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise ImportError("JOB_STORE=redis requires the 'redis' package: pip install redis") from e
+            client = redis.Redis.from_url(url)
+        self._client = client
+        self.prefix = prefix
+        self.queue_key = f"{prefix}queue"
+        self.processing_key = f"{prefix}processing"
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.prefix}{job_id}"
+
+    def create(self, job_id: str, job: Dict) -> None:
+        job = {'status': STATUS_UPLOADED, **job}
+        self._client.set(self._key(job_id), json.dumps(job), ex=self.ttl)
+        if job['status'] == STATUS_UPLOADED:
+            self._client.zadd(self.queue_key, {job_id: job.get('priority', 0) * 1e12 + time.time()})
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        raw = self._client.get(self._key(job_id))
+        return json.loads(raw) if raw is not None else None
+
+    def _write(self, job_id: str, fields: Dict, from_statuses: Optional[Iterable[str]],
+               check: Optional[Callable[[Dict], bool]] = None) -> bool:
+        key = self._key(job_id)
+        written = False
+
+        def apply(pipe):
+            nonlocal written
+            raw = pipe.get(key)
+            job = json.loads(raw) if raw is not None else None
+            if job is None or (from_statuses is not None and job['status'] not in from_statuses) \
+                    or (check is not None and not check(job)):
+                written = False
+                return
+            job = {**job, **fields}
+            pipe.multi()
+            pipe.set(key, json.dumps(job), ex=self.ttl)
+            if job['status'] == STATUS_PROCESSING:
+                pipe.zadd(self.processing_key, {job_id: job.get('heartbeat', 0)})
+            else:
+                pipe.zrem(self.processing_key, job_id)
+            written = True
+
+        # WATCH/MULTI: retried automatically if another writer touches the key.
+        self._client.transaction(apply, key)
+        return written
+
+    def update(self, job_id: str, **fields) -> bool:
+        return self._write(job_id, fields, None)
+
+    def transition(self, job_id: str, status: str, from_statuses: Iterable[str], **fields) -> bool:
+        return self._write(job_id, {**fields, 'status': status}, tuple(from_statuses))
+
+    def delete(self, job_id: str) -> Optional[Dict]:
+        job = self.get(job_id)
+        self._client.delete(self._key(job_id))
+        self._client.zrem(self.queue_key, job_id)
+        self._client.zrem(self.processing_key, job_id)
+        return job
+
+    def claim_next(self, worker_id: str, stale_after: float) -> Optional[Tuple[str, Dict]]:
+        # Stale jobs first: they have waited longest. The heartbeat is checked
+        # again inside the write, so only one worker takes each over.
+        now = time.time()
+        cutoff = now - stale_after
+        for job_id in self._client.zrangebyscore(self.processing_key, 0, cutoff):
+            job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+            if self._write(job_id, {'worker': worker_id, 'heartbeat': now}, (STATUS_PROCESSING,),
+                           check=lambda job: job.get('heartbeat', 0) < cutoff):
+                job = self.get(job_id)
+                if job is not None:
+                    return job_id, job
+            elif self.get(job_id) is None:
+                # Expired with its TTL.
+                self._client.zrem(self.processing_key, job_id)
+
+        while True:
+            popped = self._client.zpopmin(self.queue_key)
+            if not popped:
+                return None
+            job_id = popped[0][0]
+            job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+            if self.transition(job_id, STATUS_PROCESSING, (STATUS_UPLOADED,), worker=worker_id, heartbeat=time.time()):
+                job = self.get(job_id)
+                if job is not None:
+                    return job_id, job
+
+
+def create_job_store(backend: str = JOB_STORE) -> JobStore:
+    if backend == 'sqlite':
+        return SQLiteJobStore()
+    if backend == 'redis':
+        return RedisJobStore()
+    raise ValueError(f"Unknown JOB_STORE '{backend}', expected 'sqlite' or 'redis'")
+
+
+job_store = create_job_store()
@@ -1,17 +1,11 @@
 import asyncio
 from langchain_community.document_loaders import PyPDFLoader
-from langchain_ollama import ChatOllama
 from langchain_core.prompts import PromptTemplate
 from langgraph.graph import START , END  , StateGraph
 from pydantic import BaseModel , Field
 from typing import List, Annotated , Dict
 from helper_function import * 
-
-
-llm = ChatOllama(
-    model="llama3.1:8b",
-    temperature=0.3
-)
+from backends import llm
 
 
 REFINE_PROMPT = PromptTemplate(
@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Every process (API, job workers, PDF extraction workers) writes its totals
+# here; /metrics adds them up. Use a directory all processes on the host share.
+METRICS_DIR = os.getenv("METRICS_DIR", "cache/metrics")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+# Histogram bounds in seconds: from a single AES segment up to a slow LLM call.
+STAGE_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _empty_stage(buckets: int) -> Dict:
+    return {'buckets': [0] * buckets, 'count': 0, 'sum': 0.0}
+
+
+class Metrics:
+    # Stage timings (histograms), LLM token counters and per-job breakdowns.
+    # Stages are dotted names: node.<graph node>, llm.summary, llm.batch
+    # (packed short pages), llm.merge (split long pages), llm.refine,
+    # llm.memory (rolling document digest), llm.wait (time queued in the scheduler), decrypt, extract, encrypt and
+    # key_derivation.
+
+    def __init__(self, directory: str = METRICS_DIR, enabled: bool = METRICS_ENABLED,
+                 buckets=STAGE_BUCKETS, flush_interval: float = METRICS_FLUSH_SECONDS):
+        self.directory = directory
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict] = {}
+        self._tokens: Dict[str, Dict[str, int]] = {}
+        self._jobs: Dict[str, Dict] = {}
+        self._last_flush = time.monotonic()
+
+    def observe(self, stage: str, seconds: float, job_id: Optional[str] = None) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._stages.setdefault(stage, _empty_stage(len(self.buckets)))
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    entry['buckets'][index] += 1
+            entry['count'] += 1
+            entry['sum'] += seconds
+            if job_id is not None:
+                stages = self._jobs.setdefault(job_id, {'stages': {}, 'tokens': {}})['stages']
+                timing = stages.setdefault(stage, {'count': 0, 'seconds': 0.0})
+                timing['count'] += 1
+                timing['seconds'] += seconds
+        self._maybe_flush()
+
+    @contextmanager
+    def span(self, stage: str, job_id: Optional[str] = None) -> Iterator[None]:
+        # Also usable around awaits; failed calls are timed too.
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, job_id)
+
+    def count_tokens(self, stage: str, prompt: int, completion: int, job_id: Optional[str] = None) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            targets = [self._tokens.setdefault(stage, {'prompt': 0, 'completion': 0})]
+            if job_id is not None:
+                job_tokens = self._jobs.setdefault(job_id, {'stages': {}, 'tokens': {}})['tokens']
+                targets.append(job_tokens)
+            for tokens in targets:
+                tokens['prompt'] = tokens.get('prompt', 0) + prompt
+                tokens['completion'] = tokens.get('completion', 0) + completion
+
+    def job_stats(self, job_id: str) -> Dict:
+        with self._lock:
+            stats = self._jobs.get(job_id, {'stages': {}, 'tokens': {}})
+            return json.loads(json.dumps(stats))
+
+    def forget_job(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return json.loads(json.dumps({'stages': self._stages, 'tokens': self._tokens}))
+
+    def _path(self, pid: int) -> Path:
+        return Path(self.directory) / f"{pid}.json"
+
+    def _maybe_flush(self) -> None:
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.enabled:
+            return
+        self._last_flush = time.monotonic()
+        path = self._path(os.getpid())
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp = path.with_suffix('.tmp')
+            temp.write_text(json.dumps(self.snapshot()))
+            os.replace(temp, path)
+        except OSError as e:
+            print(f"Could not write metrics to {path}: {e}")
+
+    def collect(self) -> Dict:
+        # This process's live totals plus the last snapshot of every other one.
+        merged = self.snapshot()
+        directory = Path(self.directory)
+        if directory.is_dir():
+            for path in directory.glob("*.json"):
+                if path == self._path(os.getpid()):
+                    continue
+                try:
+                    other = json.loads(path.read_text())
+                except (OSError, ValueError):
+                    continue
+                _merge(merged, other, len(self.buckets))
+        return merged
+
+    def purge_expired(self, max_age: float) -> int:
+        # Snapshots of processes that stopped long ago.
+        removed = 0
+        directory = Path(self.directory)
+        if directory.is_dir():
+            cutoff = time.time() - max_age
+            for path in directory.glob("*.json"):
+                if path != self._path(os.getpid()) and path.stat().st_mtime < cutoff:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+        return removed
+
+    def render(self, snapshot: Optional[Dict] = None) -> str:
+        # Prometheus text exposition format.
+        snapshot = snapshot if snapshot is not None else self.collect()
+        lines: List[str] = [
+            "# HELP docveil_stage_seconds Time spent per pipeline stage.",
+            "# TYPE docveil_stage_seconds histogram",
+        ]
+        for stage, entry in sorted(snapshot['stages'].items()):
+            for bound, count in zip(self.buckets, entry['buckets']):
+                lines.append(f'docveil_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'docveil_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {entry["count"]}')
+            lines.append(f'docveil_stage_seconds_sum{{stage="{stage}"}} {entry["sum"]:.6f}')
+            lines.append(f'docveil_stage_seconds_count{{stage="{stage}"}} {entry["count"]}')
+        lines += [
+            "# HELP docveil_llm_tokens_total Tokens sent to and generated by the LLM.",
+            "# TYPE docveil_llm_tokens_total counter",
+        ]
+        for stage, tokens in sorted(snapshot['tokens'].items()):
+            for kind in ('prompt', 'completion'):
+                lines.append(f'docveil_llm_tokens_total{{stage="{stage}",kind="{kind}"}} {tokens.get(kind, 0)}')
+        return "\n".join(lines) + "\n"
+
+
+def _merge(target: Dict, other: Dict, buckets: int) -> None:
+    for stage, entry in other.get('stages', {}).items():
+        if len(entry.get('buckets', [])) != buckets:
+            continue
+        merged = target['stages'].setdefault(stage, _empty_stage(buckets))
+        merged['buckets'] = [a + b for a, b in zip(merged['buckets'], entry['buckets'])]
+        merged['count'] += entry['count']
+        merged['sum'] += entry['sum']
+    for stage, tokens in other.get('tokens', {}).items():
+        merged = target['tokens'].setdefault(stage, {'prompt': 0, 'completion': 0})
+        for kind, value in tokens.items():
+            merged[kind] = merged.get(kind, 0) + value
+
+
+metrics = Metrics()
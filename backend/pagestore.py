@@ -0,0 +1,188 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Union
+from dotenv import load_dotenv
+from encryption import PageCipher, SALT_SIZE
+
+load_dotenv()
+
+# One encrypted SQLite file per job holds its extracted page text, page
+# drafts and refined pages. They outlive the worker process, so a resumed
+# job finds them next to its checkpoint.
+PAGE_STORE_DIR = os.getenv("PAGE_STORE_DIR", "cache/pages")
+# Decrypted pages kept in memory per store. Refinement reads every draft
+# twice (as the page and as the next page's context), close together.
+PAGE_STORE_CACHE = int(os.getenv("PAGE_STORE_CACHE", "32"))
+
+KIND_TEXT = 'text'
+KIND_DRAFT = 'draft'
+KIND_REFINED = 'refined'
+
+
+def _file_name(job_id: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", job_id) + ".db"
+
+
+class PageStore:
+    # Pages are addressed by (kind, zero-based index). Only the pages a
+    # caller is working on, plus a small cache, are held in memory.
+
+    def __init__(self, job_id: str, directory: str = PAGE_STORE_DIR, cache_pages: int = PAGE_STORE_CACHE):
+        self.job_id = job_id
+        self.path = Path(directory) / _file_name(job_id)
+        self.cache_pages = cache_pages
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._cipher: Optional[PageCipher] = None
+        self._cache: "OrderedDict[tuple, str]" = OrderedDict()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "kind TEXT NOT NULL, page INTEGER NOT NULL, data BLOB NOT NULL, "
+                "PRIMARY KEY (kind, page)) WITHOUT ROWID"
+            )
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('salt', ?)", (os.urandom(SALT_SIZE),))
+            salt = conn.execute("SELECT value FROM meta WHERE key = 'salt'").fetchone()[0]
+            self._cipher = PageCipher(salt)
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _slot(kind: str, index: int) -> bytes:
+        return f"{kind}:{index}".encode('utf-8')
+
+    def _remember(self, kind: str, index: int, text: str) -> None:
+        self._cache[(kind, index)] = text
+        self._cache.move_to_end((kind, index))
+        while len(self._cache) > self.cache_pages:
+            self._cache.popitem(last=False)
+
+    def put(self, kind: str, index: int, text: str) -> None:
+        self.put_many(kind, index, [text])
+
+    def put_many(self, kind: str, start: int, texts: List[str]) -> None:
+        with self._lock:
+            conn = self._connection()
+            rows = [
+                (kind, index, self._cipher.encrypt(text.encode('utf-8'), self._slot(kind, index)))
+                for index, text in enumerate(texts, start)
+            ]
+            conn.executemany("INSERT OR REPLACE INTO pages (kind, page, data) VALUES (?, ?, ?)", rows)
+            for index, text in enumerate(texts, start):
+                self._remember(kind, index, text)
+
+    def get(self, kind: str, index: int) -> str:
+        with self._lock:
+            text = self._cache.get((kind, index))
+            if text is not None:
+                self._cache.move_to_end((kind, index))
+                return text
+            row = self._connection().execute(
+                "SELECT data FROM pages WHERE kind = ? AND page = ?", (kind, index)
+            ).fetchone()
+            if row is None:
+                raise IndexError(f"No {kind} page {index} for job {self.job_id}")
+            text = self._cipher.decrypt(row[0], self._slot(kind, index)).decode('utf-8')
+            self._remember(kind, index, text)
+            return text
+
+    def count(self, kind: str) -> int:
+        with self._lock:
+            row = self._connection().execute("SELECT COUNT(*) FROM pages WHERE kind = ?", (kind,)).fetchone()
+            return row[0]
+
+    def pages(self, kind: str, length: Optional[int] = None) -> "PageView":
+        return PageView(self, kind, length)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._cache.clear()
+
+    def delete(self) -> None:
+        self.close()
+        for suffix in ('', '-wal', '-shm'):
+            Path(f"{self.path}{suffix}").unlink(missing_ok=True)
+
+
+class PageView(Sequence):
+    # Read-only list of one kind of page, read from the store on access, so
+    # code written for List[str] can work on a store without loading it.
+    # Pass length when it is known; counting the pages is a scan.
+
+    def __init__(self, store: PageStore, kind: str, length: Optional[int] = None):
+        self.store = store
+        self.kind = kind
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.store.count(self.kind) if self.length is None else self.length
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(index, slice):
+            return [self.store.get(self.kind, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        return self.store.get(self.kind, index)
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self)):
+            yield self.store.get(self.kind, index)
+
+
+_stores: Dict[str, PageStore] = {}
+_stores_lock = threading.Lock()
+
+
+def page_store(job_id: str) -> PageStore:
+    with _stores_lock:
+        store = _stores.get(job_id)
+        if store is None:
+            store = _stores[job_id] = PageStore(job_id, PAGE_STORE_DIR)
+        return store
+
+
+def release_pages(job_id: str) -> None:
+    # Closes the job's store in this process and drops its cached pages. The
+    # file stays, for a worker that resumes the job later.
+    with _stores_lock:
+        store = _stores.pop(job_id, None)
+    if store is not None:
+        store.close()
+
+
+def discard_pages(job_id: str) -> None:
+    with _stores_lock:
+        store = _stores.pop(job_id, None) or PageStore(job_id, PAGE_STORE_DIR)
+    store.delete()
+
+
+def purge_expired(max_age: float, keep=lambda job_id: False) -> int:
+    # Stores of jobs that stopped long ago without finishing or being
+    # cleaned up. keep(job_id) protects stores of jobs that still exist.
+    removed = 0
+    directory = Path(PAGE_STORE_DIR)
+    if directory.is_dir():
+        cutoff = time.time() - max_age
+        for path in directory.glob("*.db"):
+            # Writes land in the -wal file until SQLite checkpoints it.
+            wal = Path(f"{path}-wal")
+            modified = max(path.stat().st_mtime, wal.stat().st_mtime if wal.exists() else 0)
+            if modified < cutoff and not keep(path.stem):
+                discard_pages(path.stem)
+                removed += 1
+    return removed
@@ -0,0 +1,165 @@
+import os
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+from dotenv import load_dotenv
+from backends import draft_llm
+
+load_dotenv()
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+PRIORITY_NAMES = {
+    'interactive': PRIORITY_INTERACTIVE,
+    'bulk': PRIORITY_BULK,
+}
+
+# 0: the draft endpoints' total capacity (see LLM_ENDPOINT_CONCURRENCY), so
+# every slot granted here is a call a server takes at once. Beyond it, calls
+# would wait in the endpoint pool, which knows nothing of priorities.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY") or "0") or draft_llm.capacity
+# 0: refine calls share the draft queue above (jumping ahead of their own
+# job's drafts). Set it when refinement runs on its own model or servers, so
+# the two stages are limited separately.
+LLM_REFINE_CONCURRENCY = int(os.getenv("LLM_REFINE_CONCURRENCY", "0"))
+
+
+class LLMScheduler:
+    # Lanes are served strictly by priority. Inside a lane, jobs take turns
+    # (round-robin), so one 400-page upload cannot starve a 3-page one.
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self._active = 0
+        self._lanes: Dict[int, "OrderedDict[str, Deque[asyncio.Future]]"] = {}
+        self._running: Dict[str, int] = {}
+
+    async def acquire(self, job_id: str, priority: int = PRIORITY_INTERACTIVE, front: bool = False) -> None:
+        if self._active < self.max_concurrency and not self._has_waiters():
+            self._grant(job_id)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        lane = self._lanes.setdefault(priority, OrderedDict())
+        queue = lane.setdefault(job_id, deque())
+        if front:
+            queue.appendleft(future)
+        else:
+            queue.append(future)
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(job_id)
+            else:
+                self._discard(priority, job_id, future)
+            raise
+
+    def release(self, job_id: str) -> None:
+        self._active -= 1
+        self._running[job_id] -= 1
+        if not self._running[job_id]:
+            del self._running[job_id]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, job_id: str, priority: int = PRIORITY_INTERACTIVE, front: bool = False):
+        await self.acquire(job_id, priority, front)
+        try:
+            yield
+        finally:
+            self.release(job_id)
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        # Number of other jobs that will be served before this job's next
+        # waiting request, or None when the job has nothing queued.
+        ahead = 0
+        for priority in sorted(self._lanes):
+            lane = self._lanes[priority]
+            if job_id in lane:
+                return ahead + list(lane).index(job_id)
+            ahead += len(lane)
+        return None
+
+    def job_status(self, job_id: str) -> Dict:
+        return {
+            'queue_position': self.queue_position(job_id),
+            'queued_requests': sum(len(lane.get(job_id, ())) for lane in self._lanes.values()),
+            'running_requests': self._running.get(job_id, 0),
+        }
+
+    def idle_slots(self) -> int:
+        # Slots free with nothing queued for them: the backend has room for
+        # more work than the current jobs are sending.
+        return 0 if self._has_waiters() else self.max_concurrency - self._active
+
+    def _grant(self, job_id: str) -> None:
+        self._active += 1
+        self._running[job_id] = self._running.get(job_id, 0) + 1
+
+    def _has_waiters(self) -> bool:
+        return any(self._lanes.values())
+
+    def _dispatch(self) -> None:
+        while self._active < self.max_concurrency:
+            future, job_id = self._next_waiter()
+            if future is None:
+                return
+            self._grant(job_id)
+            future.set_result(None)
+
+    def _next_waiter(self):
+        for priority in sorted(self._lanes):
+            lane = self._lanes[priority]
+            while lane:
+                job_id, queue = next(iter(lane.items()))
+                future = queue.popleft()
+                if queue:
+                    lane.move_to_end(job_id)
+                else:
+                    del lane[job_id]
+                if not future.done():
+                    return future, job_id
+        return None, None
+
+    def _discard(self, priority: int, job_id: str, future: asyncio.Future) -> None:
+        lane = self._lanes.get(priority, {})
+        queue = lane.get(job_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            pass
+        if not queue:
+            del lane[job_id]
+
+
+scheduler = LLMScheduler()
+refine_scheduler = LLMScheduler(LLM_REFINE_CONCURRENCY) if LLM_REFINE_CONCURRENCY else scheduler
+
+
+def job_status(job_id: str) -> Dict:
+    status = scheduler.job_status(job_id)
+    if refine_scheduler is not scheduler:
+        refine = refine_scheduler.job_status(job_id)
+        positions = [p for p in (status['queue_position'], refine['queue_position']) if p is not None]
+        status = {
+            'queue_position': min(positions, default=None),
+            'queued_requests': status['queued_requests'] + refine['queued_requests'],
+            'running_requests': status['running_requests'] + refine['running_requests'],
+        }
+    return status
+
+
+def parse_priority(value: Optional[str]) -> int:
+    if value is None:
+        return PRIORITY_INTERACTIVE
+    if value not in PRIORITY_NAMES:
+        raise ValueError(f"Unknown priority '{value}', expected one of {list(PRIORITY_NAMES)}")
+    return PRIORITY_NAMES[value]
@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import backends
+from backends import BackendPool, Endpoint, NoBackendAvailable, load_endpoints
+
+
+class StubOllama:
+    # Minimal Ollama server: /api/tags for health checks, /api/chat streaming
+    # the reply "stub <port>" as NDJSON. Records its peak concurrency.
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.failing = False
+        # Calls answered with an error before the stub starts working.
+        self.fail_calls = 0
+        self.calls = 0
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, lines):
+                body = b"".join(json.dumps(line).encode() + b"\n" for line in lines)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if stub.failing:
+                    return self._send(503, [{'error': 'down'}])
+                self._send(200, [{'models': []}])
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with stub._lock:
+                    flaky = stub.fail_calls > 0
+                    stub.fail_calls -= flaky
+                if stub.failing or flaky:
+                    return self._send(500, [{'error': 'model crashed'}])
+                with stub._lock:
+                    stub.calls += 1
+                    stub.active += 1
+                    stub.peak = max(stub.peak, stub.active)
+                time.sleep(stub.delay)
+                with stub._lock:
+                    stub.active -= 1
+                base = {'model': 'stub', 'created_at': '2024-01-01T00:00:00Z'}
+                self._send(200, [
+                    {**base, 'message': {'role': 'assistant', 'content': 'stub '}, 'done': False},
+                    {**base, 'message': {'role': 'assistant', 'content': str(stub.port)}, 'done': False},
+                    {**base, 'message': {'role': 'assistant', 'content': ''}, 'done': True,
+                     'done_reason': 'stop', 'prompt_eval_count': 3, 'eval_count': 2},
+                ])
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _pool(stubs, max_concurrency=1):
+    return BackendPool([Endpoint(stub.url, model='stub', max_concurrency=max_concurrency) for stub in stubs],
+                       model='stub')
+
+
+def test_least_outstanding_routing():
+    stubs = [StubOllama(delay=0.2), StubOllama(delay=0.2)]
+    pool = _pool(stubs)
+    try:
+        async def run():
+            return await asyncio.gather(*(pool.ainvoke(f"page {i}") for i in range(4)))
+
+        replies = asyncio.run(run())
+    finally:
+        for stub in stubs:
+            stub.close()
+
+    assert sorted(reply.content for reply in replies) == sorted(
+        [f"stub {stubs[0].port}"] * 2 + [f"stub {stubs[1].port}"] * 2
+    )
+    # The cap of one call per endpoint held; the other calls waited.
+    assert [stub.peak for stub in stubs] == [1, 1]
+    assert all(endpoint.outstanding == 0 for endpoint in pool.endpoints)
+    print("✅ Least-outstanding routing test passed")
+
+
+def test_failover_and_recovery():
+    stubs = [StubOllama(), StubOllama()]
+    stubs[0].failing = True
+    pool = _pool(stubs, max_concurrency=2)
+    retry = backends.LLM_RETRY_SECONDS
+    backends.LLM_RETRY_SECONDS = 0.1
+    try:
+        async def run():
+            first = await pool.ainvoke("page")
+            streamed = [chunk.content async for chunk in pool.astream("page")]
+            stubs[0].failing = False
+            await asyncio.sleep(0.25)
+            recovered = await asyncio.gather(pool.ainvoke("page"), pool.ainvoke("page"))
+            return first, streamed, recovered
+
+        first, streamed, recovered = asyncio.run(run())
+    finally:
+        backends.LLM_RETRY_SECONDS = retry
+        for stub in stubs:
+            stub.close()
+
+    assert first.content == f"stub {stubs[1].port}"
+    assert "".join(streamed) == f"stub {stubs[1].port}"
+    # After the back-off the first endpoint passed its health check and took
+    # traffic again.
+    assert stubs[0].calls >= 1
+    assert pool.status()[0]['healthy']
+    assert len(recovered) == 2
+    print("✅ Failover test passed")
+
+
+def test_all_endpoints_failing():
+    stub = StubOllama()
+    stub.failing = True
+    pool = _pool([stub])
+    try:
+        asyncio.run(pool.ainvoke("page"))
+        assert False, "expected the endpoint error"
+    except NoBackendAvailable:
+        assert False, "the endpoint's own error should surface"
+    except Exception:
+        pass
+    finally:
+        stub.close()
+    assert not pool.status()[0]['healthy']
+    print("✅ All-endpoints-failing test passed")
+
+
+def test_transient_failure_only_fails_its_call():
+    stub = StubOllama(delay=0.05)
+    stub.fail_calls = 1
+    pool = _pool([stub])
+    retry = backends.LLM_RETRY_SECONDS
+    backends.LLM_RETRY_SECONDS = 0.1
+    try:
+        async def run():
+            return await asyncio.gather(*(pool.ainvoke(f"page {i}") for i in range(4)), return_exceptions=True)
+
+        replies = asyncio.run(run())
+    finally:
+        backends.LLM_RETRY_SECONDS = retry
+        stub.close()
+
+    # The calls queued behind the failed one waited out the back-off and
+    # ran once the endpoint passed its health check.
+    failed = [reply for reply in replies if isinstance(reply, BaseException)]
+    assert len(failed) == 1 and not isinstance(failed[0], NoBackendAvailable)
+    assert [reply.content for reply in replies if not isinstance(reply, BaseException)] == [f"stub {stub.port}"] * 3
+    assert pool.status()[0]['healthy']
+    print("✅ Transient failure test passed")
+
+
+def test_fallback_model():
+    primary, spare = StubOllama(), StubOllama()
+    primary.failing = True
+    fallback = BackendPool([Endpoint(spare.url, model='small')], model='small')
+    pool = BackendPool([Endpoint(primary.url, model='big')], model='big', fallback=fallback)
+    try:
+        async def run():
+            reply = await pool.ainvoke("page")
+            streamed = [chunk.content async for chunk in pool.astream("page")]
+            return reply, streamed
+
+        reply, streamed = asyncio.run(run())
+    finally:
+        primary.close()
+        spare.close()
+
+    assert reply.content == f"stub {spare.port}"
+    assert "".join(streamed) == f"stub {spare.port}"
+    print("✅ Fallback model test passed")
+
+
+def test_cancelled_acquire_keeps_slots():
+    endpoint = Endpoint('http://unused:11434', model='m', max_concurrency=1, client=object())
+    pool = BackendPool([endpoint], model='m')
+
+    async def slow_check():
+        await asyncio.sleep(10)
+        return True
+
+    async def scenario():
+        # Cancelled during the health check of a recovering endpoint.
+        endpoint.failures, endpoint.down_until = 1, 0.0
+        endpoint.check = slow_check
+        checking = asyncio.create_task(pool._acquire(set()))
+        await asyncio.sleep(0.01)
+        checking.cancel()
+        await asyncio.gather(checking, return_exceptions=True)
+        assert endpoint.outstanding == 0
+
+        # Woken by a release, then cancelled before taking the slot: the
+        # wakeup goes to the next waiter.
+        endpoint.failures = 0
+        held = await pool._acquire(set())
+        first = asyncio.create_task(pool._acquire(set()))
+        second = asyncio.create_task(pool._acquire(set()))
+        await asyncio.sleep(0.01)
+        pool._release(held)
+        first.cancel()
+        assert await asyncio.wait_for(second, timeout=1) is endpoint
+        await asyncio.gather(first, return_exceptions=True)
+        assert endpoint.outstanding == 1
+
+    asyncio.run(scenario())
+    print("✅ Cancelled acquire test passed")
+
+
+def test_stage_endpoints_from_file():
+    path = os.path.join(tempfile.mkdtemp(), 'endpoints.json')
+    with open(path, 'w') as f:
+        json.dump([
+            {'url': 'http://small:11434', 'stages': ['draft'], 'max_concurrency': 8},
+            {'url': 'http://big:11434', 'stages': ['refine']},
+            {'url': 'http://spare:11434'},
+        ], f)
+
+    draft = load_endpoints(path=path, model='m', stage='draft')
+    refine = load_endpoints(path=path, model='m', stage='refine')
+    assert [endpoint.url for endpoint in draft] == ['http://small:11434', 'http://spare:11434']
+    assert draft[0].max_concurrency == 8
+    assert [endpoint.url for endpoint in refine] == ['http://big:11434', 'http://spare:11434']
+    print("✅ Stage endpoint config test passed")
+
+
+def test_load_endpoints_from_env_spec():
+    endpoints = load_endpoints("http://a:11434, http://b:11434/", path=None, model='m')
+    assert [(endpoint.url, endpoint.kind, endpoint.model) for endpoint in endpoints] == [
+        ('http://a:11434', 'ollama', 'm'), ('http://b:11434', 'ollama', 'm')
+    ]
+    print("✅ Endpoint config test passed")
+
+
+if __name__ == "__main__":
+    test_least_outstanding_routing()
+    test_failover_and_recovery()
+    test_all_endpoints_failing()
+    test_transient_failure_only_fails_its_call()
+    test_fallback_model()
+    test_cancelled_acquire_keeps_slots()
+    test_stage_endpoints_from_file()
+    test_load_endpoints_from_env_spec()
+    sys.exit(0)
@@ -0,0 +1,142 @@
+import io
+import os
+import sys
+import zipfile
+import asyncio
+import tempfile
+from pathlib import Path
+import batches
+import worker
+from jobs import SQLiteJobStore
+from bus import SQLiteEventBus
+
+
+def _zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def test_documents_from_uploads_zips_and_directories():
+    directory = Path(tempfile.mkdtemp()).resolve()
+    (directory / 'nested').mkdir()
+    (directory / 'nested' / 'c.PDF').write_bytes(b'%PDF c')
+    (directory / 'notes.txt').write_bytes(b'notes')
+
+    uploads = [
+        ('a.pdf', io.BytesIO(b'%PDF a')),
+        ('archive.zip', _zip({'b.pdf': b'%PDF b', 'readme.md': b'#', '__MACOSX/._b.pdf': b'x'})),
+        ('picture.png', io.BytesIO(b'png')),
+    ]
+    skipped = []
+    found = [(name, f.read()) for name, f in batches.iter_documents(uploads, directory, skipped)]
+
+    assert found == [('a.pdf', b'%PDF a'), ('b.pdf', b'%PDF b'), (os.path.join('nested', 'c.PDF'), b'%PDF c')]
+    assert skipped == ['archive.zip/readme.md', 'picture.png', 'notes.txt']
+    print("✅ Batch document discovery test passed")
+
+
+def test_directories_are_confined_to_the_root():
+    root = tempfile.mkdtemp()
+    os.mkdir(os.path.join(root, 'inbox'))
+    assert batches.resolve_directory('inbox', root) == Path(root, 'inbox').resolve()
+    for directory, root_setting, error in (
+        ('inbox', '', PermissionError),
+        ('../', root, PermissionError),
+        ('/etc', root, PermissionError),
+        ('missing', root, FileNotFoundError),
+    ):
+        try:
+            batches.resolve_directory(directory, root_setting)
+            assert False, f"{directory} should be rejected"
+        except error:
+            pass
+    print("✅ Batch directory confinement test passed")
+
+
+def test_links_out_of_the_directory_are_skipped():
+    root = Path(tempfile.mkdtemp()).resolve()
+    outside = Path(tempfile.mkdtemp()).resolve()
+    (outside / 'secret.pdf').write_bytes(b'%PDF secret')
+    (outside / 'folder').mkdir()
+    (outside / 'folder' / 'other.pdf').write_bytes(b'%PDF other')
+    (root / 'inbox').mkdir()
+    (root / 'inbox' / 'a.pdf').write_bytes(b'%PDF a')
+    (root / 'inbox' / 'alias.pdf').symlink_to(root / 'inbox' / 'a.pdf')
+    (root / 'inbox' / 'secret.pdf').symlink_to(outside / 'secret.pdf')
+    (root / 'inbox' / 'folder').symlink_to(outside / 'folder', target_is_directory=True)
+
+    directory = batches.resolve_directory('inbox', str(root))
+    skipped = []
+    found = [(name, f.read()) for name, f in batches.iter_documents([], directory, skipped)]
+
+    assert found == [('a.pdf', b'%PDF a'), ('alias.pdf', b'%PDF a')]
+    assert 'secret.pdf' in skipped
+    print("✅ Batch link confinement test passed")
+
+
+def test_batch_progress_aggregates_jobs():
+    store = SQLiteJobStore(path=':memory:', ttl=60)
+    original = batches.job_store
+    batches.job_store = store
+    try:
+        store.create('done', {'filename': 'a.pdf', 'total_pages': 3, 'pages_done': 3, 'status': 'complete'})
+        store.create('running', {'filename': 'b.pdf', 'total_pages': 10, 'pages_done': 4, 'status': 'processing'})
+        store.create('queued', {'filename': 'c.pdf', 'status': 'uploaded'})
+        batches.create_batch('batch-1', ['done', 'running', 'queued', 'gone'], ['notes.txt'], 1)
+
+        progress = batches.batch_progress('batch-1')
+        assert batches.batch_progress('done') is None
+        assert batches.batch_progress('missing') is None
+    finally:
+        batches.job_store = original
+
+    assert progress['status'] == 'processing'
+    assert progress['documents'] == 4
+    assert progress['counts'] == {'uploaded': 1, 'processing': 1, 'complete': 1, 'error': 0, 'expired': 1}
+    assert (progress['pages_done'], progress['pages_total']) == (7, 13)
+    assert progress['skipped'] == ['notes.txt']
+    assert [job['status'] for job in progress['jobs']] == ['complete', 'processing', 'uploaded', 'expired']
+    print("✅ Batch progress test passed")
+
+
+def test_worker_records_pages_done():
+    store, bus = SQLiteJobStore(path=':memory:', ttl=60), SQLiteEventBus(path=':memory:')
+    seen = []
+
+    async def fake_stream(pdf_path, job_id, priority, pipelined, fingerprint, after_page, deltas):
+        for page in range(after_page + 1, 4):
+            yield {'page': page, 'total_pages': 3, 'summary': f"page {page}", 'status': 'processing'}
+            seen.append(store.get(job_id)['pages_done'])
+        yield {'page': 3, 'total_pages': 3, 'summary': '', 'status': 'complete', 'saved_file': 'out.md'}
+
+    original = worker.job_store, worker.event_bus, worker.stream_pdf_summaries
+    worker.job_store, worker.event_bus, worker.stream_pdf_summaries = store, bus, fake_stream
+    try:
+        job = {'path': 'a.pdf', 'priority': 0, 'fingerprint': None, 'filename': 'a.pdf', 'status': 'processing'}
+        store.create('job', job)
+        asyncio.run(worker.run_job('job', job))
+        # A job picked up again after a crash resumes after its last page.
+        resumed = {**job, 'pages_done': 2}
+        store.create('resumed', resumed)
+        asyncio.run(worker.run_job('resumed', resumed))
+    finally:
+        worker.job_store, worker.event_bus, worker.stream_pdf_summaries = original
+
+    assert seen == [1, 2, 3, 3]
+    finished = store.get('job')
+    assert (finished['status'], finished['pages_done'], finished['total_pages']) == ('complete', 3, 3)
+    assert [event['data']['page'] for event in bus.read('resumed')[0]] == [3, 3]
+    print("✅ Worker pages done test passed")
+
+
+if __name__ == "__main__":
+    test_documents_from_uploads_zips_and_directories()
+    test_directories_are_confined_to_the_root()
+    test_links_out_of_the_directory_are_skipped()
+    test_batch_progress_aggregates_jobs()
+    test_worker_records_pages_done()
+    sys.exit(0)
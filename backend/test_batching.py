@@ -0,0 +1,144 @@
+import sys
+import asyncio
+import tempfile
+import batching
+from benchmark import FakeChatModel, fake_llm
+from cache import SummaryCache
+from metrics import metrics
+
+
+class PlainChatModel(FakeChatModel):
+    # Answers batch prompts in plain text, as a model that ignored the JSON
+    # instruction would.
+    def _reply(self, messages):
+        return ["not json " for _ in range(self.output_tokens)]
+
+
+def _recorder(calls):
+    async def summarize(page_contnet, job_id='default', priority=0, on_token=None):
+        calls.append(page_contnet)
+        return f"single:{page_contnet[:12]}"
+    return summarize
+
+
+def _short(number):
+    return f"cover page {number}"
+
+
+def _normal(number):
+    return f"page {number} " + "body text " * 100
+
+
+async def _run_batcher(page_texts, summarize):
+    batcher = batching.PageBatcher('test-batching', summarize=summarize)
+    tasks = [task for text in page_texts for task in batcher.add(text)]
+    tasks += batcher.flush()
+    return await asyncio.gather(*tasks)
+
+
+def test_short_pages_share_one_call():
+    calls = []
+    pages = [_short(1), _short(2), _short(3), _normal(4), _short(5)]
+    with fake_llm(FakeChatModel(latency=0, token_rate=1e6, output_tokens=12)):
+        summaries = asyncio.run(_run_batcher(pages, _recorder(calls)))
+    stats = metrics.job_stats('test-batching')
+    metrics.forget_job('test-batching')
+
+    # One summary per page, in page order.
+    assert len(summaries) == 5
+    assert summaries[3] == "single:page 4 body "
+    assert summaries[4] == "single:cover page 5"
+    assert all(not s.startswith("single:") for s in summaries[:3])
+    # Pages 1-3 went out as one batch; the normal page and the lone short
+    # page after it were summarized on their own.
+    assert stats['stages']['llm.batch']['count'] == 1
+    assert calls == [pages[3], pages[4]]
+    print("✅ Page packing test passed")
+
+
+def test_batch_size_is_bounded():
+    calls = []
+    pages = [_short(n) for n in range(1, batching.PAGE_BATCH_MAX_PAGES * 2 + 2)]
+    with fake_llm(FakeChatModel(latency=0, token_rate=1e6, output_tokens=30)):
+        summaries = asyncio.run(_run_batcher(pages, _recorder(calls)))
+    stats = metrics.job_stats('test-batching')
+    metrics.forget_job('test-batching')
+
+    assert len(summaries) == len(pages)
+    assert stats['stages']['llm.batch']['count'] == 2
+    assert calls == [pages[-1]]
+    print("✅ Batch bound test passed")
+
+
+def test_unparsable_batch_falls_back_to_single_pages():
+    assert batching.parse_batch_summaries('{"pages": [{"page": 1, "summary": "a"}]}', [1, 2]) is None
+    assert batching.parse_batch_summaries('no json here', [1]) is None
+    assert batching.parse_batch_summaries(
+        'Sure: {"pages": [{"page": 2, "summary": "b"}, {"page": 1, "summary": "a"}]}', [1, 2]
+    ) == ["a", "b"]
+
+    calls = []
+    pages = [_short(1), _short(2)]
+    with fake_llm(PlainChatModel(latency=0, token_rate=1e6, output_tokens=5)):
+        summaries = asyncio.run(batching.summarize_batch(pages, 1, 'test-batching', summarize=_recorder(calls)))
+    metrics.forget_job('test-batching')
+    assert summaries == ["single:cover page 1", "single:cover page 2"]
+    assert len(calls) == 2
+    print("✅ Batch fallback test passed")
+
+
+def test_batch_results_are_cached_per_page():
+    calls = []
+    pages = [_short(1), _short(2), _short(3)]
+    original = batching.summary_cache
+    batching.summary_cache = SummaryCache(path=tempfile.mkdtemp() + "/cache.db", enabled=True)
+    try:
+        model = FakeChatModel(latency=0, token_rate=1e6, output_tokens=12)
+        with fake_llm(model):
+            batching.summary_cache.enabled = True
+            first = asyncio.run(batching.summarize_batch(pages, 1, 'test-batching', summarize=_recorder(calls)))
+            # A later document sharing page 2 finds it without a call, but a
+            # single-page summary of it is not taken from the packed answer.
+            assert batching.summary_cache.get(batching._batch_key(pages[1])) == first[1]
+            assert batching.summary_cache.get(batching._summary_key(pages[1])) is None
+            second = asyncio.run(batching.summarize_batch(pages, 4, 'test-batching', summarize=_recorder(calls)))
+    finally:
+        batching.summary_cache = original
+    stats = metrics.job_stats('test-batching')
+    metrics.forget_job('test-batching')
+
+    assert second == first
+    assert stats['stages']['llm.batch']['count'] == 1
+    assert calls == []
+    print("✅ Per-page batch cache test passed")
+
+
+def test_oversize_page_is_split_and_merged():
+    assert batching.split_text("aaaa\nbbbb\ncccc\n", 3) == ["aaaa\nbbbb\n", "cccc\n"]
+    assert batching.split_text("x" * 20, 1) == ["xxxx"] * 5
+
+    calls = []
+    original = batching.PAGE_SPLIT_TOKENS
+    batching.PAGE_SPLIT_TOKENS = 60
+    try:
+        page = "".join(f"line {n} " + "word " * 20 + "\n" for n in range(30))
+        with fake_llm(FakeChatModel(latency=0, token_rate=1e6, output_tokens=8)):
+            summaries = asyncio.run(_run_batcher([page], _recorder(calls)))
+    finally:
+        batching.PAGE_SPLIT_TOKENS = original
+    stats = metrics.job_stats('test-batching')
+    metrics.forget_job('test-batching')
+
+    assert len(summaries) == 1 and not summaries[0].startswith("single:")
+    assert len(calls) > 1 and "".join(calls) == page
+    assert stats['stages']['llm.merge']['count'] == 1
+    print("✅ Oversize page test passed")
+
+
+if __name__ == "__main__":
+    test_short_pages_share_one_call()
+    test_batch_size_is_bounded()
+    test_unparsable_batch_falls_back_to_single_pages()
+    test_batch_results_are_cached_per_page()
+    test_oversize_page_is_split_and_merged()
+    sys.exit(0)
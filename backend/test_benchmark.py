@@ -0,0 +1,81 @@
+import os
+import sys
+import asyncio
+import tempfile
+import subprocess
+from pypdf import PdfReader
+from benchmark import FakeChatModel, make_pdf, percentile, run_benchmark
+
+
+def test_synthetic_pdf():
+    directory = tempfile.mkdtemp()
+    first = make_pdf(os.path.join(directory, 'a.pdf'), 3)
+    second = make_pdf(os.path.join(directory, 'b.pdf'), 3)
+    assert open(first, 'rb').read() == open(second, 'rb').read()
+
+    reader = PdfReader(first)
+    assert len(reader.pages) == 3
+    assert reader.pages[2].extract_text().startswith("Page 3")
+    print("✅ Synthetic PDF test passed")
+
+
+def test_fake_llm_is_deterministic():
+    model = FakeChatModel(latency=0, token_rate=1e6, output_tokens=8)
+    first = asyncio.run(model.ainvoke("summarize this")).content
+    chunks = []
+
+    async def stream():
+        async for chunk in model.astream("summarize this"):
+            chunks.append(chunk.content)
+
+    asyncio.run(stream())
+    assert first == "".join(chunks)
+    assert len(first.split()) == 8
+    assert first != asyncio.run(model.ainvoke("something else")).content
+    print("✅ Fake LLM test passed")
+
+
+def test_percentile():
+    samples = [float(value) for value in range(1, 101)]
+    assert percentile(samples, 50) == 50.0
+    assert percentile(samples, 95) == 95.0
+    assert percentile([3.0], 95) == 3.0
+    print("✅ Percentile test passed")
+
+
+def test_benchmark_report():
+    model = FakeChatModel(latency=0, token_rate=1e6, output_tokens=4)
+    report = asyncio.run(run_benchmark([2], [1, 2], runs=2, model=model, scale_pages=2, step_pages=[20]))
+
+    document = report['documents'][0]
+    assert document['pages'] == 2
+    assert set(document['stages']) == {'load', 'encrypt', 'decrypt', 'extract', 'summarize', 'refine'}
+    for mode in ('graph', 'pipelined'):
+        stream = document['stream'][mode]
+        assert 0 < stream['ttfe']['p50'] <= stream['total']['p50']
+    assert [row['jobs'] for row in report['scaling']] == [1, 2]
+    steps = report['graph_steps'][0]
+    assert steps['pages'] == 20 and 0 < steps['step']['p50'] <= steps['step']['p95']
+    assert report['peak_rss_mb']['self'] > 0
+    print("✅ Benchmark report test passed")
+
+
+def test_benchmark_command_exits():
+    # Run as documented; the process must end once the report is printed.
+    result = subprocess.run(
+        [sys.executable, "benchmark.py", "--pages", "2", "--jobs", "1", "--runs", "1", "--scale-pages", "2",
+         "--step-pages", "10", "--latency", "0", "--token-rate", "1000000", "--tokens", "4"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    assert "pages" in result.stdout
+    print("✅ Benchmark command test passed")
+
+
+if __name__ == "__main__":
+    test_synthetic_pdf()
+    test_fake_llm_is_deterministic()
+    test_percentile()
+    test_benchmark_report()
+    test_benchmark_command_exits()
+    sys.exit(0)
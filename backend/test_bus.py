@@ -0,0 +1,82 @@
+import asyncio
+import sys
+import uuid
+from bus import SQLiteEventBus, RedisEventBus
+from test_jobs import redis_client, _run_or_skip
+import worker
+
+
+def test_replay_and_follow():
+    bus = SQLiteEventBus(path=':memory:')
+    bus.publish('job', {'event': 'summary', 'data': {'page': 1, 'status': 'processing'}})
+    bus.publish('other', {'event': 'summary', 'data': {'page': 7, 'status': 'processing'}})
+
+    async def scenario():
+        received = []
+
+        async def listen():
+            async for event in bus.subscribe('job', poll_interval=0.01):
+                received.append(event['data']['status'])
+
+        listener = asyncio.create_task(listen())
+        await asyncio.sleep(0.05)
+        bus.publish('job', {'event': 'summary', 'data': {'page': 2, 'status': 'processing'}})
+        bus.publish('job', {'event': 'summary', 'data': {'page': 2, 'status': 'complete'}})
+        await asyncio.wait_for(listener, timeout=1)
+        return received
+
+    assert asyncio.run(scenario()) == ['processing', 'processing', 'complete']
+
+    stored = [event for (event,) in bus._connection().execute("SELECT event FROM job_events")]
+    assert stored and not any(b'processing' in event for event in stored)
+
+    bus.forget('job')
+    assert bus.read('job') == ([], None)
+    assert [event['data']['page'] for event in bus.read('other')[0]] == [7]
+    print("✅ Event bus test passed")
+
+
+def test_redis_replay_and_cursor():
+    bus = RedisEventBus(client=redis_client(), ttl=60, prefix=f"test-{uuid.uuid4()}:")
+    bus.publish('job', {'event': 'summary', 'data': {'page': 1, 'status': 'processing'}})
+    bus.publish('job', {'event': 'summary', 'data': {'page': 2, 'status': 'processing'}})
+
+    events, cursor = bus.read('job')
+    assert [event['data']['page'] for event in events] == [1, 2]
+    assert bus.read('job', cursor) == ([], cursor)
+    bus.publish('job', {'event': 'summary', 'data': {'page': 2, 'status': 'complete'}})
+    events, _ = bus.read('job', cursor)
+    assert [event['data']['status'] for event in events] == ['complete']
+
+    bus.forget('job')
+    assert bus.read('job') == ([], None)
+    print("✅ Redis event bus test passed")
+
+
+def test_interleaved_page_deltas_are_batched():
+    bus = SQLiteEventBus(path=':memory:')
+    original = worker.event_bus, worker.TOKEN_FLUSH_SECONDS
+    worker.event_bus, worker.TOKEN_FLUSH_SECONDS = bus, 60
+    try:
+        deltas = worker._DeltaPublisher('job')
+        deltas(1, 'a')  # first call flushes: nothing published yet
+        # A refine window streams several pages at once.
+        for token in ('b', 'c', 'd'):
+            for page in (2, 3, 4):
+                deltas(page, f"{page}{token} ")
+        deltas.flush()
+    finally:
+        worker.event_bus, worker.TOKEN_FLUSH_SECONDS = original
+
+    events, _ = bus.read('job')
+    assert [(e['data']['page'], e['data']['delta']) for e in events] == [
+        (1, 'a'), (2, '2b 2c 2d '), (3, '3b 3c 3d '), (4, '4b 4c 4d ')
+    ]
+    print("✅ Delta batching test passed")
+
+
+if __name__ == "__main__":
+    test_replay_and_follow()
+    _run_or_skip(test_redis_replay_and_cursor)
+    test_interleaved_page_deltas_are_batched()
+    sys.exit(0)
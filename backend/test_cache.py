@@ -0,0 +1,114 @@
+import sys
+import sqlite3
+import tempfile
+from cache import SummaryCache, make_key
+
+
+def test_key_normalization():
+    key = make_key('summary', ["Page  one\n text "], "tmpl", "llama3.1:8b", 0.3)
+
+    assert key == make_key('summary', ["Page one text"], "tmpl", "llama3.1:8b", 0.3)
+    assert key != make_key('summary', ["Page one text"], "tmpl", "llama3.1:8b", 0.5)
+    assert key != make_key('summary', ["Page one text"], "other", "llama3.1:8b", 0.3)
+    assert key != make_key('refine', ["Page one text"], "tmpl", "llama3.1:8b", 0.3)
+    assert make_key('refine', ["a", "bc"], "t", "m", 0.3) != make_key('refine', ["ab", "c"], "t", "m", 0.3)
+    print("✅ Cache key test passed")
+
+
+def test_lru_eviction_and_job_stats():
+    cache = SummaryCache(path=':memory:', max_entries=10, max_bytes=10_000, enabled=True)
+
+    for i in range(10):
+        cache.put(f"k{i}", f"summary {i}")
+    assert cache.get("k0", job_id="job") == "summary 0"
+    cache.put("k10", "summary 10")
+
+    assert cache.get("k0", job_id="job") == "summary 0"
+    assert cache.get("k1", job_id="job") is None
+    assert cache.get("k10", job_id="job") == "summary 10"
+    assert cache.job_stats("job") == {'hits': 3, 'misses': 1}
+
+    cache.forget_job("job")
+    assert cache.job_stats("job") == {'hits': 0, 'misses': 0}
+    print("✅ Cache eviction test passed")
+
+
+def test_size_limit():
+    cache = SummaryCache(path=':memory:', max_entries=100, max_bytes=100, enabled=True)
+
+    cache.put("a", "x" * 60)
+    cache.put("b", "y" * 60)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == "y" * 60
+    print("✅ Cache size limit test passed")
+
+
+def test_limits_hold_across_processes_sharing_the_file():
+    # Two instances stand in for the API and a worker on one summaries.db.
+    path = tempfile.mkdtemp() + "/cache.db"
+    api, worker = (SummaryCache(path=path, max_entries=10, max_bytes=100_000, enabled=True) for _ in range(2))
+    for i in range(8):
+        (api if i % 2 else worker).put(f"k{i}", f"summary {i}")
+    assert api.get("k0") == "summary 0"
+    worker.put("k8", "summary 8")
+    worker.put("k9", "summary 9")
+    api.put("k10", "summary 10")
+
+    count = sqlite3.connect(path).execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+    assert count <= 10
+    # Least recently used across both: k0 was read, k1 was not.
+    assert worker.get("k0") == "summary 0"
+    assert worker.get("k1") is None
+    print("✅ Shared cache limit test passed")
+
+
+def test_values_are_encrypted_and_bound_to_their_key():
+    path = tempfile.mkdtemp() + "/cache.db"
+    cache = SummaryCache(path=path, enabled=True)
+    cache.put("a", "confidential summary")
+    cache.put("b", "other summary")
+    assert cache.get("a") == "confidential summary"
+
+    conn = sqlite3.connect(path)
+    values = dict(conn.execute("SELECT key, value FROM summaries"))
+    assert b"confidential" not in values["a"]
+    # A value moved to another key, or left in the clear, reads as a miss.
+    conn.execute("UPDATE summaries SET value = ? WHERE key = 'b'", (values["a"],))
+    conn.execute("INSERT INTO summaries (key, value, size, last_access) VALUES ('c', 'plain', 5, 0)")
+    conn.commit()
+    conn.close()
+    assert cache.get("b") is None
+    assert cache.get("c") is None
+    print("✅ Cache encryption test passed")
+
+
+def test_document_key_covers_pipeline_settings():
+    import workflow
+    import batching
+    key = workflow.document_cache_key("fingerprint")
+    assert workflow.document_cache_key("fingerprint") == key
+    original = workflow.REFINE_WINDOW, batching.MERGE_PROMPT, batching.PAGE_BATCH_MAX_PAGES
+    try:
+        workflow.REFINE_WINDOW += 1
+        assert workflow.document_cache_key("fingerprint") != key
+        workflow.REFINE_WINDOW = original[0]
+        batching.MERGE_PROMPT = batching.BATCH_SUMMARY_PROMPT
+        assert workflow.document_cache_key("fingerprint") != key
+        batching.MERGE_PROMPT = original[1]
+        batching.PAGE_BATCH_MAX_PAGES = 1
+        assert workflow.document_cache_key("fingerprint") != key
+    finally:
+        workflow.REFINE_WINDOW, batching.MERGE_PROMPT, batching.PAGE_BATCH_MAX_PAGES = original
+    assert workflow.document_cache_key("fingerprint") == key
+    print("✅ Document cache key test passed")
+
+
+if __name__ == "__main__":
+    test_key_normalization()
+    test_lru_eviction_and_job_stats()
+    test_size_limit()
+    test_limits_hold_across_processes_sharing_the_file()
+    test_values_are_encrypted_and_bound_to_their_key()
+    test_document_key_covers_pipeline_settings()
+    sys.exit(0)
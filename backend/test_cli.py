@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import tempfile
+import contextlib
+import io
+from pathlib import Path
+import cli
+import workflow
+import batching
+import helper_function
+from cache import SummaryCache
+from benchmark import FakeChatModel, fake_llm, make_pdf
+
+
+def test_find_pdfs():
+    directory = Path(tempfile.mkdtemp())
+    (directory / 'sub').mkdir()
+    a = make_pdf(str(directory / 'a.pdf'), 1)
+    b = make_pdf(str(directory / 'sub' / 'b.PDF'), 1)
+    (directory / 'notes.txt').write_text('notes')
+
+    assert cli.find_pdfs([str(directory)]) == sorted([Path(a).resolve(), Path(b).resolve()])
+    assert cli.find_pdfs([str(directory / '*.pdf'), a]) == [Path(a).resolve()]
+    assert cli.find_pdfs([str(directory / '**' / '*.PDF')]) == [Path(b).resolve()]
+    assert cli.find_pdfs([str(directory / 'missing')]) == []
+    print("✅ CLI file discovery test passed")
+
+
+def test_bulk_run_skips_summarized_files():
+    directory = Path(tempfile.mkdtemp())
+    output = directory / 'out'
+    first = make_pdf(str(directory / 'first.pdf'), 2)
+    make_pdf(str(directory / 'second.pdf'), 3, seed=1)
+    original = workflow.SUMMARY_OUTPUT_DIR
+    try:
+        with fake_llm(FakeChatModel(latency=0, token_rate=1e6, output_tokens=8)):
+            assert cli.main([str(directory), '--output', str(output), '--jobs', '2']) == 0
+            summaries = sorted(path.name for path in output.glob('*.txt'))
+            assert len(summaries) == 2 and summaries[0].startswith('first_summary_')
+            assert 'Total Pages: 3' in next(output.glob('second_summary_*.txt')).read_text()
+
+            manifest = cli.Manifest(output / cli.MANIFEST_NAME)
+            assert all(manifest.is_done(pdf) for pdf in cli.find_pdfs([str(directory)]))
+
+            # A touched but unchanged file is still done; a changed one is not.
+            later = time.time() + 10
+            os.utime(first, (later, later))
+            assert manifest.is_done(Path(first).resolve())
+            make_pdf(first, 4, seed=2)
+            assert not manifest.is_done(Path(first).resolve())
+
+            assert cli.main([str(directory), '--output', str(output)]) == 0
+    finally:
+        workflow.SUMMARY_OUTPUT_DIR = original
+
+    assert len(list(output.glob('first_summary_*.txt'))) == 2
+    assert len(list(output.glob('second_summary_*.txt'))) == 1
+    print("✅ CLI incremental run test passed")
+
+
+def test_force_recomputes_stored_summaries():
+    directory = Path(tempfile.mkdtemp())
+    output = directory / 'out'
+    make_pdf(str(directory / 'doc.pdf'), 2, seed=3)
+    modules = (cli, workflow, helper_function, batching)
+    original = workflow.SUMMARY_OUTPUT_DIR, [module.summary_cache for module in modules]
+    cache = SummaryCache(path=str(directory / 'cache.db'))
+    try:
+        with fake_llm(FakeChatModel(latency=0, token_rate=1e6, output_tokens=8)):
+            for module in modules:
+                module.summary_cache = cache
+            cache.enabled = True
+            assert cli.main([str(directory), '--output', str(output)]) == 0
+            runs = {}
+            for args in (['--force'], ['--force', '--no-pipelined']):
+                log = io.StringIO()
+                with contextlib.redirect_stdout(log):
+                    assert cli.main([str(directory), '--output', str(output)] + args) == 0
+                runs[tuple(args)] = log.getvalue()
+            # The same document elsewhere, without --force, is replayed.
+            copy = directory / 'copy'
+            copy.mkdir()
+            (copy / 'doc.pdf').write_bytes((directory / 'doc.pdf').read_bytes())
+            log = io.StringIO()
+            with contextlib.redirect_stdout(log):
+                assert cli.main([str(copy), '--output', str(output)]) == 0
+            replayed = log.getvalue()
+    finally:
+        workflow.SUMMARY_OUTPUT_DIR = original[0]
+        for module, summary_cache in zip(modules, original[1]):
+            module.summary_cache = summary_cache
+
+    for log in runs.values():
+        assert "1 to do" in log
+        assert "Replaying stored summaries" not in log
+    assert "Replaying stored summaries" in replayed
+    assert len(list(output.glob('doc_summary_*.txt'))) == 4
+    print("✅ CLI force test passed")
+
+
+if __name__ == "__main__":
+    test_find_pdfs()
+    test_bulk_run_skips_summarized_files()
+    test_force_recomputes_stored_summaries()
+    sys.exit(0)
@@ -1,6 +1,11 @@
 import sys
 from pathlib import Path
-from encryption import encrypt_file, decrypt_file_to_memory, is_encrypted_file
+import os
+import tempfile
+import encryption
+from encryption import encrypt_file, decrypt_file_to_memory, is_encrypted_file, StreamEncryptor, EncryptedFileReader
+from encryption import migrate_file, needs_migration, _derive_key, _get_passphrase, SALT_SIZE, NONCE_SIZE
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 def test_encryption():
     test_pdf = "five_page_detailed_document.pdf"
@@ -34,6 +39,128 @@ def test_encryption():
     print("✅ All encryption tests passed")
     return True
 
+def test_streamed_segments():
+    encrypted_output = "test_streamed.enc"
+    payload = os.urandom(10_000)
+
+    with StreamEncryptor(encrypted_output, segment_size=1024) as encryptor:
+        for start in range(0, len(payload), 777):
+            encryptor.write(payload[start:start + 777])
+
+    try:
+        assert decrypt_file_to_memory(encrypted_output).getvalue() == payload
+
+        # Dropping the final segment must not decrypt to a shorter document.
+        with open(encrypted_output, 'r+b') as f:
+            f.truncate(Path(encrypted_output).stat().st_size - (10_000 % 1024 + 16))
+        try:
+            decrypt_file_to_memory(encrypted_output)
+            assert False, "truncated file decrypted without error"
+        except AssertionError:
+            raise
+        except Exception:
+            pass
+    finally:
+        Path(encrypted_output).unlink()
+
+    print("✅ Streamed segment tests passed")
+
+def test_random_access_reader():
+    encrypted_output = "test_random_access.enc"
+    payload = os.urandom(5_000)
+
+    with StreamEncryptor(encrypted_output, segment_size=512) as encryptor:
+        encryptor.write(payload)
+
+    with EncryptedFileReader(encrypted_output, cache_segments=2) as reader:
+        reader.seek(-10, os.SEEK_END)
+        tail = reader.read()
+        reader.seek(1000)
+        middle = reader.read(600)
+        size = reader.size
+    Path(encrypted_output).unlink()
+
+    assert size == len(payload)
+    assert tail == payload[-10:]
+    assert middle == payload[1000:1600]
+    print("✅ Random access reader tests passed")
+
+def test_legacy_migration():
+    encrypted_output = "test_legacy.enc"
+    payload = os.urandom(3_000)
+
+    # Single-blob layout used before the streamed container: [SALT][NONCE][CIPHERTEXT]
+    salt, nonce = os.urandom(SALT_SIZE), os.urandom(NONCE_SIZE)
+    ciphertext = AESGCM(_derive_key(_get_passphrase(), salt)).encrypt(nonce, payload, None)
+    with open(encrypted_output, 'wb') as f:
+        f.write(salt + nonce + ciphertext)
+
+    try:
+        assert decrypt_file_to_memory(encrypted_output).getvalue() == payload
+        assert migrate_file(encrypted_output) and not needs_migration(encrypted_output)
+        assert not migrate_file(encrypted_output), "current file migrated twice"
+        assert decrypt_file_to_memory(encrypted_output).getvalue() == payload
+    finally:
+        Path(encrypted_output).unlink()
+
+    print("✅ Legacy migration tests passed")
+
+def test_master_key_salt_is_per_deployment():
+    directory = tempfile.mkdtemp()
+    encrypted_output = os.path.join(directory, "deployment.enc")
+    payload = os.urandom(2_000)
+    original = encryption.MASTER_KEY_SALT_PATH
+    try:
+        encryption.MASTER_KEY_SALT_PATH = os.path.join(directory, "a", "master_key.salt")
+        salt = encryption.deployment_salt()
+        assert len(salt) == SALT_SIZE and encryption.deployment_salt() == salt
+        with StreamEncryptor(encrypted_output) as encryptor:
+            encryptor.write(payload)
+        assert decrypt_file_to_memory(encrypted_output).getvalue() == payload
+
+        # Same passphrase, other deployment: the file does not decrypt.
+        encryption.MASTER_KEY_SALT_PATH = os.path.join(directory, "b", "master_key.salt")
+        assert encryption.deployment_salt() != salt
+        try:
+            decrypt_file_to_memory(encrypted_output)
+            assert False, "file decrypted under another deployment's salt"
+        except Exception as e:
+            assert type(e).__name__ == 'InvalidTag'
+    finally:
+        encryption.MASTER_KEY_SALT_PATH = original
+    print("✅ Per-deployment master salt test passed")
+
+def test_lost_master_key_salt_is_not_replaced():
+    directory = tempfile.mkdtemp()
+    original = encryption.MASTER_KEY_SALT_PATH, os.link
+    try:
+        # No hard links on this filesystem: the salt is created in place.
+        def no_link(source, target):
+            raise PermissionError("hard links not supported")
+        os.link = no_link
+        encryption.MASTER_KEY_SALT_PATH = os.path.join(directory, ".master_key.salt")
+        salt = encryption.deployment_salt()
+        assert len(salt) == SALT_SIZE and encryption.deployment_salt() == salt
+        assert sorted(os.listdir(directory)) == [".master_key.salt"]
+
+        with StreamEncryptor(os.path.join(directory, "job.enc")) as encryptor:
+            encryptor.write(b"%PDF")
+        os.unlink(encryption.MASTER_KEY_SALT_PATH)
+        try:
+            encryption.deployment_salt()
+            assert False, "a new salt was made while uploads need the old one"
+        except RuntimeError as e:
+            assert "missing" in str(e)
+        assert not os.path.exists(encryption.MASTER_KEY_SALT_PATH)
+    finally:
+        encryption.MASTER_KEY_SALT_PATH, os.link = original
+    print("✅ Lost master salt test passed")
+
 if __name__ == "__main__":
     success = test_encryption()
+    test_streamed_segments()
+    test_random_access_reader()
+    test_legacy_migration()
+    test_master_key_salt_is_per_deployment()
+    test_lost_master_key_salt_is_not_replaced()
     sys.exit(0 if success else 1)
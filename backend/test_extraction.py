@@ -0,0 +1,42 @@
+import sys
+from pathlib import Path
+from pypdf import PdfReader, PdfWriter
+from encryption import encrypt_file
+import extraction
+
+
+def test_parallel_extraction_keeps_order():
+    test_pdf = "five_page_detailed_document.pdf"
+    long_pdf = "test_long_document.pdf"
+    encrypted_pdf = "test_long_document.enc"
+
+    writer = PdfWriter()
+    for _ in range(8):
+        writer.append(test_pdf)
+    writer.write(long_pdf)
+    encrypt_file(long_pdf, encrypted_pdf)
+
+    expected = [page.extract_text() for page in PdfReader(long_pdf).pages]
+    saved = extraction.PARALLEL_MIN_PAGES, extraction.PDF_WORKERS, extraction.STREAM_RANGE_PAGES
+    extraction.PARALLEL_MIN_PAGES, extraction.PDF_WORKERS, extraction.STREAM_RANGE_PAGES = 1, 2, 3
+    try:
+        with extraction.PageStream(long_pdf) as pages:
+            plain = list(pages)
+        with extraction.PageStream(encrypted_pdf) as pages:
+            total = pages.total
+            encrypted = list(pages)
+    finally:
+        extraction.PARALLEL_MIN_PAGES, extraction.PDF_WORKERS, extraction.STREAM_RANGE_PAGES = saved
+        Path(long_pdf).unlink()
+        Path(encrypted_pdf).unlink()
+
+    assert plain == expected
+    assert total == len(expected) and encrypted == expected
+    assert extraction.page_ranges(10, 4) == [(0, 3), (3, 6), (6, 9), (9, 10)]
+    assert extraction.page_ranges(10, 2, max_size=4) == [(0, 4), (4, 8), (8, 10)]
+    print("✅ Parallel extraction test passed")
+
+
+if __name__ == "__main__":
+    test_parallel_extraction_keeps_order()
+    sys.exit(0)
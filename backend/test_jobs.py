@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+import uuid
+import pytest
+from jobs import JobStore, SQLiteJobStore, RedisJobStore
+
+
+def redis_client():
+    # fakeredis when installed, else the server at REDIS_TEST_URL (keys are
+    # namespaced per test run); without either the Redis tests are skipped.
+    try:
+        import fakeredis
+        return fakeredis.FakeRedis()
+    except ImportError:
+        pass
+    url = os.getenv("REDIS_TEST_URL")
+    if not url:
+        pytest.skip("Neither fakeredis nor REDIS_TEST_URL available")
+    redis = pytest.importorskip("redis")
+    client = redis.Redis.from_url(url)
+    try:
+        client.ping()
+    except redis.RedisError as e:
+        pytest.skip(f"Redis at REDIS_TEST_URL is unreachable: {e}")
+    return client
+
+
+def _redis_store(ttl=60):
+    return RedisJobStore(client=redis_client(), ttl=ttl, prefix=f"test-{uuid.uuid4()}:")
+
+
+def _run_or_skip(test) -> None:
+    # Outside pytest, a skipped test is reported rather than raised.
+    try:
+        test()
+    except pytest.skip.Exception as e:
+        print(f"⚠️ Skipped {test.__name__}: {e}")
+
+
+def test_transitions_are_conditional():
+    store = SQLiteJobStore(path=':memory:', ttl=60)
+    store.create('job', {'filename': 'a.pdf', 'status': 'uploaded'})
+
+    assert store.transition('job', 'processing', ('uploaded',))
+    assert not store.transition('job', 'processing', ('uploaded',))
+    assert store.update('job', saved_file='out.txt')
+    assert store.get('job') == {'filename': 'a.pdf', 'saved_file': 'out.txt', 'status': 'processing'}
+
+    assert store.delete('job')['filename'] == 'a.pdf'
+    assert store.get('job') is None
+    assert not store.transition('job', 'complete', ('processing',))
+    print("✅ Job store transition test passed")
+
+
+def test_ttl_expiry():
+    store = SQLiteJobStore(path=':memory:', ttl=0.05)
+    store.create('job', {'status': 'uploaded'})
+    assert store.get('job') is not None
+
+    time.sleep(0.1)
+    assert store.get('job') is None
+    assert not store.update('job', status='processing')
+    assert store.purge_expired() == 1
+    print("✅ Job store expiry test passed")
+
+
+def test_claim_order_and_stale_recovery():
+    store = SQLiteJobStore(path=':memory:', ttl=60)
+    store.create('bulk', {'priority': 1, 'status': 'uploaded'})
+    store.create('first', {'priority': 0, 'status': 'uploaded'})
+    store.create('second', {'priority': 0, 'status': 'uploaded'})
+
+    assert [store.claim_next('w1', stale_after=60)[0] for _ in range(3)] == ['first', 'second', 'bulk']
+    assert store.claim_next('w1', stale_after=60) is None
+
+    # A job whose worker stopped sending heartbeats is handed out again.
+    store.update('first', heartbeat=time.time() - 120)
+    job_id, job = store.claim_next('w2', stale_after=60)
+    assert job_id == 'first' and job['worker'] == 'w2' and job['status'] == 'processing'
+    print("✅ Job store claim test passed")
+
+
+def test_redis_transitions_and_claims():
+    store = _redis_store()
+    store.create('job', {'filename': 'a.pdf', 'priority': 1, 'status': 'uploaded'})
+    store.create('urgent', {'filename': 'b.pdf', 'priority': 0, 'status': 'uploaded'})
+    assert store.update('job', saved_file='out.txt')
+    assert store.get('job')['saved_file'] == 'out.txt'
+
+    assert [store.claim_next('w1', stale_after=60)[0] for _ in range(2)] == ['urgent', 'job']
+    assert store.claim_next('w1', stale_after=60) is None
+    assert not store.transition('job', 'processing', ('uploaded',))
+    assert store.transition('urgent', 'complete', ('processing',))
+
+    # A job whose worker stopped sending heartbeats is handed out again, to
+    # one worker only; finished jobs never are.
+    store.update('job', heartbeat=time.time() - 120)
+    job_id, job = store.claim_next('w2', stale_after=60)
+    assert job_id == 'job' and job['worker'] == 'w2' and job['status'] == 'processing'
+    assert store.claim_next('w3', stale_after=60) is None
+
+    assert store.delete('job')['filename'] == 'a.pdf'
+    assert store.get('job') is None
+    print("✅ Redis job store test passed")
+
+
+def test_incomplete_backends_are_rejected():
+    from bus import EventBus
+
+    class PartialStore(JobStore):
+        def get(self, job_id):
+            return None
+
+    class PartialBus(EventBus):
+        def publish(self, job_id, event):
+            pass
+
+    for backend in (PartialStore, PartialBus):
+        try:
+            backend()
+            assert False, f"{backend.__name__} was created without all its methods"
+        except TypeError:
+            pass
+    print("✅ Incomplete backend test passed")
+
+
+if __name__ == "__main__":
+    test_transitions_are_conditional()
+    test_ttl_expiry()
+    test_claim_order_and_stale_recovery()
+    _run_or_skip(test_redis_transitions_and_claims)
+    test_incomplete_backends_are_rejected()
+    sys.exit(0)
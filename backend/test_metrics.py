@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import asyncio
+import tempfile
+from benchmark import FakeChatModel
+from helper_function import run_chain, SUMMARY_PROMPT
+from metrics import Metrics, metrics
+
+
+def test_stage_histogram_and_job_breakdown():
+    registry = Metrics(directory=tempfile.mkdtemp(), buckets=(0.1, 1.0))
+    registry.observe('llm.summary', 0.05, 'job-a')
+    registry.observe('llm.summary', 0.5, 'job-a')
+    registry.observe('decrypt', 2.0)
+
+    snapshot = registry.snapshot()
+    assert snapshot['stages']['llm.summary'] == {'buckets': [1, 2], 'count': 2, 'sum': 0.55}
+    assert snapshot['stages']['decrypt']['buckets'] == [0, 0]
+
+    stats = registry.job_stats('job-a')
+    assert stats['stages']['llm.summary']['count'] == 2
+    assert 'decrypt' not in stats['stages']
+    registry.forget_job('job-a')
+    assert registry.job_stats('job-a') == {'stages': {}, 'tokens': {}}
+    print("✅ Stage histogram test passed")
+
+
+def test_collect_merges_other_processes():
+    directory = tempfile.mkdtemp()
+    registry = Metrics(directory=directory, buckets=(1.0,))
+    registry.observe('extract', 0.5)
+    registry.count_tokens('llm.refine', 100, 20)
+
+    # Snapshot left by another process (e.g. a job worker).
+    with open(os.path.join(directory, '999999.json'), 'w') as f:
+        json.dump({'stages': {'extract': {'buckets': [0], 'count': 1, 'sum': 3.0}},
+                   'tokens': {'llm.refine': {'prompt': 50, 'completion': 5}}}, f)
+
+    merged = registry.collect()
+    assert merged['stages']['extract'] == {'buckets': [1], 'count': 2, 'sum': 3.5}
+    assert merged['tokens']['llm.refine'] == {'prompt': 150, 'completion': 25}
+
+    text = registry.render(merged)
+    assert 'docveil_stage_seconds_bucket{stage="extract",le="1.0"} 1' in text
+    assert 'docveil_stage_seconds_bucket{stage="extract",le="+Inf"} 2' in text
+    assert 'docveil_stage_seconds_count{stage="extract"} 2' in text
+    assert 'docveil_llm_tokens_total{stage="llm.refine",kind="prompt"} 150' in text
+
+    registry.flush()
+    assert os.path.exists(os.path.join(directory, f"{os.getpid()}.json"))
+    print("✅ Metrics collect test passed")
+
+
+def test_llm_calls_are_timed_and_counted():
+    model = FakeChatModel(latency=0, token_rate=1e6, output_tokens=5)
+    chain = SUMMARY_PROMPT | model
+
+    async def calls():
+        await run_chain(chain, {'page_contnet': 'one two three'}, None, 'llm.summary', 'job-llm')
+        await run_chain(chain, {'page_contnet': 'one two three'}, lambda text: None, 'llm.summary', 'job-llm')
+
+    asyncio.run(calls())
+    stats = metrics.job_stats('job-llm')
+    metrics.forget_job('job-llm')
+    assert stats['stages']['llm.summary']['count'] == 2
+    # Prompt tokens come from the model's usage report, streamed or not.
+    assert stats['tokens']['completion'] == 10
+    assert stats['tokens']['prompt'] > 0 and stats['tokens']['prompt'] % 2 == 0
+    print("✅ LLM instrumentation test passed")
+
+
+if __name__ == "__main__":
+    test_stage_histogram_and_job_breakdown()
+    test_collect_merges_other_processes()
+    test_llm_calls_are_timed_and_counted()
+    sys.exit(0)
@@ -0,0 +1,124 @@
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import asyncio
+import pagestore
+import worker
+from jobs import SQLiteJobStore
+from bus import SQLiteEventBus
+from pagestore import PageStore, KIND_TEXT, KIND_DRAFT
+
+os.environ.setdefault("ENCRYPTION_PASSPHRASE", "test-passphrase")
+
+
+def test_pages_round_trip_and_reopen():
+    directory = tempfile.mkdtemp()
+    store = PageStore('job-a', directory, cache_pages=2)
+    store.put_many(KIND_TEXT, 0, ["first page", "second page", "third page"])
+    store.put(KIND_DRAFT, 1, "draft of page two")
+    assert store.get(KIND_TEXT, 2) == "third page"
+    assert store.count(KIND_TEXT) == 3
+    store.close()
+
+    # Another process (a resumed worker) opens the same file.
+    reopened = PageStore('job-a', directory)
+    view = reopened.pages(KIND_TEXT, 3)
+    assert list(view) == ["first page", "second page", "third page"]
+    assert view[1:] == ["second page", "third page"] and view[-1] == "third page"
+    assert reopened.get(KIND_DRAFT, 1) == "draft of page two"
+    try:
+        reopened.get(KIND_DRAFT, 0)
+        assert False, "missing page should raise"
+    except IndexError:
+        pass
+    reopened.delete()
+    assert not os.path.exists(reopened.path)
+    print("✅ Page store round trip test passed")
+
+
+def test_pages_are_encrypted_and_bound_to_their_slot():
+    directory = tempfile.mkdtemp()
+    store = PageStore('job-b', directory, cache_pages=0)
+    store.put_many(KIND_TEXT, 0, ["confidential merger terms", "public appendix"])
+    store.close()
+
+    conn = sqlite3.connect(str(store.path))
+    raw = b"".join(row[0] for row in conn.execute("SELECT data FROM pages"))
+    assert b"confidential" not in raw
+    # Swap the two pages on disk: neither decrypts under the other's index.
+    first, second = (row[0] for row in conn.execute("SELECT data FROM pages ORDER BY page"))
+    conn.execute("UPDATE pages SET data = ? WHERE page = 0", (second,))
+    conn.execute("UPDATE pages SET data = ? WHERE page = 1", (first,))
+    conn.commit()
+    conn.close()
+
+    try:
+        store.get(KIND_TEXT, 0)
+        assert False, "moved page should not decrypt"
+    except Exception as e:
+        assert type(e).__name__ == 'InvalidTag'
+    store.delete()
+    print("✅ Page store encryption test passed")
+
+
+def test_purge_expired_stores():
+    directory = tempfile.mkdtemp()
+    original = pagestore.PAGE_STORE_DIR
+    pagestore.PAGE_STORE_DIR = directory
+    try:
+        for job_id in ('old-orphan', 'old-live', 'recent'):
+            store = PageStore(job_id, directory)
+            store.put(KIND_TEXT, 0, job_id)
+            store.close()
+        past = time.time() - 3600
+        for job_id in ('old-orphan', 'old-live'):
+            os.utime(os.path.join(directory, f"{job_id}.db"), (past, past))
+
+        removed = pagestore.purge_expired(60, keep=lambda job_id: job_id == 'old-live')
+    finally:
+        pagestore.PAGE_STORE_DIR = original
+
+    assert removed == 1
+    assert sorted(name for name in os.listdir(directory) if name.endswith('.db')) == ['old-live.db', 'recent.db']
+    print("✅ Page store purge test passed")
+
+
+def test_failed_job_releases_its_store():
+    directory = tempfile.mkdtemp()
+    store, bus = SQLiteJobStore(path=':memory:', ttl=60), SQLiteEventBus(path=':memory:')
+    original = pagestore.PAGE_STORE_DIR, worker.job_store, worker.event_bus
+    pagestore.PAGE_STORE_DIR, worker.job_store, worker.event_bus = directory, store, bus
+    try:
+        # Released, not deleted: a resumed job still finds its pages.
+        pagestore.page_store('stopped').put(KIND_TEXT, 0, "page")
+        pagestore.release_pages('stopped')
+        assert 'stopped' not in pagestore._stores
+        assert pagestore.page_store('stopped').get(KIND_TEXT, 0) == "page"
+        pagestore.discard_pages('stopped')
+
+        job = {'path': os.path.join(directory, 'missing.pdf'), 'priority': 0, 'fingerprint': None,
+               'pipelined': False, 'filename': 'missing.pdf', 'status': 'processing'}
+        store.create('failing', job)
+
+        async def run():
+            await worker.run_job('failing', job)
+            await worker.close_checkpoints()
+
+        asyncio.run(run())
+    finally:
+        pagestore.PAGE_STORE_DIR, worker.job_store, worker.event_bus = original
+
+    assert store.get('failing')['status'] == 'error'
+    assert 'failing' not in pagestore._stores
+    assert not os.listdir(directory)
+    print("✅ Failed job store release test passed")
+
+
+if __name__ == "__main__":
+    test_pages_round_trip_and_reopen()
+    test_pages_are_encrypted_and_bound_to_their_slot()
+    test_purge_expired_stores()
+    test_failed_job_releases_its_store()
+    sys.exit(0)
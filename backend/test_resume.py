@@ -0,0 +1,96 @@
+import asyncio
+import sys
+import workflow
+
+
+async def _fake_summary(page_contnet, job_id='default', priority=0, on_token=None):
+    _calls['summary'] += 1
+    return page_contnet[:20]
+
+
+async def _fake_refine(memory, previous, current, job_id, priority, on_token=None):
+    _calls['refine'] += 1
+    _contexts.append((memory, previous))
+    return current
+
+
+async def _fake_memory(memory, summaries, job_id, priority):
+    _calls['memory'] += 1
+    return memory + str(len(summaries))
+
+
+_calls = {'summary': 0, 'refine': 0, 'memory': 0}
+_contexts = []
+
+
+async def _interrupt_and_resume():
+    pdf = "five_page_detailed_document.pdf"
+    pages = []
+
+    first = workflow.stream_pdf_summaries(pdf, 'test-resume', pipelined=False)
+    async for summary_data in first:
+        pages.append(summary_data['page'])
+        if summary_data['page'] == 2:
+            break
+    await first.aclose()
+
+    async for summary_data in workflow.stream_pdf_summaries(pdf, 'test-resume', pipelined=False, after_page=2):
+        pages.append((summary_data['page'], summary_data['status']))
+
+    await workflow.close_checkpoints()
+    return pages
+
+
+def test_resume_from_checkpoint():
+    originals = (workflow.summery_asycn, workflow.refine_page, workflow.update_memory,
+                 workflow.save_summaries_to_file, workflow.REFINE_WINDOW)
+    workflow.summery_asycn, workflow.refine_page, workflow.update_memory = _fake_summary, _fake_refine, _fake_memory
+    workflow.save_summaries_to_file = lambda refined_summaries, pdf_path: 'unused.txt'
+    # Windows of pages 1-2, 3-4 and 5; the run is cut after the first.
+    workflow.REFINE_WINDOW = 2
+    try:
+        pages = asyncio.run(_interrupt_and_resume())
+    finally:
+        (workflow.summery_asycn, workflow.refine_page, workflow.update_memory,
+         workflow.save_summaries_to_file, workflow.REFINE_WINDOW) = originals
+
+    assert pages == [1, 2, (3, 'processing'), (4, 'processing'), (5, 'processing'), (5, 'complete')], pages
+    # Page summaries, the first window and its digest came from the checkpoint.
+    assert _calls == {'summary': 5, 'refine': 4, 'memory': 2}, _calls
+    print("✅ Resume test passed")
+
+
+async def _pipelined_run():
+    pages = []
+    async for summary_data in workflow.stream_pdf_summaries(
+        "five_page_detailed_document.pdf", 'test-pipelined-refine', pipelined=True
+    ):
+        pages.append((summary_data['page'], summary_data['summary']))
+    return pages
+
+
+def test_pipelined_refine_uses_window_digest():
+    originals = (workflow.summery_asycn, workflow.refine_page, workflow.update_memory,
+                 workflow.save_summaries_to_file, workflow.REFINE_WINDOW)
+    workflow.summery_asycn, workflow.refine_page, workflow.update_memory = _fake_summary, _fake_refine, _fake_memory
+    workflow.save_summaries_to_file = lambda refined_summaries, pdf_path: 'unused.txt'
+    workflow.REFINE_WINDOW = 2
+    _contexts.clear()
+    try:
+        pages = asyncio.run(_pipelined_run())
+    finally:
+        (workflow.summery_asycn, workflow.refine_page, workflow.update_memory,
+         workflow.save_summaries_to_file, workflow.REFINE_WINDOW) = originals
+
+    assert [page for page, _ in pages] == [1, 2, 3, 4, 5, 5]
+    # Each page sees the digest of the windows before its own and the
+    # previous page's draft.
+    assert [memory for memory, _ in _contexts] == ['', '2', '2', '22']
+    assert [previous for _, previous in _contexts] == [summary for _, summary in pages[:4]]
+    print("✅ Pipelined window refine test passed")
+
+
+if __name__ == "__main__":
+    test_resume_from_checkpoint()
+    test_pipelined_refine_uses_window_digest()
+    sys.exit(0)
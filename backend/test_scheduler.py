@@ -0,0 +1,94 @@
+import asyncio
+import sys
+from scheduler import LLMScheduler, PRIORITY_INTERACTIVE, PRIORITY_BULK
+
+
+async def _run_jobs(scheduler, jobs):
+    order = []
+
+    async def call(job_id, priority):
+        async with scheduler.slot(job_id, priority):
+            order.append(job_id)
+            await asyncio.sleep(0)
+
+    blocker = asyncio.Event()
+
+    async def hold():
+        async with scheduler.slot('holder'):
+            await blocker.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+
+    tasks = [asyncio.create_task(call(job_id, priority)) for job_id, priority in jobs]
+    await asyncio.sleep(0)
+    positions = {job_id: scheduler.queue_position(job_id) for job_id, _ in jobs}
+
+    blocker.set()
+    await asyncio.gather(holder, *tasks)
+    return order, positions
+
+
+def test_fair_sharing_and_priority():
+    scheduler = LLMScheduler(max_concurrency=1)
+    jobs = [('big', PRIORITY_INTERACTIVE)] * 3 + [('small', PRIORITY_INTERACTIVE)] + [('backfill', PRIORITY_BULK)]
+    order, positions = asyncio.run(_run_jobs(scheduler, jobs))
+
+    assert order == ['big', 'small', 'big', 'big', 'backfill'], order
+    assert positions == {'big': 0, 'small': 1, 'backfill': 2}, positions
+    assert scheduler.queue_position('big') is None
+    print("✅ Scheduler fairness test passed")
+
+
+def test_cancelled_waiter_frees_queue():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=1)
+        assert scheduler.idle_slots() == 1
+        await scheduler.acquire('a')
+        assert scheduler.idle_slots() == 0
+        waiter = asyncio.create_task(scheduler.acquire('b'))
+        await asyncio.sleep(0)
+        assert scheduler.queue_position('b') == 0
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert scheduler.queue_position('b') is None
+        scheduler.release('a')
+        await asyncio.wait_for(scheduler.acquire('c'), timeout=1)
+        scheduler.release('c')
+        assert scheduler.idle_slots() == 1
+
+    asyncio.run(scenario())
+    print("✅ Scheduler cancellation test passed")
+
+
+def test_workers_started_together_share_llm_limits():
+    import worker
+    queues = {worker.scheduler, worker.refine_scheduler}
+    endpoints = set(worker.draft_llm.endpoints) | set(worker.refine_llm.endpoints)
+    limits = {queue: queue.max_concurrency for queue in queues}
+    caps = {endpoint: endpoint.max_concurrency for endpoint in endpoints}
+    for queue in queues:
+        queue.max_concurrency = 8
+    for endpoint in endpoints:
+        endpoint.max_concurrency = 3
+    try:
+        worker.share_llm_limits(2)
+        assert {queue.max_concurrency for queue in queues} == {4}
+        assert {endpoint.max_concurrency for endpoint in endpoints} == {1}
+        worker.share_llm_limits(4)
+        # Never below one call at a time.
+        assert {queue.max_concurrency for queue in queues} == {1}
+        assert {endpoint.max_concurrency for endpoint in endpoints} == {1}
+    finally:
+        for queue, limit in limits.items():
+            queue.max_concurrency = limit
+        for endpoint, cap in caps.items():
+            endpoint.max_concurrency = cap
+    print("✅ Shared worker limits test passed")
+
+
+if __name__ == "__main__":
+    test_fair_sharing_and_priority()
+    test_cancelled_waiter_frees_queue()
+    test_workers_started_together_share_llm_limits()
+    sys.exit(0)
@@ -0,0 +1,33 @@
+import asyncio
+import sys
+from transport import coalesce, encode_event
+
+
+def test_encode_is_compact():
+    chunk = encode_event('summary', {'page': 1, 'summary': 'a b'}, '1')
+    assert b'data: {"page":1,"summary":"a b"}' in chunk
+    assert b'id: 1' in chunk and b'event: summary' in chunk
+    print("✅ Event encoding test passed")
+
+
+def test_coalesce_batches_under_load():
+    async def burst():
+        yield b"a"
+        for chunk in (b"b", b"c", b"d", b"e"):
+            yield chunk
+        await asyncio.sleep(0.2)
+        yield b"f"
+
+    async def collect():
+        return [chunk async for chunk in coalesce(burst(), flush_interval=0.05, max_batch=3)]
+
+    # Events that are already waiting are grouped up to max_batch, and an
+    # event after an idle gap goes out on its own without waiting.
+    assert asyncio.run(collect()) == [b"abc", b"de", b"f"]
+    print("✅ Coalescing test passed")
+
+
+if __name__ == "__main__":
+    test_encode_is_compact()
+    test_coalesce_batches_under_load()
+    sys.exit(0)
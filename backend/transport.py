@@ -0,0 +1,73 @@
+import os
+import json
+import asyncio
+from typing import AsyncIterator, Dict, Optional
+from sse_starlette.event import ServerSentEvent
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Writes to one SSE connection are at least this far apart; events arriving
+# in between go out together in the next write. The first event after an
+# idle period is sent immediately.
+SSE_FLUSH_INTERVAL = float(os.getenv("SSE_FLUSH_INTERVAL", "0.05"))
+SSE_MAX_BATCH = int(os.getenv("SSE_MAX_BATCH", "32"))
+SSE_PING_SECONDS = float(os.getenv("SSE_PING_SECONDS", "15"))
+
+_DONE = object()
+
+
+def encode_event(event: str, data: Dict, event_id: Optional[str] = None) -> bytes:
+    payload = json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+    return ServerSentEvent(data=payload, event=event, id=event_id).encode()
+
+
+async def coalesce(
+    source: AsyncIterator[bytes],
+    flush_interval: float = SSE_FLUSH_INTERVAL,
+    max_batch: int = SSE_MAX_BATCH,
+) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for chunk in source:
+                await queue.put(chunk)
+        except Exception as error:
+            await queue.put(error)
+        await queue.put(_DONE)
+
+    pump_task = asyncio.ensure_future(pump())
+    last_flush = float('-inf')
+    try:
+        done = False
+        while not done:
+            item = await queue.get()
+            batch = []
+            while True:
+                if item is _DONE:
+                    done = True
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                batch.append(item)
+                if len(batch) >= max_batch:
+                    break
+                try:
+                    item = queue.get_nowait()
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = last_flush + flush_interval - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if batch:
+                yield b"".join(batch)
+                last_flush = loop.time()
+    finally:
+        pump_task.cancel()
@@ -0,0 +1,251 @@
+import os
+import time
+import socket
+import asyncio
+import argparse
+import multiprocessing
+from typing import Dict, List
+from dotenv import load_dotenv
+from jobs import job_store, STATUS_PROCESSING, STATUS_COMPLETE, STATUS_ERROR
+from bus import event_bus
+from scheduler import job_status, scheduler, refine_scheduler
+from backends import draft_llm, refine_llm, fallback_llm
+from cache import summary_cache
+from metrics import metrics
+from pagestore import release_pages, discard_pages
+from workflow import stream_pdf_summaries, close_checkpoints
+
+load_dotenv()
+
+# LLM limits (LLM_MAX_CONCURRENCY, LLM_REFINE_CONCURRENCY, endpoint caps)
+# hold per process. Workers started together split them between them.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOBS_PER_WORKER = int(os.getenv("JOBS_PER_WORKER", "2"))
+# While the LLM queue has idle slots, a worker takes on more jobs, up to
+# WORKER_MAX_JOBS in total: a batch of small documents cannot keep the
+# backend busy one or two documents at a time.
+WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", "8"))
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "0.5"))
+WORKER_HEARTBEAT_SECONDS = float(os.getenv("WORKER_HEARTBEAT_SECONDS", "5"))
+# A processing job without a heartbeat for this long is picked up again and
+# resumed from its last checkpoint.
+WORKER_STALE_SECONDS = WORKER_HEARTBEAT_SECONDS * 6
+# Forward partial model output as 'delta' events (per job with
+# ?stream_tokens=true on upload). Tokens are gathered and published at most
+# every TOKEN_FLUSH_SECONDS, not one bus write per token.
+TOKEN_STREAMING = os.getenv("TOKEN_STREAMING", "false").lower() == "true"
+TOKEN_FLUSH_SECONDS = float(os.getenv("TOKEN_FLUSH_SECONDS", "0.1"))
+
+
+class _DeltaPublisher:
+    # Pages of a refine window stream at the same time, so tokens are kept
+    # per page and every buffered page is published on each flush.
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self._parts: Dict[int, List[str]] = {}
+        self._last_flush = 0.0
+
+    def __call__(self, page: int, text: str) -> None:
+        self._parts.setdefault(page, []).append(text)
+        if time.monotonic() - self._last_flush >= TOKEN_FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self) -> None:
+        for page in sorted(self._parts):
+            event_bus.publish(self.job_id, {
+                'event': 'delta',
+                'data': {'page': page, 'delta': ''.join(self._parts[page]), 'status': 'delta'}
+            })
+        self._parts.clear()
+        self._last_flush = time.monotonic()
+
+
+def _report(job_id: str) -> bool:
+    # Scheduler, cache and timing counters live in this process; copy them
+    # onto the job so /status can report them from any API process.
+    metrics.flush()
+    return job_store.update(
+        job_id,
+        heartbeat=time.time(),
+        **job_status(job_id),
+        cache=summary_cache.job_stats(job_id),
+        timings=metrics.job_stats(job_id),
+    )
+
+
+async def _heartbeat(job_id: str, run: asyncio.Task) -> None:
+    while True:
+        await asyncio.sleep(WORKER_HEARTBEAT_SECONDS)
+        if not _report(job_id):
+            print(f"Job {job_id} was removed, stopping it")
+            run.cancel()
+            return
+
+
+async def run_job(job_id: str, job: Dict) -> None:
+    # Pages already published by an earlier (crashed) attempt are not
+    # published again; the checkpoint lets the workflow skip their work too.
+    after_page = job.get('pages_done', 0)
+    if after_page:
+        print(f"Resuming job {job_id} after page {after_page}")
+
+    stream_tokens = job.get('stream_tokens')
+    deltas = _DeltaPublisher(job_id) if (TOKEN_STREAMING if stream_tokens is None else stream_tokens) else None
+
+    async def process():
+        total_pages = job.get('total_pages')
+        pages_done = after_page
+        async for summary_data in stream_pdf_summaries(
+            job['path'], job_id, job['priority'], job.get('pipelined'), job['fingerprint'], after_page, deltas
+        ):
+            if deltas is not None:
+                deltas.flush()
+            event_bus.publish(job_id, {'event': 'summary', 'data': summary_data})
+            if summary_data['status'] == 'processing':
+                # Kept on the job for /status, batch progress and resuming,
+                # so none of them scans the event log. Written after the
+                # publish: a page counted here is always in the log.
+                pages_done = max(pages_done, summary_data['page'])
+                total_pages = summary_data.get('total_pages')
+                job_store.update(job_id, total_pages=total_pages, pages_done=pages_done)
+            if summary_data['status'] == 'complete':
+                job_store.transition(job_id, STATUS_COMPLETE, (STATUS_PROCESSING,),
+                                     saved_file=summary_data.get('saved_file'),
+                                     total_pages=summary_data.get('total_pages'), pages_done=pages_done)
+                break
+
+    run = asyncio.ensure_future(process())
+    heartbeat = asyncio.ensure_future(_heartbeat(job_id, run))
+    try:
+        await run
+        print(f"Completed job {job_id}")
+    except asyncio.CancelledError:
+        # Swallow only the cancellation _heartbeat issued for a removed job.
+        if not heartbeat.done() or heartbeat.cancelled():
+            raise
+        discard_pages(job_id)
+    except Exception as e:
+        print(f"Error in job {job_id}: {str(e)}")
+        event_bus.publish(job_id, {'event': 'error', 'data': {'error': str(e), 'status': 'error'}})
+        job_store.transition(job_id, STATUS_ERROR, (STATUS_PROCESSING,))
+        discard_pages(job_id)
+    finally:
+        heartbeat.cancel()
+        # A worker stopped mid-job leaves the file for the one resuming it.
+        release_pages(job_id)
+        _report(job_id)
+        summary_cache.forget_job(job_id)
+        metrics.forget_job(job_id)
+        if job.get('batch_id'):
+            # Keeps the batch record alive as long as its documents are.
+            job_store.update(job['batch_id'], touched=time.time())
+
+
+async def _claim_loop(worker_id: str, parent_pid: int) -> None:
+    while True:
+        if parent_pid and os.getppid() != parent_pid:
+            return
+        claimed = job_store.claim_next(worker_id, WORKER_STALE_SECONDS)
+        if claimed is None:
+            await asyncio.sleep(WORKER_POLL_SECONDS)
+            continue
+        job_id, job = claimed
+        print(f"Worker {worker_id} picked up job {job_id}")
+        await run_job(job_id, job)
+
+
+async def _fill_loop(worker_id: str, parent_pid: int, extra_jobs: int) -> None:
+    # Claims jobs beyond the fixed claim loops, one per poll, while both LLM
+    # queues have slots nobody is waiting for.
+    running = set()
+    try:
+        while True:
+            if parent_pid and os.getppid() != parent_pid:
+                return
+            await asyncio.sleep(WORKER_POLL_SECONDS)
+            if len(running) >= extra_jobs or not (scheduler.idle_slots() and refine_scheduler.idle_slots()):
+                continue
+            claimed = job_store.claim_next(worker_id, WORKER_STALE_SECONDS)
+            if claimed is None:
+                continue
+            job_id, job = claimed
+            print(f"Worker {worker_id} picked up job {job_id} for idle LLM slots")
+            task = asyncio.ensure_future(run_job(job_id, job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    finally:
+        for task in running:
+            task.cancel()
+
+
+async def serve(parent_pid: int = 0, jobs_per_worker: int = JOBS_PER_WORKER,
+                max_jobs: int = WORKER_MAX_JOBS) -> None:
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"Worker {worker_id} started ({jobs_per_worker}-{max(jobs_per_worker, max_jobs)} concurrent jobs)")
+    loops = [_claim_loop(worker_id, parent_pid) for _ in range(jobs_per_worker)]
+    if max_jobs > jobs_per_worker:
+        loops.append(_fill_loop(worker_id, parent_pid, max_jobs - jobs_per_worker))
+    try:
+        await asyncio.gather(*loops)
+    finally:
+        await close_checkpoints()
+
+
+def share_llm_limits(workers: int) -> None:
+    # Each process has its own LLM queues and endpoint pools; with the limits
+    # divided, workers started together stay within the configured ones.
+    if workers <= 1:
+        return
+    queues = [scheduler] + ([refine_scheduler] if refine_scheduler is not scheduler else [])
+    for queue in queues:
+        queue.max_concurrency = max(1, queue.max_concurrency // workers)
+    pools = []
+    for pool in (draft_llm, refine_llm, fallback_llm):
+        if pool is not None and not any(pool is seen for seen in pools):
+            pools.append(pool)
+    for pool in pools:
+        for endpoint in pool.endpoints:
+            endpoint.max_concurrency = max(1, endpoint.max_concurrency // workers)
+
+
+def worker_main(parent_pid: int = 0, workers: int = 1) -> None:
+    share_llm_limits(workers)
+    try:
+        asyncio.run(serve(parent_pid))
+    except KeyboardInterrupt:
+        pass
+
+
+def start_workers(count: int = JOB_WORKERS) -> List[multiprocessing.Process]:
+    # spawn: workers must not inherit the API's event loop and threads. They
+    # are not daemonic because PDF extraction starts its own process pool.
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for _ in range(count):
+        process = context.Process(target=worker_main, args=(os.getpid(), count), name="docveil-worker")
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def stop_workers(processes: List[multiprocessing.Process], timeout: float = 10) -> None:
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join(timeout)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run DocVeil background workers")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS)
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        worker_main()
+    else:
+        workers = start_workers(args.workers)
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            stop_workers(workers)
@@ -1,32 +1,57 @@
+import os
+import json
+import time
 import asyncio
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_ollama import ChatOllama
 from langchain_core.prompts import PromptTemplate
 from langgraph.graph import START, END, StateGraph
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.encrypted import EncryptedSerializer
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
 from pydantic import BaseModel
-from typing import List, Dict, AsyncGenerator
+from typing import Callable, List, Dict, AsyncGenerator, Optional, Sequence, Tuple
+from langchain_core.runnables import RunnableConfig
 from helper_function import *
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from encryption import decrypt_file_to_memory, is_encrypted_file
-from pypdf import PdfReader
-
-
-
-llm = ChatOllama(
-    model="llama3.1:8b",
-    temperature=0.3
-)
+from encryption import is_encrypted_file, CheckpointCipher
+from extraction import PageStream
+from scheduler import refine_scheduler, PRIORITY_INTERACTIVE
+from cache import summary_cache, make_key
+from metrics import metrics
+from backends import draft_llm, refine_llm
+import batching
+from batching import PageBatcher, split_text
+from pagestore import page_store, discard_pages, KIND_TEXT, KIND_DRAFT, KIND_REFINED
+
+
+
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "false").lower() == "true"
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", "cache/checkpoints.db")
+PAGE_WINDOW = int(os.getenv("PAGE_WINDOW", "16"))
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Pages are refined in windows of REFINE_WINDOW, all pages of a window in
+# parallel. Each page sees its previous page's draft plus a rolling digest of
+# the document before its window, kept under REFINE_MEMORY_TOKENS. The serial
+# part of refinement is one digest update per window, not one call per page.
+REFINE_WINDOW = int(os.getenv("REFINE_WINDOW", "8"))
+REFINE_MEMORY_TOKENS = int(os.getenv("REFINE_MEMORY_TOKENS", "400"))
+# Finished summaries are written here as <pdf name>_summary_<timestamp>.txt.
+SUMMARY_OUTPUT_DIR = os.getenv("SUMMARY_OUTPUT_DIR", "summaries_output")
+
+cpu_pool = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="docveil-cpu")
 
 
 REFINE_PROMPT = PromptTemplate(
-    input_variables=["previous", "current"],
+    input_variables=["memory", "previous", "current"],
     template=(
         "You are refining a document summary page by page.\n\n"
+        "What the document has covered so far:\n{memory}\n\n"
         "Previous page summary (for context):\n{previous}\n\n"
         "Current page summary:\n{current}\n\n"
         "Provide an improved version of the current page summary that is clearer, more detailed, "
-        "and consistent with the previous context. Do NOT repeat the previous page.\n\n"
+        "and consistent with the document so far and the previous page. "
+        "Do NOT repeat earlier pages.\n\n"
         "IMPORTANT formatting rules:\n"
         "- Start with a brief heading in bold: **Topic/Heading**\n"
         "- Then provide numbered points: (1), (2), (3), (4), (5), etc. - as many as needed\n"
@@ -38,81 +63,234 @@ REFINE_PROMPT = PromptTemplate(
     ),
 )
 
+MEMORY_PROMPT = PromptTemplate(
+    input_variables=["memory", "summaries", "words"],
+    template=(
+        "You keep a running digest of a long document that is read page by page.\n\n"
+        "Current digest:\n{memory}\n\n"
+        "Summaries of the pages that follow:\n{summaries}\n\n"
+        "Rewrite the digest so it covers the whole document so far in at most {words} words: "
+        "its subject, the sections seen so far and the key names, terms and figures. "
+        "When space runs short, shorten what is said about earlier pages first.\n\n"
+        "Output ONLY the digest, as plain sentences."
+    ),
+)
+
+# Digest text before the first window has been read.
+EMPTY_MEMORY = "(start of the document)"
+
 
 class State(BaseModel):
+    # Page text, drafts and refined pages live in the job's page store,
+    # addressed by index; State only holds positions, so a checkpoint or a
+    # node call costs the same at page 10 as at page 1000.
     pdf_path: str
+    job_id: str = 'default'
+    priority: int = PRIORITY_INTERACTIVE
     total_page: int = 0
-    page_text: List[str] = []
-    page_summaries: List[str] = []
-    refined_summaries: List[str] = []
     current_page_index: int = 0
+    memory: str = ''
 
 
-def load_pdf(state: State) -> Dict:
-    pdf_path = state.pdf_path
-    
+def _extract_pages(pdf_path: str, job_id: str = 'default') -> Dict:
     if is_encrypted_file(pdf_path):
-        print(f"Decrypting PDF to memory: {pdf_path}")
-        pdf_bytes = decrypt_file_to_memory(pdf_path)
-        
-        reader = PdfReader(pdf_bytes)
-        page_texts = []
-        for page_num, page in enumerate(reader.pages):
-            text = page.extract_text()
-            page_texts.append(text)
-        
-        print(f"Loaded encrypted PDF with {len(page_texts)} pages (in-memory)")
-        
-        return {
-            'total_page': len(page_texts),
-            'page_text': page_texts,
-        }
-    else:
-        loader = PyPDFLoader(pdf_path)
-        data = loader.load()
-        print(f"Loaded PDF with {len(data)} pages")
-        
-        return {
-            'total_page': len(data),
-            'page_text': [page.page_content for page in data],
-        }
-
-
-
-
-async def page_summaries(state: State) -> dict:
-    page_texts = state.page_text
-    tasks = [summery_asycn(page_contnet=page_text) for page_text in page_texts]
-    summaries = await asyncio.gather(*tasks)
+        print(f"Decrypting PDF on demand: {pdf_path}")
+    store = page_store(job_id)
+    with PageStream(pdf_path, job_id) as pages:
+        batch: List[str] = []
+        for index, page_text in enumerate(pages):
+            batch.append(page_text)
+            if len(batch) == PAGE_WINDOW:
+                store.put_many(KIND_TEXT, index + 1 - len(batch), batch)
+                batch = []
+        store.put_many(KIND_TEXT, pages.total - len(batch), batch)
+        total_page = pages.total
+    print(f"Loaded PDF with {total_page} pages")
+
+    return {'total_page': total_page}
+
+
+async def load_pdf(state: State) -> Dict:
+    # Decryption and pypdf parsing are CPU-bound; keep them off the event
+    # loop that also serves uploads, status checks and other SSE streams.
+    loop = asyncio.get_running_loop()
+    with metrics.span('node.load_pdf', state.job_id):
+        return await loop.run_in_executor(cpu_pool, _extract_pages, state.pdf_path, state.job_id)
+
+
+def _forward_tokens(on_token: Optional[Callable[[int, str], None]], page: int) -> Optional[Callable[[str], None]]:
+    if on_token is None:
+        return None
+    return lambda text: on_token(page, text)
+
+
+def _config_on_token(config: Optional[RunnableConfig]) -> Optional[Callable[[int, str], None]]:
+    # on_token travels in the run config rather than State, which is
+    # checkpointed and has to stay serializable.
+    return ((config or {}).get('configurable') or {}).get('on_token')
+
+
+async def page_summaries(state: State, config: RunnableConfig) -> dict:
+    # Short pages share calls and oversize pages are split; the batcher
+    # still yields one summary per page, in order. Page 1 is not refined,
+    # so its summary is the text the client watches. Drafts go to the page
+    # store as they finish, with at most PAGE_WINDOW of them outstanding.
+    store = page_store(state.job_id)
+    batcher = PageBatcher(
+        state.job_id, state.priority, summarize=summery_asycn,
+        on_token=_forward_tokens(_config_on_token(config), 1),
+    )
 
-    print(f"Generated {len(summaries)} page summaries")
+    async def keep(index: int, task: asyncio.Future) -> None:
+        store.put(KIND_DRAFT, index, await task)
+
+    running = set()
+    drafted = 0
+
+    def start(tasks: List[asyncio.Future]) -> None:
+        nonlocal drafted
+        for task in tasks:
+            running.add(asyncio.ensure_future(keep(drafted, task)))
+            drafted += 1
+
+    with metrics.span('node.page_summaries', state.job_id):
+        try:
+            for index in range(state.total_page):
+                start(batcher.add(store.get(KIND_TEXT, index)))
+                while len(running) >= PAGE_WINDOW:
+                    done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    running.difference_update(done)
+                    for task in done:
+                        task.result()
+            start(batcher.flush())
+            await asyncio.gather(*running)
+        except BaseException:
+            for task in running:
+                task.cancel()
+            raise
+
+    print(f"Generated {drafted} page summaries")
+
+    return {'current_page_index': 0}
+
+
+async def refined_summaries(state: State, config: RunnableConfig) -> dict:
+    start = state.current_page_index
+    end = min(start + REFINE_WINDOW, state.total_page)
+
+    store = page_store(state.job_id)
+    with metrics.span('node.refined_summaries', state.job_id):
+        refined, memory = await refine_window(
+            store.pages(KIND_DRAFT, state.total_page), start, end, state.memory, state.job_id, state.priority,
+            on_token=_config_on_token(config),
+        )
+        store.put_many(KIND_REFINED, start, refined)
+
+    print(f"Refined pages {start + 1}-{end}/{state.total_page}")
 
     return {
-        'page_summaries': summaries,
-        'current_page_index': 0
+        'current_page_index': end,
+        'memory': memory,
     }
 
 
-def refined_summaries(state: State) -> dict:
-    index = state.current_page_index
-    current_summary = state.page_summaries[index]
-    
-    if index == 0:
-        refined = [current_summary]
-    else:
-        previous = state.refined_summaries[-1]
-        chain = REFINE_PROMPT | llm
-        refined_content = chain.invoke(
-            {"previous": previous, "current": current_summary}
-        ).content
-        refined = [refined_content]
-
-    print(f"Refined page {index + 1}/{state.total_page}")
-
-    return {
-        'refined_summaries': state.refined_summaries + refined,
-        'current_page_index': index + 1,
+async def refine_page(
+    memory: str, previous: str, current: str, job_id: str, priority: int,
+    on_token: Optional[Callable[[str], None]] = None,
+) -> str:
+    memory = memory or EMPTY_MEMORY
+    key = make_key(
+        'refine', [memory, previous, current], REFINE_PROMPT.template, refine_llm.model, refine_llm.temperature
+    )
+    cached = summary_cache.get(key, job_id)
+    if cached is not None:
+        return cached
+
+    chain = REFINE_PROMPT | refine_llm
+    # Refinement is on the job's critical path, so it jumps ahead of the
+    # job's own queued page summaries (other jobs keep their turn).
+    queued = time.perf_counter()
+    async with refine_scheduler.slot(job_id, priority, front=True):
+        metrics.observe('llm.wait', time.perf_counter() - queued, job_id)
+        content = await run_chain(
+            chain, {"memory": memory, "previous": previous, "current": current}, on_token, 'llm.refine', job_id
+        )
+    summary_cache.put(key, content)
+    return content
+
+
+async def update_memory(memory: str, summaries: List[str], job_id: str, priority: int) -> str:
+    # Folds one window's draft summaries into the digest. Drafts rather than
+    # refined pages, so the next window's digest need not wait for this
+    # window's refinement.
+    inputs = {
+        'memory': memory or EMPTY_MEMORY,
+        'summaries': "\n\n".join(summaries),
+        'words': REFINE_MEMORY_TOKENS * 3 // 4,
     }
+    key = make_key(
+        'memory', [inputs['memory'], inputs['summaries']], MEMORY_PROMPT.template,
+        refine_llm.model, refine_llm.temperature
+    )
+    cached = summary_cache.get(key, job_id)
+    if cached is not None:
+        return cached
+
+    chain = MEMORY_PROMPT | refine_llm
+    queued = time.perf_counter()
+    async with refine_scheduler.slot(job_id, priority, front=True):
+        metrics.observe('llm.wait', time.perf_counter() - queued, job_id)
+        content = await run_chain(chain, inputs, None, 'llm.memory', job_id)
+    # Held to the budget even if the model ignores the word limit.
+    chunks = split_text(content.strip(), REFINE_MEMORY_TOKENS)
+    content = chunks[0] if chunks else memory
+    summary_cache.put(key, content)
+    return content
+
+
+async def refine_window(
+    page_summaries: Sequence[str], start: int, end: int, memory: str, job_id: str, priority: int,
+    on_token: Optional[Callable[[int, str], None]] = None,
+) -> Tuple[List[str], str]:
+    # Refines pages [start, end) and, alongside, builds the digest the next
+    # window needs. Page 1 is not refined.
+    async def refine(index: int) -> str:
+        if index == 0:
+            return page_summaries[0]
+        return await refine_page(
+            memory, page_summaries[index - 1], page_summaries[index], job_id, priority,
+            on_token=_forward_tokens(on_token, index + 1),
+        )
+
+    async def next_memory() -> str:
+        if end >= len(page_summaries):
+            return memory
+        return await update_memory(memory, page_summaries[start:end], job_id, priority)
+
+    results = await asyncio.gather(next_memory(), *(refine(index) for index in range(start, end)))
+    return list(results[1:]), results[0]
+
+
+async def _next_memory(previous: asyncio.Future, summaries: List[str], job_id: str, priority: int) -> str:
+    return await update_memory(await previous, summaries, job_id, priority)
+
+
+async def _refine_after(
+    memory: asyncio.Future, previous: str, current: str, job_id: str, priority: int,
+    on_token: Optional[Callable[[str], None]] = None,
+) -> str:
+    return await refine_page(await memory, previous, current, job_id, priority, on_token=on_token)
+
+
+async def refine_document(
+    page_summaries: Sequence[str], job_id: str = 'default', priority: int = PRIORITY_INTERACTIVE
+) -> List[str]:
+    refined, memory = [], ''
+    for start in range(0, len(page_summaries), REFINE_WINDOW):
+        end = min(start + REFINE_WINDOW, len(page_summaries))
+        window, memory = await refine_window(page_summaries, start, end, memory, job_id, priority)
+        refined += window
+    return refined
 
 
 def should_continue(state: State) -> str:
@@ -137,14 +315,61 @@ graph.add_conditional_edges(
 
 workflow = graph.compile()
 
-
-def save_summaries_to_file(refined_summaries: List[str], pdf_path: str) -> str:
-    output_dir = Path("summaries_output")
-    output_dir.mkdir(exist_ok=True)
+_checkpointed_workflow = None
+
+
+async def checkpointed_workflow():
+    # Same graph with a checkpoint of State after every node, keyed by job,
+    # so an interrupted run resumes instead of starting from load_pdf. The
+    # async saver is bound to the running loop, hence the lazy compile.
+    global _checkpointed_workflow
+    loop = asyncio.get_running_loop()
+    if _checkpointed_workflow is None or _checkpointed_workflow[0] is not loop:
+        serde = EncryptedSerializer(
+            CheckpointCipher(), JsonPlusSerializer(allowed_msgpack_modules=[(State.__module__, 'State')])
+        )
+        try:
+            import aiosqlite
+            from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+        except ImportError:
+            print("langgraph-checkpoint-sqlite not installed, checkpoints are kept in memory only")
+            saver = InMemorySaver(serde=serde)
+        else:
+            Path(CHECKPOINT_PATH).parent.mkdir(parents=True, exist_ok=True)
+            saver = AsyncSqliteSaver(aiosqlite.connect(CHECKPOINT_PATH), serde=serde)
+            await saver.setup()
+        _checkpointed_workflow = (loop, graph.compile(checkpointer=saver))
+    return _checkpointed_workflow[1]
+
+
+async def close_checkpoints() -> None:
+    global _checkpointed_workflow
+    if _checkpointed_workflow is not None:
+        conn = getattr(_checkpointed_workflow[1].checkpointer, 'conn', None)
+        if conn is not None:
+            await conn.close()
+        _checkpointed_workflow = None
+
+
+async def forget_checkpoints(job_id: str) -> None:
+    app = await checkpointed_workflow()
+    await app.checkpointer.adelete_thread(job_id)
+    discard_pages(job_id)
+
+
+def save_summaries_to_file(refined_summaries: Sequence[str], pdf_path: str) -> str:
+    output_dir = Path(SUMMARY_OUTPUT_DIR)
+    output_dir.mkdir(parents=True, exist_ok=True)
     
     pdf_name = Path(pdf_path).stem
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     output_file = output_dir / f"{pdf_name}_summary_{timestamp}.txt"
+    # Bulk runs finish same-named documents (from different folders) within
+    # the same second; neither may overwrite the other.
+    copy = 1
+    while output_file.exists():
+        copy += 1
+        output_file = output_dir / f"{pdf_name}_summary_{timestamp}_{copy}.txt"
     
     with open(output_file, 'w', encoding='utf-8') as f:
         f.write(f"PDF Summary: {pdf_name}\n")
@@ -161,45 +386,275 @@ def save_summaries_to_file(refined_summaries: List[str], pdf_path: str) -> str:
     return str(output_file)
 
 
-async def stream_pdf_summaries(pdf_path: str) -> AsyncGenerator[Dict, None]:
+def document_cache_key(fingerprint: str) -> str:
+    # Everything that shapes a document's summaries: every prompt, both
+    # models and temperatures, and the packing, splitting and window sizes.
+    models = draft_llm.model if draft_llm.model == refine_llm.model else f"{draft_llm.model}+{refine_llm.model}"
+    templates = [
+        SUMMARY_PROMPT.template, batching.BATCH_SUMMARY_PROMPT.template, batching.MERGE_PROMPT.template,
+        REFINE_PROMPT.template, MEMORY_PROMPT.template,
+    ]
+    settings = (
+        f"draft_temperature={draft_llm.temperature!r};refine_window={REFINE_WINDOW};"
+        f"refine_memory_tokens={REFINE_MEMORY_TOKENS};page_batch_max_pages={batching.PAGE_BATCH_MAX_PAGES};"
+        f"page_batch_small_tokens={batching.PAGE_BATCH_SMALL_TOKENS};page_batch_tokens={batching.PAGE_BATCH_TOKENS};"
+        f"page_split_tokens={batching.PAGE_SPLIT_TOKENS}"
+    )
+    return make_key('document', [fingerprint], "\0".join(templates + [settings]), models, refine_llm.temperature)
+
+
+def remember_document(fingerprint: Optional[str], refined_summaries: Sequence[str]) -> None:
+    if fingerprint:
+        summary_cache.put(document_cache_key(fingerprint), json.dumps(list(refined_summaries)))
+
+
+def is_known_document(fingerprint: str) -> bool:
+    return summary_cache.get(document_cache_key(fingerprint)) is not None
+
+
+async def replay_summaries(
+    refined_summaries: List[str], pdf_path: str, after_page: int = 0
+) -> AsyncGenerator[Dict, None]:
+    total_page = len(refined_summaries)
+    for index, summary in enumerate(refined_summaries[after_page:], after_page):
+        yield {
+            'page': index + 1,
+            'total_pages': total_page,
+            'summary': summary,
+            'status': 'processing'
+        }
+
+    saved_file = save_summaries_to_file(refined_summaries, pdf_path)
+
+    yield {
+        'page': total_page,
+        'total_pages': total_page,
+        'summary': '',
+        'status': 'complete',
+        'saved_file': saved_file
+    }
+
+
+async def stream_pdf_summaries(
+    pdf_path: str,
+    job_id: str = 'default',
+    priority: int = PRIORITY_INTERACTIVE,
+    pipelined: Optional[bool] = None,
+    fingerprint: Optional[str] = None,
+    after_page: int = 0,
+    on_token: Optional[Callable[[int, str], None]] = None,
+) -> AsyncGenerator[Dict, None]:
+    # after_page: pages the client already has (SSE Last-Event-ID); they are
+    # not sent again. on_token(page, text): streamed model output for the
+    # page currently being written, before its final event.
+    if fingerprint and not summary_cache.is_refreshing(job_id):
+        cached = summary_cache.get(document_cache_key(fingerprint))
+        if cached is not None:
+            print(f"Replaying stored summaries for duplicate document {fingerprint[:12]}")
+            async for summary_data in replay_summaries(json.loads(cached), pdf_path, after_page):
+                yield summary_data
+            return
+
+    if pipelined is None:
+        pipelined = PIPELINE_MODE
+    if pipelined:
+        async for summary_data in stream_pdf_summaries_pipelined(
+            pdf_path, job_id, priority, fingerprint, after_page, on_token
+        ):
+            yield summary_data
+        return
+
     initial_state = State(
         pdf_path=pdf_path,
+        job_id=job_id,
+        priority=priority,
         total_page=0,
-        page_text=[],
-        page_summaries=[],
-        refined_summaries=[],
         current_page_index=0
     )
 
-    current_state = initial_state
-    
-    async for event in workflow.astream(initial_state):
+    app = await checkpointed_workflow()
+    config = {'configurable': {'thread_id': job_id, 'on_token': on_token}}
+    snapshot = await app.aget_state(config)
+    store = page_store(job_id)
+
+    if snapshot.next:
+        # Interrupted run: continue from the last finished node. Pages that
+        # were refined but never delivered are sent from the page store.
+        resumed = State(**snapshot.values)
+        graph_input = None
+        total_page, refined = resumed.total_page, resumed.current_page_index
+        print(f"Resuming job {job_id} before {snapshot.next} ({refined} pages refined)")
+        for index in range(after_page, refined):
+            yield {
+                'page': index + 1,
+                'total_pages': total_page,
+                'summary': store.get(KIND_REFINED, index),
+                'status': 'processing'
+            }
+    else:
+        # Leftovers of an earlier run under this id belong to no checkpoint.
+        discard_pages(job_id)
+        store = page_store(job_id)
+        graph_input = initial_state
+        total_page, refined = 0, 0
+
+    # Sync durability: the checkpoint is on disk before the page is sent, so
+    # a client that reconnects right away still finds it.
+    async for event in app.astream(graph_input, config, durability='sync'):
         for node_name, node_output in event.items():
-            current_state = State(
-                pdf_path=current_state.pdf_path,
-                total_page=node_output.get('total_page', current_state.total_page),
-                page_text=node_output.get('page_text', current_state.page_text),
-                page_summaries=node_output.get('page_summaries', current_state.page_summaries),
-                refined_summaries=node_output.get('refined_summaries', current_state.refined_summaries),
-                current_page_index=node_output.get('current_page_index', current_state.current_page_index)
-            )
-            
-            if 'refined_summaries' in node_output and node_output['refined_summaries']:
-                page_num = len(current_state.refined_summaries)
+            total_page = node_output.get('total_page', total_page)
+            if node_name != 'refined_summaries':
+                continue
+            # A refine step finishes a whole window of pages.
+            end = node_output['current_page_index']
+            for index in range(max(refined, after_page), end):
                 yield {
-                    'page': page_num,
-                    'total_pages': current_state.total_page,
-                    'summary': current_state.refined_summaries[-1],
+                    'page': index + 1,
+                    'total_pages': total_page,
+                    'summary': store.get(KIND_REFINED, index),
                     'status': 'processing'
                 }
-    
-    saved_file = save_summaries_to_file(current_state.refined_summaries, pdf_path)
-    
+            refined = end
+
+    summaries = store.pages(KIND_REFINED, total_page)
+    remember_document(fingerprint, summaries)
+    await app.checkpointer.adelete_thread(job_id)
+    saved_file = save_summaries_to_file(summaries, pdf_path)
+    discard_pages(job_id)
+
     yield {
-        'page': current_state.total_page,
-        'total_pages': current_state.total_page,
+        'page': total_page,
+        'total_pages': total_page,
         'summary': '',
         'status': 'complete',
         'saved_file': saved_file
     }
 
+
+async def stream_pdf_summaries_pipelined(
+    pdf_path: str,
+    job_id: str = 'default',
+    priority: int = PRIORITY_INTERACTIVE,
+    fingerprint: Optional[str] = None,
+    after_page: int = 0,
+    on_token: Optional[Callable[[int, str], None]] = None,
+) -> AsyncGenerator[Dict, None]:
+    # Same two stages as the graph, without the barriers between them: pages
+    # are summarized as soon as they are extracted, and page N is refined as
+    # soon as drafts N-1 and N and the digest for its window exist. Digests
+    # are chained window to window ahead of the refine calls.
+    loop = asyncio.get_running_loop()
+    pages = await loop.run_in_executor(cpu_pool, PageStream, pdf_path, job_id)
+    total_page = pages.total
+    page_iter = iter(pages)
+
+    # At most PAGE_WINDOW pages are extracted ahead of the refine stage, which
+    # bounds memory and keeps extraction from racing far ahead of the LLM.
+    window: asyncio.Queue = asyncio.Queue(maxsize=PAGE_WINDOW)
+
+    async def produce():
+        try:
+            batcher = PageBatcher(job_id, priority, summarize=summery_asycn,
+                                  on_token=_forward_tokens(on_token, 1))
+            while True:
+                page_text = await loop.run_in_executor(cpu_pool, next, page_iter, None)
+                if page_text is None:
+                    break
+                for task in batcher.add(page_text):
+                    await window.put(task)
+            for task in batcher.flush():
+                await window.put(task)
+        except Exception as error:
+            # Hand extraction errors to the consumer in page order.
+            failed = loop.create_future()
+            failed.set_exception(error)
+            await window.put(failed)
+            return
+        await window.put(None)
+
+    # Refine calls in page order, also bounded by PAGE_WINDOW.
+    refines: asyncio.Queue = asyncio.Queue(maxsize=PAGE_WINDOW)
+
+    async def schedule():
+        # Only the current window's drafts are kept; the digest covers the rest.
+        window_drafts: List[str] = []
+        memory = loop.create_future()
+        memory.set_result('')
+        try:
+            for index in range(total_page):
+                task = await window.get()
+                if task is None:
+                    break
+                draft = await task
+                if index == 0:
+                    refine = loop.create_future()
+                    refine.set_result(draft)
+                else:
+                    if index % REFINE_WINDOW == 0:
+                        memory = asyncio.ensure_future(_next_memory(memory, window_drafts, job_id, priority))
+                        window_drafts = []
+                    refine = asyncio.ensure_future(_refine_after(
+                        memory, previous, draft, job_id, priority, _forward_tokens(on_token, index + 1),
+                    ))
+                window_drafts.append(draft)
+                previous = draft
+                await refines.put(refine)
+        except Exception as error:
+            failed = loop.create_future()
+            failed.set_exception(error)
+            await refines.put(failed)
+            return
+        await refines.put(None)
+
+    # Refined pages go to the page store rather than a list, so the
+    # summaries written out at the end are never all in memory during the run.
+    discard_pages(job_id)
+    store = page_store(job_id)
+    producer = asyncio.ensure_future(produce())
+    scheduler_task = asyncio.ensure_future(schedule())
+    refined = 0
+
+    try:
+        for index in range(total_page):
+            task = await refines.get()
+            if task is None:
+                break
+            refined_content = await task
+            store.put(KIND_REFINED, index, refined_content)
+            refined += 1
+
+            print(f"Refined page {index + 1}/{total_page}")
+
+            # Pages a resumed client already has are recomputed from the
+            # summary cache, not the LLM, and are not sent again.
+            if index < after_page:
+                continue
+
+            yield {
+                'page': index + 1,
+                'total_pages': total_page,
+                'summary': refined_content,
+                'status': 'processing'
+            }
+    finally:
+        producer.cancel()
+        scheduler_task.cancel()
+        for queue in (window, refines):
+            while not queue.empty():
+                task = queue.get_nowait()
+                if task is not None:
+                    task.cancel()
+        pages.close()
+
+    summaries = store.pages(KIND_REFINED, refined)
+    remember_document(fingerprint, summaries)
+    saved_file = save_summaries_to_file(summaries, pdf_path)
+    discard_pages(job_id)
+
+    yield {
+        'page': total_page,
+        'total_pages': total_page,
+        'summary': '',
+        'status': 'complete',
+        'saved_file': saved_file
+    }